@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""Compare copying files with a `cp` subprocess per file (the previous
+action of bioscons.fileutils.copyfile) and in-process with
+bioscons.fileutils.copy_file.
+
+usage: python dev/bench_copyfile.py [-n NFILES] [-s SIZE_KB]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bioscons.fileutils import copy_file, COPY_MODES
+
+
+def shell_cp(src, dst):
+    subprocess.check_call('cp {} {}'.format(src, dst), shell=True)
+
+
+def bench(label, copy, fnames, outdir):
+    start = time.perf_counter()
+    for fname in fnames:
+        copy(fname, os.path.join(outdir, os.path.basename(fname)))
+    elapsed = time.perf_counter() - start
+    print('{:<16} {:>8.0f} files/s'.format(label, len(fnames) / elapsed))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--nfiles', type=int, default=1000)
+    parser.add_argument('-s', '--size', type=int, default=64,
+                        help='file size in KB [%(default)s]')
+    args = parser.parse_args(arguments)
+
+    with tempfile.TemporaryDirectory(dir='.') as tmpdir:
+        indir = os.path.join(tmpdir, 'in')
+        os.mkdir(indir)
+        fnames = []
+        for i in range(args.nfiles):
+            fname = os.path.join(indir, '{}.txt'.format(i))
+            with open(fname, 'wb') as f:
+                f.write(os.urandom(args.size * 1024))
+            fnames.append(fname)
+
+        bench('cp subprocess', shell_cp, fnames, tmpdir)
+        for mode in COPY_MODES:
+            try:
+                bench('copy_file ' + mode,
+                      lambda src, dst: copy_file(src, dst, mode),
+                      fnames, tmpdir)
+            except OSError as err:
+                print('{:<16} {}'.format('copy_file ' + mode, err))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
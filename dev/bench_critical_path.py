@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+"""Simulate the makespan of a synthetic build when ready commands are
+started in the order they become ready (approximating scons) and in
+order of decreasing longest remaining path
+(bioscons.scheduling.longest_paths).
+
+The build has SAMPLES per-sample pipelines of 1 to 4 steps with
+log-normally distributed runtimes, feeding into a few long
+aggregation chains.
+
+usage: python dev/bench_critical_path.py [-n SAMPLES] [-j SLOTS ...]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+from bioscons import scheduling
+
+
+def build_dag(nsamples, nchains, rng):
+    deps, runtimes = {}, {}
+    finals = []
+    for i in range(nsamples):
+        prev = None
+        for step in range(rng.randint(1, 4)):
+            target = 's{}.{}'.format(i, step)
+            deps[target] = [prev] if prev else []
+            runtimes[target] = rng.lognormvariate(3, 1)
+            prev = target
+        finals.append(prev)
+
+    # aggregation chains, each depending on a subset of samples
+    for c in range(nchains):
+        prev = None
+        for step in range(10):
+            target = 'chain{}.{}'.format(c, step)
+            deps[target] = [prev] if prev else rng.sample(
+                finals, max(len(finals) // 20, 1))
+            runtimes[target] = rng.lognormvariate(5, 0.5)
+            prev = target
+
+    # declaration order is randomized, as scons does not sort by cost
+    items = list(deps.items())
+    rng.shuffle(items)
+    return dict(items), runtimes
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--samples', type=int, default=2000)
+    parser.add_argument('-c', '--chains', type=int, default=4)
+    parser.add_argument('-j', '--slots', type=int, nargs='+',
+                        default=[16, 64, 256])
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(arguments)
+
+    deps, runtimes = build_dag(args.samples, args.chains,
+                               random.Random(args.seed))
+
+    start = time.perf_counter()
+    paths = scheduling.longest_paths(deps, runtimes)
+    elapsed = time.perf_counter() - start
+    print('{} targets; longest path {:.0f} s; '
+          'longest_paths took {:.3f} s'.format(
+              len(deps), max(paths.values()), elapsed))
+
+    print('{:>6} {:>12} {:>12} {:>8}'.format(
+        'slots', 'fifo', 'critical', 'speedup'))
+    for slots in args.slots:
+        fifo = scheduling.makespan(
+            scheduling.simulate(deps, runtimes, slots))
+        critical = scheduling.makespan(
+            scheduling.simulate(deps, runtimes, slots, priority=paths))
+        print('{:>6} {:>12.0f} {:>12.0f} {:>8.2f}'.format(
+            slots, fifo, critical, fifo / critical))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
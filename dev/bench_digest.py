@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""Measure throughput and peak memory of bioscons.fileutils.file_digest,
+and scaling of file_digests with the number of workers.
+
+usage: python dev/bench_digest.py [-s SIZE_MB] [-a ALGORITHM ...] [-j JOBS ...]
+"""
+
+import argparse
+import hashlib
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from bioscons.fileutils import file_digest, file_digests, CHUNKSIZE
+
+
+def whole_file_md5(fname):
+    """The previous implementation: read the entire file, then hash."""
+    with open(fname, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def maxrss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def bench(label, fn, fname, size_mb):
+    start, rss = time.perf_counter(), maxrss_mb()
+    fn(fname)
+    elapsed = time.perf_counter() - start
+    print('{:<24} {:>8.1f} MB/s  {:>8.1f} MB peak RSS growth'.format(
+        label, size_mb / elapsed, maxrss_mb() - rss))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-s', '--size', type=int, default=512,
+                        help='size of test file in MB [%(default)s]')
+    parser.add_argument('-a', '--algorithms', nargs='+',
+                        default=['md5', 'sha256', 'blake2b'])
+    parser.add_argument('-c', '--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('-j', '--jobs', type=int, nargs='+',
+                        default=[1, 2, 4, 8],
+                        help='worker counts for file_digests %(default)s')
+    parser.add_argument('-n', '--nfiles', type=int, default=16,
+                        help='number of files for file_digests [%(default)s]')
+    args = parser.parse_args(arguments)
+
+    with tempfile.NamedTemporaryFile() as tmp:
+        block = os.urandom(1024 * 1024)
+        for __ in range(args.size):
+            tmp.write(block)
+        tmp.flush()
+
+        # streaming runs first so that peak RSS growth is attributable
+        for algorithm in args.algorithms:
+            bench('file_digest ' + algorithm,
+                  lambda f: file_digest(f, algorithm, args.chunksize),
+                  tmp.name, args.size)
+        bench('whole-file md5', whole_file_md5, tmp.name, args.size)
+
+    # each file is 1/nfiles of --size so the total is comparable
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fnames = [os.path.join(tmpdir, str(i)) for i in range(args.nfiles)]
+        for fname in fnames:
+            with open(fname, 'wb') as f:
+                f.write(os.urandom(args.size * 1024 * 1024 // args.nfiles))
+
+        for jobs in args.jobs:
+            for processes in (False, True):
+                start = time.perf_counter()
+                file_digests(fnames, jobs=jobs, processes=processes)
+                elapsed = time.perf_counter() - start
+                print('file_digests jobs={:<3} {:<9} {:>8.1f} MB/s'.format(
+                    jobs, 'processes' if processes else 'threads',
+                    args.size / elapsed))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
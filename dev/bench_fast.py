@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Time no-op rebuilds of a synthetic graph of NTARGETS targets using
+each profile of bioscons.fast.fast (and without calling fast).
+
+Each target is built from an input file and the previous target in
+its chain by a python function, and is scanned for implicit
+dependencies (#include lines) to include the cost of scanning. The
+inputs are created with old timestamps, as for large immutable
+inputs. Builds are run in a temporary directory using the scons
+executable on PATH; the fastest of --repeat no-op builds is reported.
+
+usage: python dev/bench_fast.py [-n NTARGETS] [-p PROFILE ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from bioscons.fast import PROFILES
+
+SCONSTRUCT = """
+import os
+from bioscons.fast import fast
+
+env = Environment(ENV=os.environ)
+if ARGUMENTS['profile'] != 'none':
+    fast(env, ARGUMENTS['profile'])
+
+
+def build(target, source, env):
+    with open(str(target[0]), 'w') as f:
+        f.write(str(source[0]) + '\\n')
+
+
+include = Scanner(
+    lambda node, env, path: [
+        env.File('#' + line.split()[1]) for line in node.get_text_contents().splitlines()
+        if line.startswith('#include')],
+    skeys=['.in'])
+env.Append(SCANNERS=include)
+
+n, length = int(ARGUMENTS['n']), 10
+for i in range(n):
+    chain, j = divmod(i, length)
+    sources = ['inputs/{}/{}.in'.format(chain // 100, i)]
+    if j:
+        sources.append('out/{}/{}.txt'.format(chain // 100, i - 1))
+    env.Command('out/{}/{}.txt'.format(chain // 100, i), sources, build)
+"""
+
+
+def setup(dirname, ntargets):
+    with open(os.path.join(dirname, 'SConstruct'), 'w') as f:
+        f.write(SCONSTRUCT)
+    old = time.time() - 30 * 24 * 3600
+    os.makedirs(os.path.join(dirname, 'inputs', 'common'))
+    common = os.path.join(dirname, 'inputs', 'common', 'header.h')
+    with open(common, 'w') as f:
+        f.write('header\n')
+    os.utime(common, (old, old))
+    for i in range(ntargets):
+        d = os.path.join(dirname, 'inputs', str(i // 1000))
+        os.makedirs(d, exist_ok=True)
+        fname = os.path.join(d, '{}.in'.format(i))
+        with open(fname, 'w') as f:
+            f.write('#include inputs/common/header.h\n' + 'x' * 1000)
+        os.utime(fname, (old, old))
+
+
+def scons(dirname, args):
+    start = time.perf_counter()
+    subprocess.run(['scons', '-Q'] + args, cwd=dirname, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntargets', type=int, default=100000)
+    parser.add_argument('-p', '--profiles', nargs='+',
+                        default=['none'] + list(PROFILES))
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args(arguments)
+
+    fmt = '{:<12} {:>10} {:>10}'
+    print(fmt.format('profile', 'build', 'no-op'))
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as dirname:
+            setup(dirname, args.ntargets)
+            scons_args = ['n={}'.format(args.ntargets),
+                          'profile={}'.format(profile)]
+            build = scons(dirname, scons_args)
+            noop = min(scons(dirname, scons_args)
+                       for __ in range(args.repeat))
+            print(fmt.format(profile, '{:.1f}s'.format(build),
+                             '{:.1f}s'.format(noop)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Time a full build and a no-op rebuild of NTARGETS SlurmEnvironment
+targets, with and without the memoized _SlurmAction.get_presig. Both
+the elapsed time of each build and the time spent in get_presig
+(which is a small fraction of the total) are reported.
+
+Commands are not run: SPAWN is replaced by a function creating the
+target named at the end of each command, so that the times reflect
+the overhead of scons and bioscons. Builds are run in a temporary
+directory using the scons executable on PATH.
+
+usage: python dev/bench_presig.py [-n NTARGETS] [-j JOBS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SCONSTRUCT = """
+import atexit
+import os
+import time
+
+import SCons.Subst
+from bioscons import slurm
+
+if ARGUMENTS.get('memo') == '0':
+    def get_presig(self, target, source, env, executor=None):
+        return env.subst_target_source(
+            self.presig_cmd, SCons.Subst.SUBST_SIG, target, source)
+else:
+    get_presig = slurm._SlurmAction.get_presig
+
+presig_time = [0, 0.0]
+
+
+def timed_presig(*args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return get_presig(*args, **kwargs)
+    finally:
+        presig_time[0] += 1
+        presig_time[1] += time.perf_counter() - start
+
+
+slurm._SlurmAction.get_presig = timed_presig
+atexit.register(lambda: print('presig', *presig_time))
+
+
+def spawn(sh, escape, cmd, args, env):
+    # args are the words of: srun ... sh -c 'touch target'
+    target = args[-1].strip("'")
+    open(target, 'w').close()
+    return 0
+
+
+env = slurm.SlurmEnvironment(ENV={'PATH': os.environ['PATH']},
+                             SPAWN=spawn, out='output')
+for i in range(int(ARGUMENTS['n'])):
+    env.SRun('$out/{}/{}.txt'.format(i // 1000, i), 'input.txt',
+             'touch $TARGET', ncores=2)
+"""
+
+
+def scons(dirname, args):
+    """Return the elapsed time, number of calls to get_presig and time
+    spent in get_presig
+
+    """
+
+    start = time.perf_counter()
+    proc = subprocess.run(['scons', '-Q'] + args, cwd=dirname, check=True,
+                          stdout=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.perf_counter() - start
+    __, calls, presig = proc.stdout.splitlines()[-1].split()
+    return elapsed, int(calls), float(presig)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntargets', type=int, default=100000)
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    args = parser.parse_args(arguments)
+
+    fmt = '{:<10} {:<6} {:>9} {:>9} {:>11}'
+    print(fmt.format('get_presig', '', 'elapsed', 'calls', 'presig'))
+    for memo in ['1', '0']:
+        with tempfile.TemporaryDirectory() as dirname:
+            with open(os.path.join(dirname, 'SConstruct'), 'w') as f:
+                f.write(SCONSTRUCT)
+            with open(os.path.join(dirname, 'input.txt'), 'w') as f:
+                f.write('input\n')
+            scons_args = ['-j', str(args.jobs), 'n={}'.format(args.ntargets),
+                          'memo={}'.format(memo)]
+            for label in ['build', 'no-op']:
+                elapsed, calls, presig = scons(dirname, scons_args)
+                print(fmt.format(
+                    'memoized' if memo == '1' else 'original', label,
+                    '{:.1f}s'.format(elapsed), calls,
+                    '{:.2f}s'.format(presig)))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+"""Benchmark SlurmEnvironment builds of synthetic dependency graphs
+using the stand-in slurm commands in tests/fakeslurm.
+
+For each number of targets, reports:
+
+* parse - seconds to read the SConstruct (``scons -h``)
+* dispatch - targets built per second with trivial commands and no
+  queue latency, for each launcher
+* makespan - seconds to build with commands sleeping for --sleep
+  seconds and a queue latency of --latency seconds (skipped unless
+  --makespan is given, as it is slow for large builds)
+
+The graph has --width targets per layer; each target depends on two
+targets in the layer before it. Builds are run in a temporary
+directory using the scons executable on PATH.
+
+usage: python dev/bench_slurm.py [-n NTARGETS ...] [-j JOBS] [--makespan]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+FAKESLURM = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, 'tests', 'fakeslurm')
+
+SCONSTRUCT = """
+import os
+from bioscons.slurm import SlurmEnvironment
+
+n, width = int(ARGUMENTS['n']), int(ARGUMENTS['width'])
+options = eval(ARGUMENTS.get('options', '{}'))
+env = SlurmEnvironment(ENV=os.environ, **options)
+action = 'sleep {} && cat $SOURCES > $TARGET'.format(
+    ARGUMENTS.get('sleep', 0))
+for i in range(n):
+    layer, j = divmod(i, width)
+    if layer:
+        prev = layer - 1
+        sources = ['out/{}/{}.txt'.format(prev, j),
+                   'out/{}/{}.txt'.format(prev, (j + 1) % width)]
+    else:
+        sources = ['input.txt']
+    env.SRun('out/{}/{}.txt'.format(layer, j), sources, action)
+"""
+
+# launchers compared, as SlurmEnvironment keyword arguments
+MODES = [
+    ('srun', {}),
+    ('max_in_flight', {'max_in_flight': 256}),
+    ('allocation', {'allocation_size': 64}),
+    ('batch', {'batch_size': 100, 'batch_wait': 0.5}),
+]
+
+
+def scons(dirname, args, env):
+    """Return the seconds taken to run scons with ``args``"""
+
+    start = time.perf_counter()
+    subprocess.run(['scons', '-Q'] + args, cwd=dirname, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def setup(dirname):
+    with open(os.path.join(dirname, 'SConstruct'), 'w') as f:
+        f.write(SCONSTRUCT)
+    with open(os.path.join(dirname, 'input.txt'), 'w') as f:
+        f.write('input\n')
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntargets', type=int, nargs='+',
+                        default=[1000, 10000])
+    parser.add_argument('-w', '--width', type=int, default=100)
+    parser.add_argument('-j', '--jobs', type=int, default=64)
+    parser.add_argument('-m', '--modes', nargs='+',
+                        choices=[name for name, __ in MODES],
+                        default=[name for name, __ in MODES])
+    parser.add_argument('--makespan', action='store_true',
+                        help='also measure makespan')
+    parser.add_argument('--sleep', type=float, default=0.1)
+    parser.add_argument('--latency', default='0.5,2')
+    args = parser.parse_args(arguments)
+
+    fmt = '{:>8} {:<14} {:>8} {:>10} {:>10}'
+    print(fmt.format('targets', 'launcher', 'parse', 'dispatch', 'makespan'))
+    for ntargets in args.ntargets:
+        for name, options in MODES:
+            if name not in args.modes:
+                continue
+            with tempfile.TemporaryDirectory() as dirname:
+                env = dict(
+                    os.environ,
+                    PATH=FAKESLURM + os.pathsep + os.environ['PATH'],
+                    FAKESLURM_STATE=os.path.join(dirname, 'state'),
+                    FAKESLURM_PYTHON=sys.executable)
+                setup(dirname)
+                scons_args = ['-j', str(args.jobs),
+                              'n={}'.format(ntargets),
+                              'width={}'.format(args.width),
+                              'options={!r}'.format(options)]
+
+                parse = scons(dirname, scons_args + ['-h'], env)
+                elapsed = scons(dirname, scons_args, env)
+                makespan = ''
+                if args.makespan:
+                    env['FAKESLURM_LATENCY'] = args.latency
+                    # changing the command rebuilds every target
+                    makespan = '{:.1f}s'.format(scons(
+                        dirname,
+                        scons_args + ['sleep={}'.format(args.sleep)], env))
+                print(fmt.format(
+                    ntargets, name, '{:.1f}s'.format(parse),
+                    '{:.0f}/s'.format(ntargets / elapsed), makespan))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
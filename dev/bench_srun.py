@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""Compare time and memory used to declare targets with
+SlurmEnvironment.SRun and with the previous implementation, which
+cloned the environment for each call requesting ncores, timelimit or
+slurm_queue. Each implementation is run in a separate process; peak
+RSS is reported for the whole process.
+
+usage: python dev/bench_srun.py [-n NTARGETS]
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+import time
+
+from bioscons.slurm import SlurmEnvironment
+
+
+def clone_srun(env, target, source, action, ncores=1, timelimit=None,
+               slurm_queue=None, **kw):
+    """SRun as previously implemented, with resources provided as
+    environment variables of a cloned environment
+
+    """
+
+    if ncores > 1 or timelimit or slurm_queue:
+        env = env.Clone()
+        if ncores > 1:
+            env.SetCpusPerTask(ncores)
+        if timelimit:
+            env.SetTimeLimit(timelimit)
+        if slurm_queue:
+            env.SetPartition(slurm_queue)
+    return env._SlurmCommand(target, source, action, 'srun', **kw)
+
+
+def declare(impl, ntargets):
+    env = SlurmEnvironment(ENV={'PATH': '/usr/bin:/bin'})
+    if impl == 'clone':
+        srun = lambda *args, **kw: clone_srun(env, *args, **kw)  # noqa
+    else:
+        srun = env.SRun
+
+    start = time.perf_counter()
+    for i in range(ntargets):
+        srun('out/{}.txt'.format(i), None, 'sort $SOURCE > $TARGET',
+             ncores=4, timelimit='1:00:00')
+    elapsed = time.perf_counter() - start
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('{:<8} {:>8.1f} MB  {:>6.2f} s'.format(
+        impl, maxrss / 1024, elapsed))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntargets', type=int, default=100000)
+    parser.add_argument('--impl', choices=['clone', 'srun'],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args(arguments)
+
+    if args.impl:
+        declare(args.impl, args.ntargets)
+    else:
+        for impl in ['clone', 'srun']:
+            subprocess.run([sys.executable, __file__, '-n',
+                            str(args.ntargets), '--impl', impl], check=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
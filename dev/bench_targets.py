@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""Compare memory and time used to register build targets with
+Targets.update (as when reading an SConstruct) and as a set of
+strings (the previous implementation of Targets.targets). The targets
+are SCons File nodes, created before measuring; the registry is also
+measured after compact(), which is called by Targets.iter_extras.
+
+usage: python dev/bench_targets.py [-n NTARGETS] [-s SAMPLES] [-l LAYOUT]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+
+from SCons.Environment import Environment
+
+from bioscons.fileutils import Targets
+
+
+def paths(ntargets, nsamples, layout):
+    """Generate per-sample output paths like output/s000001/step.1.txt
+    (layout 'shared') or output/s000001/s000001.1.txt (layout 'unique')
+
+    """
+
+    per_sample = max(ntargets // nsamples, 1)
+    for i in range(ntargets):
+        sample = 's{:06d}'.format(i // per_sample)
+        prefix = 'step' if layout == 'shared' else sample
+        yield 'output/{}/{}.{}.txt'.format(sample, prefix, i % per_sample)
+
+
+def string_set(nodes):
+    return set(str(node) for node in nodes)
+
+
+def targets(nodes):
+    t = Targets()
+    t.update(nodes)
+    return t.targets
+
+
+def compacted(nodes):
+    registry = targets(nodes)
+    registry.compact()
+    return registry
+
+
+def bench(label, build, nodes):
+    # time and memory are measured separately; tracemalloc is slow
+    start = time.perf_counter()
+    obj = build(nodes)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for node in nodes:
+        assert str(node) in obj
+    lookup = time.perf_counter() - start
+    del obj
+
+    tracemalloc.start()
+    obj = build(nodes)
+    size, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('{:<24} {:>8.1f} MB  build {:>6.2f} s  lookup {:>6.2f} s'.format(
+        label, size / 1024 ** 2, elapsed, lookup))
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--ntargets', type=int, default=1000000)
+    parser.add_argument('-s', '--samples', type=int, default=10000)
+    parser.add_argument('-l', '--layout', choices=['shared', 'unique'],
+                        default='shared',
+                        help='file names shared among sample directories '
+                        'or unique to each [%(default)s]')
+    args = parser.parse_args(arguments)
+
+    env = Environment(tools=[])
+    nodes = [env.File(pth)
+             for pth in paths(args.ntargets, args.samples, args.layout)]
+    # the string representation of a node is cached by SCons
+    for node in nodes:
+        str(node)
+
+    bench('set(str)', string_set, nodes)
+    bench('Targets.update', targets, nodes)
+    bench('Targets.update, compact', compacted, nodes)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,325 @@
+"""
+A content-addressed cache of derived files shared among checkouts.
+
+When a cache is enabled (``SlurmEnvironment(cache='/shared/cache')``),
+the outputs of each command are stored after it succeeds, keyed on a
+digest of its presignature (the command with construction variables
+substituted, see ``_SlurmAction.get_presig``), the paths of its
+targets relative to the top of the build, and the content signatures
+of its sources and other dependencies. A later build of the same
+command with the same inputs, in this or any other checkout,
+retrieves the outputs from the cache instead of running the command.
+
+Outputs are retrieved by copying (which clones the file on
+filesystems supporting reflinks) or, with ``mode='hardlink'``, by
+creating hard links, which requires that targets are never modified
+in place. Entries are stored as directories named by their key,
+created atomically so that concurrent builds may share a cache.
+
+If ``max_size`` is provided, the least recently used entries are
+removed when scons exits until the total size of the cache is within
+the limit. Each lookup is recorded in ``log.jsonl`` in the cache
+directory; summarize the hit rate with::
+
+  python -m bioscons.cache report /shared/cache
+
+or remove entries with::
+
+  python -m bioscons.cache evict /shared/cache --max-size 500G
+"""
+
+import argparse
+import atexit
+import collections
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from bioscons.fileutils import copy_file
+
+LOG_FILE = 'log.jsonl'
+META_FILE = 'meta.json'
+
+
+def parse_size(size):
+    """Return the number of bytes given ``size``, either an integer
+    or a string with an optional suffix K, M, G or T (eg '500G').
+
+    """
+
+    if isinstance(size, int):
+        return size
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$', size, re.I)
+    if not match:
+        raise ValueError('invalid size "{}"'.format(size))
+    number, suffix = match.groups()
+    return int(float(number) * 1024 ** ' KMGT'.index(suffix.upper() or ' '))
+
+
+class DerivedCache(object):
+    """
+    Stores and retrieves the targets of commands in ``directory``
+    (see the module documentation). ``mode`` is 'copy', 'reflink' or
+    'hardlink' (see ``bioscons.fileutils.copy_file``). ``max_size``
+    (bytes, or a string such as '500G') limits the total size of the
+    cache.
+    """
+
+    def __init__(self, directory, mode='copy', max_size=None):
+        if mode not in ('copy', 'reflink', 'hardlink'):
+            raise ValueError('mode must be one of copy, reflink, hardlink')
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.mode = mode
+        self.max_size = None if max_size is None else parse_size(max_size)
+        self.stats = collections.Counter()
+        # keys of entries already retrieved by this process, so that
+        # each step of a command with several actions does not copy
+        # the targets again
+        self.retrieved = set()
+        self.lock = threading.Lock()
+        self._evict_at_exit = False
+
+    def key(self, target, executor):
+        """Return the key for the command run by ``executor`` building
+        ``target`` (a list of nodes), or None if any target is not a
+        file.
+
+        """
+
+        import SCons.Node.FS
+        if not target or not all(
+                isinstance(t, SCons.Node.FS.File) for t in target):
+            return None
+        h = hashlib.sha256()
+        h.update(executor.get_contents())
+        for t in target:
+            h.update(b'\0' + t.get_path().encode())
+        for child in target[0].children():
+            h.update(b'\0' + str(child.get_csig()).encode())
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, 'entries', key[:2], key)
+
+    def record(self, event, key, target, name=None, size=None):
+        """Append a line describing a lookup or store to the log"""
+
+        rec = {'time': time.time(), 'event': event, 'key': key,
+               'target': str(target[0]), 'name': name, 'size': size,
+               'cwd': os.getcwd()}
+        line = json.dumps(rec) + '\n'
+        with self.lock:
+            self.stats[event] += 1
+            try:
+                # a single write in append mode, so that lines from
+                # concurrent builds are not interleaved
+                with open(os.path.join(self.directory, LOG_FILE), 'a') as f:
+                    f.write(line)
+            except OSError:
+                pass
+
+    def retrieve(self, key, target, name=None):
+        """Copy the cached files for ``key`` to ``target`` (a list of
+        nodes), returning True if successful.
+
+        """
+
+        if key in self.retrieved:
+            return True
+
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, META_FILE)) as f:
+                meta = json.load(f)
+            if len(meta['targets']) != len(target):
+                raise ValueError('wrong number of targets')
+            for i, t in enumerate(target):
+                copy_file(os.path.join(entry, str(i)), str(t), self.mode)
+            # the modification time of the metadata records use
+            os.utime(os.path.join(entry, META_FILE))
+        except (OSError, ValueError, KeyError):
+            self.record('miss', key, target, name)
+            return False
+
+        with self.lock:
+            self.retrieved.add(key)
+        self.record('hit', key, target, name, meta.get('size'))
+        return True
+
+    def store(self, key, target, name=None):
+        """Add the files in ``target`` (a list of nodes) to the cache
+        as ``key``.
+
+        """
+
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+        tmpdir = os.path.join(self.directory, 'tmp')
+        os.makedirs(tmpdir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=key[:8], dir=tmpdir)
+        try:
+            size = 0
+            for i, t in enumerate(target):
+                fname = os.path.join(tmp, str(i))
+                copy_file(str(t), fname, self.mode)
+                size += os.path.getsize(fname)
+            with open(os.path.join(tmp, META_FILE), 'w') as f:
+                json.dump({'targets': [str(t) for t in target],
+                           'name': name, 'size': size,
+                           'created': time.time()}, f)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            # fails if another build stored the same entry
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.record('store', key, target, name, size)
+        if self.max_size is not None:
+            with self.lock:
+                if not self._evict_at_exit:
+                    self._evict_at_exit = True
+                    atexit.register(self.evict)
+
+    def evict(self, max_size=None):
+        """Remove the least recently used entries until the total size
+        of the cache is at most ``max_size`` (default ``self.max_size``).
+        Returns a tuple (entries removed, bytes removed).
+
+        """
+
+        max_size = self.max_size if max_size is None else parse_size(max_size)
+        entries = list(iter_entries(self.directory))
+        total = sum(size for __, __, size in entries)
+        removed = freed = 0
+        for used, entry, size in sorted(entries):
+            if max_size is None or total <= max_size:
+                break
+            # entries are renamed before removal so that they are not
+            # found by concurrent builds while partially removed
+            tmp = os.path.join(self.directory, 'tmp',
+                               'evict-' + os.path.basename(entry))
+            try:
+                os.rename(entry, tmp)
+            except OSError:
+                continue
+            shutil.rmtree(tmp, ignore_errors=True)
+            total -= size
+            removed += 1
+            freed += size
+        return removed, freed
+
+
+def iter_entries(directory):
+    """Yield a tuple (last used, path, size) for each entry in the
+    cache in ``directory``.
+
+    """
+
+    top = os.path.join(directory, 'entries')
+    if not os.path.isdir(top):
+        return
+    for prefix in os.scandir(top):
+        if not prefix.is_dir():
+            continue
+        for entry in os.scandir(prefix.path):
+            meta = os.path.join(entry.path, META_FILE)
+            try:
+                used = os.stat(meta).st_mtime
+                with open(meta) as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            yield used, entry.path, size
+
+
+def read_log(filename):
+    """Return a list of records in the log ``filename``"""
+
+    records = []
+    with open(filename) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def report(records, directory=None, out=None):
+    """Write the hit rate of lookups in ``records`` overall and for
+    each command name, and the size of the cache in ``directory`` if
+    provided, to ``out`` (default stdout).
+
+    """
+
+    out = out or sys.stdout
+    counts = collections.defaultdict(collections.Counter)
+    saved = 0
+    for rec in records:
+        counts[rec.get('name') or ''][rec['event']] += 1
+        counts[None][rec['event']] += 1
+        if rec['event'] == 'hit':
+            saved += rec.get('size') or 0
+
+    fmt = '{:>8} {:>8} {:>8} {:>8}  {}\n'
+    out.write(fmt.format('hits', 'misses', 'stores', 'hit_rate', 'name'))
+
+    def row(name, c):
+        lookups = c['hit'] + c['miss']
+        rate = '{:.2f}'.format(c['hit'] / lookups) if lookups else ''
+        out.write(fmt.format(c['hit'], c['miss'], c['store'], rate, name))
+
+    names = [n for n in counts if n is not None]
+    for name in sorted(names, key=lambda n: -sum(counts[n].values())):
+        row(name, counts[name])
+    row('(total)', counts[None])
+    out.write('\n{:.1f} MB retrieved from the cache\n'.format(saved / 1e6))
+
+    if directory:
+        entries = list(iter_entries(directory))
+        out.write('{} entries, {:.1f} MB\n'.format(
+            len(entries), sum(size for __, __, size in entries) / 1e6))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bioscons.cache', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    report_parser = subparsers.add_parser(
+        'report', help='summarize cache hits and misses')
+    report_parser.add_argument('directory')
+
+    evict_parser = subparsers.add_parser(
+        'evict', help='remove the least recently used entries')
+    evict_parser.add_argument('directory')
+    evict_parser.add_argument(
+        '--max-size', required=True,
+        help='maximum total size, eg 500G')
+
+    args = parser.parse_args(arguments)
+    if args.subcommand == 'report':
+        try:
+            records = read_log(os.path.join(args.directory, LOG_FILE))
+        except FileNotFoundError:
+            records = []
+        report(records, args.directory)
+    else:
+        removed, freed = DerivedCache(args.directory).evict(args.max_size)
+        print('removed {} entries ({:.1f} MB)'.format(removed, freed / 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,17 +3,202 @@ Some tips from http://www.scons.org/wiki/GoFastButton
 """
 import SCons
 
-def fast(env):
+from bioscons.fileutils import (
+    DigestCache, _digest_file, _read_digest, file_digest)
+
+# Settings applied by fast() for each profile. Keys are options
+# accepted by SetOption, plus:
+#
+# * decider - argument to env.Decider()
+# * sconsign_dbm - name of a module (eg 'dbm.gnu') for
+#   SConsignFile(dbm_module=...), used if it can be imported
+PROFILES = {
+    # the original behavior of fast()
+    'default': {
+        'implicit_cache': True,
+        'decider': 'MD5-timestamp',
+    },
+    # avoid hashing large inputs that are rarely modified
+    'large-files': {
+        'implicit_cache': True,
+        'decider': 'size-inode',
+        'max_drift': 1,
+        'hash_chunksize': 1024,
+    },
+    # skip as much work as possible in no-op builds of many targets
+    'huge-graph': {
+        'implicit_cache': True,
+        'implicit_deps_unchanged': True,
+        'decider': 'MD5-timestamp',
+        'max_drift': 1,
+        'diskcheck': 'none',
+        'hash_chunksize': 1024,
+        'sconsign_dbm': 'dbm.gnu',
+    },
+}
+
+
+def _previous_ninfo(dependency, node):
+    """Return the node info of ``dependency`` recorded when ``node``
+    was last built, or None. The same lookup is used by SCons'
+    MD5-timestamp decider, as the ``prev_ni`` passed to deciders may
+    belong to another dependency.
+
+    """
+    try:
+        binfo = node.get_stored_info().binfo
+        try:
+            dependency_map = binfo.dependency_map
+        except AttributeError:
+            dependency_map = dependency._build_dependency_map(binfo)
+        return dependency._get_previous_signatures(dependency_map)
+    except AttributeError:
+        return None
+
+
+class SizeInodeDecider(object):
+    """
+    A decider (see ``env.Decider``) for large source files that are
+    rarely modified but whose timestamps change, eg when copied with
+    rsync or restored from an archive. The digest of each file is
+    recorded in ``cache`` (a :class:`bioscons.fileutils.DigestCache`,
+    by default ``.bioscons_digests.sqlite``) along with its size,
+    modification time and inode, and is trusted without reading the
+    file if:
+
+    * the size, modification time and inode are unchanged (only a
+      stat call is required, as for the MD5-timestamp decider); or
+    * the size is unchanged and a digest file written by
+      :func:`bioscons.fileutils.write_digest` (eg, ``fname.md5``,
+      in ``dirname`` if provided) agrees with the recorded digest; or
+    * the size and inode are unchanged and there is no digest file
+      (ie, the file was touched).
+
+    Otherwise the file is hashed in blocks. A dependency has changed
+    if its digest differs from its content signature in the previous
+    build. The hash algorithm is the one used by SCons (see ``scons
+    --hash-format``), so digest files must use the same algorithm.
+    Targets built in the same project are handled by the usual
+    MD5-timestamp logic.
+
+    Note that a file modified in place without changing its size is
+    detected only if its digest file is updated (or removed).
+
+    Example usage::
+
+      env.Decider(SizeInodeDecider(dirname='refs/digests'))
+    """
+
+    def __init__(self, cache=None, dirname=None):
+        self.cache = cache
+        self.dirname = dirname
+
+    def digest(self, fname, st):
+        """Return the digest of ``fname`` given the result of
+        ``os.stat(fname)``, reading the file only if necessary.
+
+        """
+
+        algorithm = SCons.Util.get_current_hash_algorithm_used() or 'md5'
+        if self.cache is None:
+            self.cache = DigestCache()
+
+        entry = self.cache.entry(fname, algorithm)
+        digest = None
+        if entry is not None and entry[0] == st.st_size:
+            size, mtime_ns, inode, recorded = entry
+            if (mtime_ns, inode) == (st.st_mtime_ns, st.st_ino):
+                return recorded
+            sidecar = _read_digest(
+                _digest_file(fname, self.dirname, algorithm))
+            if sidecar == recorded or (
+                    sidecar is None and inode == st.st_ino):
+                digest = recorded
+
+        if digest is None:
+            digest = file_digest(fname, algorithm)
+        self.cache.set(fname, digest, algorithm, st)
+        return digest
+
+    def __call__(self, dependency, target, prev_ni, repo_node=None):
+        st = None if dependency.has_builder() else dependency.stat()
+        if st is None:
+            return dependency.changed_timestamp_then_content(
+                target, prev_ni, repo_node)
+
+        csig = self.digest(dependency.get_abspath(), st)
+        # recorded as the content signature without hashing again
+        dependency.get_ninfo().csig = csig
+        prev = _previous_ninfo(dependency, repo_node or dependency)
+        return csig != getattr(prev, 'csig', None)
+
+
+DECIDERS = {
+    'size-inode': SizeInodeDecider,
+}
+
+
+def fast(env, profile='default', **settings):
     """
     Given an :class:`SCons.Script.Environment`, set some flags for
-    faster builds:
+    faster builds. ``profile`` is one of the following:
+
+    * ``default`` - cache implicit dependencies and use the
+      MD5-timestamp decider (if timestamp unchanged, don't checksum)
+    * ``large-files`` - for large inputs that are rarely modified:
+      decide whether source files changed using
+      :class:`SizeInodeDecider`, which hashes a file only if its size,
+      inode or digest file changed (note that a file modified in place
+      without changing its size is not detected unless its digest
+      file is updated), trust the recorded checksum of any file with
+      an unchanged timestamp (``max_drift=1``) and hash files in 1 MB
+      chunks
+    * ``huge-graph`` - use the MD5-timestamp decider, cache implicit
+      dependencies and assume they are unchanged
+      (``implicit_deps_unchanged``; run ``scons
+      --implicit-deps-changed`` after editing a scanned file's
+      dependencies), skip checks for directories and files of the
+      same name (``diskcheck=none``) and, if the gdbm module is
+      available, store signatures in a ``.sconsign`` gdbm database
+      read and written per directory rather than in full.
+
+    Changing the signature database (``sconsign_dbm``) rebuilds
+    everything once.
+
+    The hash format is not changed: md5 is already the default and
+    fastest available, and setting ``hash_format`` renames the
+    signature database, rebuilding everything once.
 
-    * Caching of implicit dependencies
-    * Use MD5-timestamp decider (if timestamp unchanged, don't checksum)
-    * Clear the default environment. Requires use of
-      ``env.Command(...)``, rather than bare ``Command(...)``
+    Keyword arguments override values of the profile (see
+    ``PROFILES``); for example, ``sconsign_dbm=None`` keeps the
+    default ``.sconsign.dblite``, which is read and written in full,
+    and ``decider='size-inode'`` may be used with any profile. In all
+    cases the default environment is cleared, requiring use of
+    ``env.Command(...)``, rather than bare ``Command(...)``.
     """
-    # cache implicit dependencies
-    env.SetOption('implicit_cache', 1)
-    env.Decider('MD5-timestamp')
+    try:
+        options = dict(PROFILES[profile])
+    except KeyError:
+        raise ValueError('no profile named "{}"'.format(profile))
+    options.update(settings)
+
+    decider = options.pop('decider', None)
+    dbm_name = options.pop('sconsign_dbm', None)
+    for name, value in options.items():
+        if value is not None:
+            env.SetOption(name, value)
+
+    if decider:
+        decider = DECIDERS.get(decider, decider)
+        env.Decider(decider() if isinstance(decider, type) else decider)
+
+    # SConsignFile must follow SetOption('hash_format', ...)
+    if dbm_name:
+        try:
+            dbm_module = __import__(dbm_name, fromlist=['open'])
+        except ImportError:
+            pass
+        else:
+            env.SConsignFile(dbm_module=dbm_module)
+
     SCons.Defaults.DefaultEnvironment(tools = [])
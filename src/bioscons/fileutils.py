@@ -1,12 +1,206 @@
+import bisect
+import bz2
+import errno
+import gzip
 import hashlib
+import lzma
 import os
+import pickle
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, as_completed)
 from os import path
 
 try:
-    from SCons.Script import Flatten, Builder
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# size of the blocks read by file_digest
+CHUNKSIZE = 1024 * 1024
+
+# ioctl request to clone a file on copy-on-write filesystems (linux)
+FICLONE = 0x40049409
+
+COPY_MODES = ('copy', 'reflink', 'hardlink')
+
+# (leading bytes, format, file suffixes)
+COMPRESSION_FORMATS = [
+    (b'\x1f\x8b', 'gz', ('.gz', '.bgz')),
+    (b'BZh', 'bz2', ('.bz2',)),
+    (b'\xfd7zXZ\x00', 'xz', ('.xz',)),
+    (b'\x28\xb5\x2f\xfd', 'zst', ('.zst', '.zstd')),
+]
+
+# Multithreaded decompression programs for each format in order of
+# preference; '{threads}' is replaced with the number of threads.
+DECOMPRESSORS = {
+    'gz': [['pigz', '-p', '{threads}', '-dc']],
+    'bz2': [['lbzip2', '-n', '{threads}', '-dc'],
+            ['pbzip2', '-p{threads}', '-dc']],
+    'xz': [['xz', '-T', '{threads}', '-dc']],
+    'zst': [['zstd', '-T{threads}', '-dcq']],
+}
+
+
+class TargetRegistry(object):
+    """
+    A set of file paths stored compactly as {directory id: basenames}.
+
+    Each directory is stored once and basenames are interned. Calling
+    ``compact`` stores the basenames in each directory as a sorted
+    tuple shared among directories with identical contents (eg,
+    per-sample output directories). Supports ``add``, ``update``,
+    ``in``, ``len`` and iteration over the normalized paths.
+    """
+
+    def __init__(self, paths=()):
+        self._dirs = []       # normalized directory names, indexed by id
+        self._dir_ids = {}    # {directory name as given: id}
+        self._files = {}      # {directory id: set or sorted tuple}
+        # {directory name as given: self._files[id]}, so that adding a
+        # path requires a single lookup; entries may refer to a tuple
+        # replaced since compact()
+        self._dir_files = {}
+        self._ancestors = set()
+        self._len = 0
+        self.update(paths)
+
+    def _dir_id(self, dirname, create=False):
+        dir_id = self._dir_ids.get(dirname)
+        if dir_id is None:
+            normalized = path.normpath(dirname) if dirname else ''
+            if normalized == os.curdir:
+                normalized = ''
+            dir_id = self._dir_ids.get(normalized)
+            if dir_id is None:
+                if not create:
+                    return None
+                dir_id = len(self._dirs)
+                self._dirs.append(normalized)
+                self._dir_ids[normalized] = dir_id
+                self._files[dir_id] = set()
+                ancestor = normalized
+                while ancestor not in self._ancestors:
+                    self._ancestors.add(ancestor)
+                    ancestor = path.dirname(ancestor)
+            self._dir_ids[dirname] = dir_id
+        return dir_id
+
+    def _split(self, pth):
+        dirname, basename = path.split(pth)
+        if basename in ('', '.', '..'):
+            dirname, basename = path.split(path.normpath(pth))
+        return dirname, basename
+
+    def _contains(self, files, basename):
+        if isinstance(files, tuple):
+            i = bisect.bisect_left(files, basename)
+            return i < len(files) and files[i] == basename
+        return basename in files
+
+    def _mutable_files(self, dirname):
+        """Return the set of basenames in ``dirname``, creating it or
+        replacing a tuple stored by ``compact`` if necessary.
+
+        """
+
+        dir_id = self._dir_id(dirname, create=True)
+        files = self._files[dir_id]
+        if isinstance(files, tuple):
+            files = self._files[dir_id] = set(files)
+        self._dir_files[dirname] = files
+        return files
+
+    def add(self, pth):
+        # faster than path.split(); the directory name is normalized
+        # by _dir_id when first seen
+        dirname, __, basename = pth.rpartition(os.sep)
+        if not dirname or basename in ('', '.', '..'):
+            dirname, basename = self._split(pth)
+        files = self._dir_files.get(dirname)
+        if files is None or files.__class__ is tuple:
+            files = self._mutable_files(dirname)
+        if basename not in files:
+            files.add(sys.intern(basename))
+            self._len += 1
+
+    def update(self, paths):
+        add = self.add
+        for pth in paths:
+            add(pth)
+
+    def compact(self):
+        """Store the basenames of each directory as a sorted tuple
+        shared among directories with identical contents.
+
+        """
+
+        shared = {}
+        for dir_id, files in self._files.items():
+            files = tuple(sorted(files))
+            self._files[dir_id] = shared.setdefault(files, files)
+        self._dir_files = {dirname: self._files[dir_id]
+                           for dirname, dir_id in self._dir_ids.items()}
+
+    def __contains__(self, pth):
+        dirname, basename = self._split(pth)
+        dir_id = self._dir_id(dirname)
+        return dir_id is not None and self._contains(
+            self._files[dir_id], basename)
+
+    def __iter__(self):
+        for dir_id, files in self._files.items():
+            dirname = self._dirs[dir_id]
+            for basename in files:
+                yield path.join(dirname, basename)
+
+    def __len__(self):
+        return self._len
+
+    def basenames(self, dirname):
+        """Return a set of the basenames in ``dirname`` (which must be
+        normalized).
+
+        """
+
+        dir_id = self._dir_ids.get(dirname)
+        if dir_id is None:
+            return frozenset()
+        return frozenset(self._files[dir_id])
+
+    def has_descendants(self, dirname):
+        """Return True if any path is in ``dirname`` or below."""
+        return dirname in self._ancestors
+
+
+try:
+    from SCons.Node import Node
+    from SCons.Script import Action, Builder
+    from SCons.Util import is_Sequence
 except ImportError:
     pass
 else:
+    def _copyfile_action(target, source, env):
+        (sname,) = list(map(str, source))
+        (tname,) = list(map(str, target))
+        copy_file(sname, tname, env.get('COPYFILE_MODE', 'copy'))
+
     def _copyfile_emitter(target, source, env):
         """
         target - name of file or directory
@@ -21,9 +215,13 @@ else:
 
         return target, source
 
+    # The copy is performed in-process by copy_file(); set the
+    # construction variable COPYFILE_MODE to 'reflink' or 'hardlink'
+    # to change the method (see COPY_MODES).
     copyfile = Builder(
         emitter=_copyfile_emitter,
-        action='cp $SOURCE $TARGET'
+        action=Action(_copyfile_action, 'copyfile $SOURCE $TARGET',
+                      varlist=['COPYFILE_MODE'])
     )
 
     def _bunzip2_emitter(target, source, env):
@@ -42,6 +240,36 @@ else:
         action = 'bunzip2 --keep $SOURCE'
         )
 
+    def _decompress_action(target, source, env):
+        (sname,) = list(map(str, source))
+        (tname,) = list(map(str, target))
+        threads = env.get('DECOMPRESS_THREADS')
+        decompress_file(sname, tname, int(threads) if threads else None)
+
+    def _decompress_emitter(target, source, env):
+        """
+        Decompress source file, keeping original.
+
+        target - name of source with the compression suffix removed,
+            unless a different name is given
+        source - file compressed with gzip, bzip2, xz or zstd
+        """
+
+        (sname,) = list(map(str, source))
+        (tname,) = list(map(str, target))
+        stripped = strip_compression_suffix(sname)
+        # an unknown suffix (eg, '.gzip') is removed by default
+        if tname == path.splitext(sname)[0] and stripped != sname:
+            tname = stripped
+        return tname, source
+
+    # Set the construction variable DECOMPRESS_THREADS to limit the
+    # number of threads used by each call (defaults to all cpus).
+    decompress = Builder(
+        emitter=_decompress_emitter,
+        action=Action(_decompress_action, 'decompress $SOURCE > $TARGET')
+    )
+
     class Targets(object):
         """
         Provides an object with methods for identifying objects in the
@@ -62,42 +290,291 @@ else:
         """
 
         def __init__(self, objs = None):
-            self.targets = self.update(objs) if objs else set()
+            self.targets = TargetRegistry()
+            if objs:
+                self.update(objs)
+
+        def _nodes(self, objs):
+            for obj in objs:
+                if isinstance(obj, Node):
+                    yield obj
+                elif is_Sequence(obj):
+                    yield from self._nodes(obj)
 
         def update(self, objs):
             """
-            Given a list of objects (eg, the output of ``locals().values()``),
-            update self.targets with the set containing the relative path
-            to each target (ie, those objects with a "NodeInfo"
-            attribute).
+            Given an iterable of objects (eg, the output of
+            ``locals().values()``), update self.targets (a
+            :class:`TargetRegistry`) with the relative path to each
+            target (ie, each SCons Node, including those within lists).
+            """
+
+            self.targets.update(str(node) for node in self._nodes(objs))
+
+        def _listdir(self, dirname, previous, current):
+            """
+            Return ``(files, subdirs)`` for ``dirname``, using the
+            listing in ``previous`` if the directory is unmodified
+            since it was recorded, and saving the listing to
+            ``current``. Symlinks to directories are skipped, as in
+            ``os.walk``.
             """
 
-            self.targets.update(
-                set(str(obj) for obj in Flatten(objs)
-                    if hasattr(obj, 'NodeInfo')))
+            mtime = os.stat(dirname or os.curdir).st_mtime_ns
+            listing = previous.get(dirname)
+            if listing is None or listing[0] != mtime:
+                files, subdirs = [], []
+                with os.scandir(dirname or os.curdir) as entries:
+                    for entry in entries:
+                        if not entry.is_dir():
+                            files.append(entry.name)
+                        elif not entry.is_symlink():
+                            subdirs.append(entry.name)
+                listing = (mtime, files, subdirs)
+
+            current[dirname] = listing
+            return listing[1:]
+
+        def iter_extras(self, directory, prune = False, snapshot = None):
+            """
+            Generate paths of files below ``directory`` not found among
+            ``self.targets``.
+
+            If ``prune`` is True, subdirectories containing no targets
+            are not searched; instead the directory itself is provided
+            (with a trailing slash). If ``snapshot`` names a file, the
+            listing of each directory is saved there once the search is
+            complete, and on subsequent searches only directories with
+            a modified mtime are read.
+            """
 
-        def show_extras(self, directory, one_line = True):
+            self.targets.compact()
+
+            previous, current = {}, {}
+            if snapshot and path.exists(snapshot):
+                with open(snapshot, 'rb') as f:
+                    previous = pickle.load(f)
+
+            # targets in the current directory have a dirname of ''
+            top = path.normpath(directory)
+            if not path.isdir(top):
+                return
+            stack = ['' if top == os.curdir else top]
+            while stack:
+                dirname = stack.pop()
+                try:
+                    names, subdirs = self._listdir(dirname, previous, current)
+                except (FileNotFoundError, NotADirectoryError):
+                    # removed during the search
+                    continue
+                known = self.targets.basenames(dirname)
+                for name in names:
+                    if name not in known:
+                        yield path.join(dirname, name)
+                for name in subdirs:
+                    subdir = path.join(dirname, name)
+                    if prune and not self.targets.has_descendants(subdir):
+                        yield subdir + os.sep
+                    else:
+                        stack.append(subdir)
+
+            if snapshot:
+                with open(snapshot, 'wb') as f:
+                    pickle.dump(current, f, pickle.HIGHEST_PROTOCOL)
+
+        def show_extras(self, directory, one_line = True, prune = False,
+                        snapshot = None):
             """
             Given a relative path ``directory`` search for files recursively
             and print a list of those not found among
             ``self.targets``. Print one path per line if ``one_line`` is
-            False.
+            False. See ``iter_extras`` for ``prune`` and ``snapshot``.
             """
 
-            outfiles = set(
-                Flatten([[path.join(d, f) for f in ff]
-                         for d, _, ff in os.walk(directory)]))
-
-            extras = outfiles - self.targets
+            extras = sorted(self.iter_extras(directory, prune, snapshot))
             if extras:
                 print('\nextraneous files in %s:' % directory)
                 if one_line:
-                    print('  ' + ' '.join(sorted(extras)))
+                    print('  ' + ' '.join(extras))
                 else:
-                    print('\n'.join(sorted(extras)))
+                    print('\n'.join(extras))
                 print()
 
 
+def _reflink(src, dst):
+    """Clone src to dst (both open file objects), raising OSError if
+    this is not supported.
+
+    """
+
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported')
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_contents(src, dst):
+    """Copy the contents of src to dst (both open file objects) within
+    the kernel if possible.
+
+    ``copy_file_range`` and ``sendfile`` may report end of file
+    without copying anything (eg, on FUSE filesystems or procfs), so
+    the next method is used unless the whole file was copied.
+    """
+
+    infd, outfd = src.fileno(), dst.fileno()
+    size = os.fstat(infd).st_size
+    for copy in (getattr(os, 'copy_file_range', None),
+                 getattr(os, 'sendfile', None)):
+        if copy is None:
+            continue
+        copied = 0
+        try:
+            while True:
+                if copy is os.sendfile:
+                    n = copy(outfd, infd, None, CHUNKSIZE * 64)
+                else:
+                    n = copy(infd, outfd, CHUNKSIZE * 64)
+                if not n:
+                    break
+                copied += n
+        except OSError as err:
+            # unsupported for these files
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+        else:
+            if copied and copied >= size:
+                return
+
+        # start over with the next method
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+
+    shutil.copyfileobj(src, dst, CHUNKSIZE)
+
+
+def copy_file(src, dst, mode='copy'):
+    """
+    Copy the file ``src`` to ``dst``, replacing ``dst`` if it exists,
+    without starting a subprocess. ``mode`` is one of:
+
+    * 'copy' - clone the file if the filesystem supports it (like
+      ``cp --reflink=auto``), and otherwise copy the contents using
+      ``os.copy_file_range`` or ``os.sendfile`` where available
+    * 'reflink' - clone the file, raising OSError if not supported
+    * 'hardlink' - create a hard link; appropriate only for inputs
+      that will not be modified. Falls back to 'copy' if src and dst
+      are on different filesystems.
+
+    Permission bits are copied from ``src``.
+    """
+
+    if mode not in COPY_MODES:
+        raise ValueError('mode must be one of {}'.format(', '.join(COPY_MODES)))
+
+    if path.lexists(dst):
+        os.unlink(dst)
+
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            try:
+                _reflink(s, d)
+            except OSError:
+                if mode == 'reflink':
+                    raise
+                _copy_contents(s, d)
+    except BaseException:
+        if path.lexists(dst):
+            os.unlink(dst)
+        raise
+
+    shutil.copymode(src, dst)
+
+
+def compression_format(fname):
+    """Return the compression format of ``fname`` ('gz', 'bz2', 'xz' or
+    'zst') identified by its leading bytes, or None if it is not
+    recognized.
+
+    """
+
+    with open(fname, 'rb') as f:
+        head = f.read(8)
+
+    for magic, fmt, __ in COMPRESSION_FORMATS:
+        if head.startswith(magic):
+            return fmt
+
+    return None
+
+
+def strip_compression_suffix(fname):
+    """Return ``fname`` without a trailing compression suffix (eg,
+    '.gz'), if present.
+
+    """
+
+    for __, __, suffixes in COMPRESSION_FORMATS:
+        for suffix in suffixes:
+            if fname.endswith(suffix):
+                return fname[:-len(suffix)]
+
+    return fname
+
+
+def _open_compressed(fname, fmt):
+    if fmt == 'gz':
+        return gzip.open(fname, 'rb')
+    elif fmt == 'bz2':
+        return bz2.open(fname, 'rb')
+    elif fmt == 'xz':
+        return lzma.open(fname, 'rb')
+    elif zstandard is None:
+        raise ValueError(
+            'decompressing {} requires zstd or the zstandard '
+            'package'.format(fname))
+    else:
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(fname, 'rb'), read_across_frames=True, closefd=True)
+
+
+def decompress_file(src, dst, threads=None, use_tools=True):
+    """
+    Decompress ``src`` to ``dst``, identifying the format using the
+    leading bytes of ``src``.
+
+    If ``use_tools`` is True, the first available program in
+    ``DECOMPRESSORS`` for the format is run with ``threads`` threads
+    (defaults to the number of cpus); otherwise, or if none is found,
+    the file is decompressed in-process in a streaming fashion.
+    """
+
+    fmt = compression_format(src)
+    if fmt is None:
+        raise ValueError('{} is not compressed using a recognized '
+                         'format'.format(src))
+
+    threads = threads or os.cpu_count()
+    for cmd in (DECOMPRESSORS[fmt] if use_tools else []):
+        if shutil.which(cmd[0]):
+            cmd = [arg.format(threads=threads) for arg in cmd] + [src]
+            with open(dst, 'wb') as out:
+                subprocess.run(cmd, stdout=out, check=True)
+            return
+
+    with _open_compressed(src, fmt) as f, open(dst, 'wb') as out:
+        shutil.copyfileobj(f, out, CHUNKSIZE)
+
+
 def rename(fname, ext=None, pth=None):
     """
     Replace the directory or file extension in ``fname`` with ``pth``
@@ -151,43 +628,327 @@ def split_path(fname, split_ext=False):
         return (directory, filename)
 
 
-def write_digest(fname, dirname=None):
-    """Save the md5 checksum of fname as fname.md5 in either the same
-    directory as fname or in dirname if provided.
+def _new_hash(algorithm):
+    """Return a new hash object for ``algorithm``, which may name any
+    algorithm provided by :mod:`hashlib` or, if the ``xxhash`` package
+    is installed, one of ``xxhash.algorithms_available``.
+
+    """
+
+    if xxhash and algorithm in xxhash.algorithms_available:
+        return getattr(xxhash, algorithm)()
+
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        raise ValueError('unsupported digest algorithm "%s"' % algorithm)
+
+
+def file_digest(fname, algorithm='md5', chunksize=CHUNKSIZE):
+    """Return the hex digest of the contents of ``fname``.
+
+    The file is read in blocks of ``chunksize`` bytes into a single
+    reusable buffer, so memory use is constant regardless of the size
+    of the file.
+
+    """
+
+    h = _new_hash(algorithm)
+    buf = bytearray(chunksize)
+    view = memoryview(buf)
+
+    with open(fname, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+
+    return h.hexdigest()
+
+
+class DigestCache(object):
+    """
+    Persistent cache of file digests stored in an sqlite database.
+
+    Digests are keyed on the absolute path of each file along with its
+    size, modification time (in ns) and inode, so a stored digest is
+    returned only if none of these have changed since it was
+    computed. At most ``max_entries`` digests are retained; when this
+    limit is exceeded the least recently used entries are discarded.
+
+    Example usage::
+
+      from bioscons.fileutils import DigestCache, check_digest
+      cache = DigestCache('output/.digests.sqlite')
+      if not check_digest('refs/nt.fasta', cache=cache):
+          ...
+    """
+
+    # check the number of entries after this many insertions
+    evict_interval = 1000
+
+    def __init__(self, filename='.bioscons_digests.sqlite',
+                 max_entries=100000):
+        self.filename = filename
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inserts = 0
+
+        dirname = path.dirname(filename)
+        if dirname and not path.isdir(dirname):
+            os.makedirs(dirname)
+
+        # autocommit; WAL avoids an fsync for every statement
+        self._db = sqlite3.connect(
+            filename, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS digests ('
+            'path TEXT, algorithm TEXT, size INTEGER, mtime_ns INTEGER, '
+            'inode INTEGER, digest TEXT, atime REAL, '
+            'PRIMARY KEY (path, algorithm))')
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS digests_atime ON digests (atime)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute(
+                'SELECT count(*) FROM digests').fetchone()[0]
+
+    def _key(self, fname, st=None):
+        st = st or os.stat(fname)
+        return path.abspath(fname), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, fname, algorithm='md5', st=None):
+        """Return the stored digest of ``fname``, or None if there is no
+        entry or the file has been modified since the digest was
+        stored. ``st`` is an optional result of ``os.stat(fname)``.
+
+        """
+
+        pth, size, mtime_ns, inode = self._key(fname, st)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT size, mtime_ns, inode, digest FROM digests '
+                'WHERE path = ? AND algorithm = ?',
+                (pth, algorithm)).fetchone()
+            if row is None or row[:3] != (size, mtime_ns, inode):
+                return None
+            self._db.execute(
+                'UPDATE digests SET atime = ? WHERE path = ? AND algorithm = ?',
+                (time.time(), pth, algorithm))
+        return row[3]
+
+    def entry(self, fname, algorithm='md5'):
+        """Return a tuple (size, mtime_ns, inode, digest) stored for
+        ``fname`` whether or not the file has since been modified, or
+        None if there is no entry.
+
+        """
+
+        with self._lock:
+            return self._db.execute(
+                'SELECT size, mtime_ns, inode, digest FROM digests '
+                'WHERE path = ? AND algorithm = ?',
+                (path.abspath(fname), algorithm)).fetchone()
+
+    def set(self, fname, digest, algorithm='md5', st=None):
+        """Store ``digest`` for the current state of ``fname``."""
+
+        pth, size, mtime_ns, inode = self._key(fname, st)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (pth, algorithm, size, mtime_ns, inode, digest, time.time()))
+            self._inserts += 1
+            if self._inserts % self.evict_interval == 0:
+                self._evict()
+
+    def digest(self, fname, algorithm='md5'):
+        """Return the digest of ``fname``, calculating and storing it
+        only if there is no valid entry in the cache.
+
+        """
+
+        st = os.stat(fname)
+        digest = self.get(fname, algorithm, st)
+        if digest is None:
+            digest = file_digest(fname, algorithm)
+            self.set(fname, digest, algorithm, st)
+        return digest
+
+    def _evict(self):
+        self._db.execute(
+            'DELETE FROM digests WHERE rowid IN ('
+            'SELECT rowid FROM digests ORDER BY atime DESC '
+            'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._db.close()
+
+
+def _digest_file(fname, dirname=None, algorithm='md5'):
+    """Return the name of the file containing the stored digest of
+    ``fname``, ie fname.<algorithm> in either the same directory as
+    fname or in dirname if provided.
 
     """
 
     bn, fn = path.split(fname)
-    hashfile = path.join(dirname or bn, fn + '.md5')
+    return path.join(dirname or bn, fn + '.' + algorithm)
+
+
+def _get_digest(fname, algorithm, cache):
+    if cache is None:
+        return file_digest(fname, algorithm)
+    return cache.digest(fname, algorithm)
 
-    with open(fname, 'rb') as f, open(hashfile, 'wb') as h:
-        m = hashlib.md5()
-        m.update(f.read())
-        digest = m.hexdigest()
+
+def write_digest(fname, dirname=None, algorithm='md5', cache=None):
+    """Save the checksum of fname as fname.<algorithm> (eg, fname.md5)
+    in either the same directory as fname or in dirname if
+    provided. ``algorithm`` is any name accepted by
+    :func:`file_digest`. If ``cache`` (a :class:`DigestCache`) is
+    provided, the digest is read from or added to the cache.
+
+    """
+
+    digest = _get_digest(fname, algorithm, cache)
+
+    with open(_digest_file(fname, dirname, algorithm), 'w') as h:
         h.write(digest)
 
     return digest
 
 
-def check_digest(fname, dirname=None):
+def check_digest(fname, dirname=None, algorithm='md5', cache=None):
     """Return True if the stored hash exists and is identical to the
     signature of the file ``fname``. Hash is saved to a file named
-    fname.md5 in either the same directory or in dirname if provided.
+    fname.<algorithm> (eg, fname.md5) in either the same directory or
+    in dirname if provided. If ``cache`` (a :class:`DigestCache`) is
+    provided, ``fname`` is read only if it has changed since its
+    digest was last cached.
 
     """
 
-    bn, fn = path.split(fname)
-    hashfile = path.join(dirname or bn, fn + '.md5')
+    stored = _read_digest(_digest_file(fname, dirname, algorithm))
+    return stored is not None and stored == _get_digest(fname, algorithm, cache)
 
-    with open(fname, 'rb') as f:
-        m = hashlib.md5()
-        m.update(f.read())
-        digest = m.hexdigest()
 
-    if path.exists(hashfile):
-        with open(hashfile, 'rb') as h:
-            same = h.read() == digest
-    else:
-        same = False
+def _read_digest(hashfile):
+    if not path.exists(hashfile):
+        return None
+
+    with open(hashfile) as h:
+        return h.read().strip()
+
+
+def file_digests(paths, algorithm='md5', jobs=None, cache=None,
+                 progress=None, processes=False):
+    """Return a dict of {path: digest} for each file in ``paths``,
+    hashing files concurrently using ``jobs`` workers (defaults to the
+    number of cpus).
+
+    Workers are threads (hashlib releases the GIL while hashing) unless
+    ``processes`` is True. Digests found in ``cache`` (a
+    :class:`DigestCache`) are used without reading the file; new
+    digests are added to the cache. If provided, ``progress`` is
+    called as ``progress(ndone, ntotal, path)`` as each file is
+    completed.
+
+    """
+
+    paths = list(dict.fromkeys(paths))
+    total = len(paths)
+    results = {}
+
+    def done(fname, digest):
+        results[fname] = digest
+        if progress:
+            progress(len(results), total, fname)
+
+    # cache lookups and updates stay in this thread so that the cache
+    # is usable with either threads or processes
+    todo = []
+    for fname in paths:
+        st = os.stat(fname)
+        digest = None if cache is None else cache.get(fname, algorithm, st)
+        if digest is None:
+            todo.append((fname, st))
+        else:
+            done(fname, digest)
+
+    if not todo:
+        return results
+
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = {pool.submit(file_digest, fname, algorithm): (fname, st)
+                   for fname, st in todo}
+        for future in as_completed(futures):
+            fname, st = futures[future]
+            digest = future.result()
+            if cache is not None:
+                cache.set(fname, digest, algorithm, st)
+            done(fname, digest)
+
+    return results
+
+
+def write_digests(paths, dirname=None, algorithm='md5', jobs=None,
+                  cache=None, progress=None, processes=False):
+    """Batch version of :func:`write_digest`: save the checksum of each
+    file in ``paths``, returning a dict of {path: digest}. See
+    :func:`file_digests` for the remaining arguments.
+
+    """
+
+    results = file_digests(paths, algorithm, jobs, cache, progress, processes)
+    for fname, digest in results.items():
+        with open(_digest_file(fname, dirname, algorithm), 'w') as h:
+            h.write(digest)
+
+    return results
+
+
+def check_digests(paths, dirname=None, algorithm='md5', jobs=None,
+                  cache=None, progress=None, processes=False):
+    """Batch version of :func:`check_digest`, returning a dict of {path:
+    bool}. Files without a stored hash are not read. See
+    :func:`file_digests` for the remaining arguments.
+
+    """
+
+    stored = {fname: _read_digest(_digest_file(fname, dirname, algorithm))
+              for fname in paths}
+    results = {fname: False for fname, digest in stored.items()
+               if digest is None}
+    digests = file_digests(
+        [fname for fname in stored if fname not in results],
+        algorithm, jobs, cache, progress, processes)
+    results.update((fname, stored[fname] == digest)
+                   for fname, digest in digests.items())
+
+    return results
+
+
+def print_progress(ndone, ntotal, fname, stream=sys.stderr):
+    """A ``progress`` callback for :func:`file_digests` and friends
+    that prints a running count to ``stream``.
+
+    """
 
-    return same
+    stream.write('\r{}/{} {}'.format(ndone, ntotal, fname)[:79].ljust(79))
+    if ndone == ntotal:
+        stream.write('\n')
+    stream.flush()
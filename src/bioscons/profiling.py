@@ -0,0 +1,355 @@
+"""
+Record where the time goes in a build: reading SConscript files,
+scanning for implicit dependencies, deciding whether targets are up
+to date, computing content signatures and running actions.
+
+Profiling is enabled by calling :func:`enable` at the top of the
+SConstruct, for example::
+
+  from bioscons import profiling
+  if ARGUMENTS.get('profile'):
+      profiling.enable(trace=ARGUMENTS['profile'], summary=True)
+
+Functions of SCons are replaced by wrappers measuring each call
+until scons exits, when a trace of the events is written in the
+Chrome trace event format (open it in https://ui.perfetto.dev or
+chrome://tracing) and a summary is printed. Events have one of the
+following categories:
+
+* ``phase`` - reading SConscript files (from the call to ``enable``)
+  and building targets
+* ``read`` - reading each SConscript file
+* ``scan`` - scanning a node for implicit dependencies
+* ``decide`` - deciding whether a node has changed since it was
+  last built (this includes computing signatures of its dependencies)
+* ``signature`` - computing the content signature of a file
+* ``execute`` - running the actions building a target, labeled with
+  the name of the builder: ``copyfile``, ``bunzip2`` or
+  ``decompress`` for the builders in :mod:`bioscons.fileutils`,
+  ``srun``, ``salloc`` or ``local`` for commands of a
+  :class:`bioscons.slurm.SlurmEnvironment`, otherwise the name of the
+  builder in ``env['BUILDERS']`` or the first word of the command
+* ``call`` - sampled calls to functions decorated with
+  :func:`bioscons.utils.verbose` while tracing is enabled
+
+Events of a category may contain others (eg, ``decide`` contains
+``signature``). Calls to scan, decide and signature shorter than
+``min_duration`` are counted in the totals but omitted from the
+trace. Summarize a trace again with::
+
+  python -m bioscons.profiling report trace.json
+"""
+
+import argparse
+import atexit
+import collections
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+CATEGORIES = ['read', 'scan', 'decide', 'signature', 'execute']
+
+# the profiler enabled by enable()
+_profiler = None
+
+
+def builder_name(executor):
+    """Return a label for the builder of the targets of ``executor``
+    (see the module documentation).
+
+    """
+
+    from bioscons import fileutils, slurm
+
+    actions = executor.get_action_list()
+    for action in actions:
+        if isinstance(action, slurm._SlurmAction):
+            return action.slurm_cmd or 'local'
+
+    targets = executor.get_all_targets()
+    builder = getattr(targets[0], 'builder', None) if targets else None
+    for name in ['copyfile', 'bunzip2', 'decompress']:
+        if builder is not None and builder is getattr(fileutils, name, None):
+            return name
+
+    try:
+        builders = executor.get_build_env()['BUILDERS']
+        return list(builders.keys())[list(builders.values()).index(builder)]
+    except (AttributeError, KeyError, TypeError, ValueError):
+        pass
+
+    # eg, env.Command(...)
+    words = str(actions[0]).split() if actions else []
+    return os.path.basename(words[0].split('(')[0]) if words else 'unknown'
+
+
+class Profiler(object):
+    """
+    Collects events from the functions of SCons replaced by
+    ``start()`` until ``stop()`` is called. Calls to scan, decide and
+    signature lasting less than ``min_duration`` seconds are counted
+    but not recorded as events.
+    """
+
+    def __init__(self, min_duration=0.001):
+        self.min_duration = min_duration
+        self.events = []
+        # category -> [calls, seconds, maximum seconds]
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.build_time = None
+        self.stop_time = None
+        self.threads = {}
+        self._patched = []
+
+    def now(self):
+        return time.perf_counter()
+
+    def add(self, category, start, duration, describe, args):
+        """Count a call lasting ``duration`` seconds; ``describe(*args)``
+        returns a tuple (name, dict of arguments) for the event.
+
+        """
+
+        with self.lock:
+            total = self.totals.setdefault(category, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+        if category in ('read', 'execute') or duration >= self.min_duration:
+            name, event_args = describe(*args)
+            self.event(category, name, start, duration, event_args)
+
+    def event(self, category, name, start, duration, args=None):
+        tid = threading.get_ident()
+        with self.lock:
+            tid = self.threads.setdefault(tid, len(self.threads) + 1)
+            self.events.append((category, name, start, duration, tid,
+                                args or {}))
+
+    def _wrap(self, owner, attr, category, describe):
+        original = owner.__dict__[attr]
+        add, now = self.add, self.now
+
+        @functools.wraps(original)
+        def wrapper(*args, **kwargs):
+            start = now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                add(category, start, now() - start, describe, args)
+
+        if isinstance(owner, types.ModuleType):
+            # SConscript() and Export() find the caller's namespace by
+            # skipping frames with the globals of their own module
+            wrapper = functools.wraps(original)(types.FunctionType(
+                wrapper.__code__, owner.__dict__, wrapper.__name__,
+                wrapper.__defaults__, wrapper.__closure__))
+
+        setattr(owner, attr, wrapper)
+        self._patched.append((owner, attr, original))
+
+    def start(self):
+        """Replace functions of SCons with wrappers recording events"""
+
+        import SCons.Executor
+        import SCons.Node
+        import SCons.Node.FS
+        import SCons.Script
+        import SCons.Taskmaster
+
+        self.start_time = self.now()
+
+        def read(fs, *files, **kw):
+            return ', '.join(str(f) for f in files), {}
+
+        def node(n, *args, **kw):
+            return str(n), {}
+
+        def execute(executor, *args, **kw):
+            targets = executor.get_all_targets()
+            return (str(targets[0]) if targets else '',
+                    {'builder': builder_name(executor),
+                     'targets': [str(t) for t in targets]})
+
+        # the module SCons.Script.SConscript (the package attribute of
+        # that name is the SConscript function)
+        self._wrap(SCons.Script._SConscript, '_SConscript', 'read', read)
+        self._wrap(SCons.Node.Node, 'scan', 'scan', node)
+        # File.changed calls Node.changed
+        self._wrap(SCons.Node.Node, 'changed', 'decide', node)
+        self._wrap(SCons.Node.FS.File, 'get_csig', 'signature', node)
+        self._wrap(SCons.Executor.Executor, '__call__', 'execute', execute)
+
+        # the build starts when the taskmaster is created
+        taskmaster = SCons.Taskmaster.Taskmaster
+        original = taskmaster.__dict__['__init__']
+
+        @functools.wraps(original)
+        def __init__(tm, *args, **kwargs):
+            if self.build_time is None:
+                self.build_time = self.now()
+            original(tm, *args, **kwargs)
+
+        taskmaster.__init__ = __init__
+        self._patched.append((taskmaster, '__init__', original))
+
+    def stop(self):
+        """Restore the original functions"""
+
+        while self._patched:
+            owner, attr, original = self._patched.pop()
+            setattr(owner, attr, original)
+        if self.stop_time is None:
+            self.stop_time = self.now()
+
+    def phases(self):
+        """Return a list of tuples (name, start, duration)"""
+
+        phases = []
+        stop = self.stop_time or self.now()
+        if self.start_time is not None:
+            build = self.build_time or stop
+            phases.append(('read SConscript files', self.start_time,
+                           build - self.start_time))
+            if self.build_time is not None:
+                phases.append(('build targets', build, stop - build))
+        return phases
+
+    def trace(self):
+        """Return a dict in the Chrome trace event format. Totals for
+        each category are provided in ``otherData``.
+
+        """
+
+        origin = self.start_time or 0.0
+        pid = os.getpid()
+
+        def us(seconds):
+            return round(seconds * 1e6, 1)
+
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid,
+                   'args': {'name': 'scons'}}]
+        for name, start, duration in self.phases():
+            events.append({'name': name, 'cat': 'phase', 'ph': 'X',
+                           'ts': us(start - origin), 'dur': us(duration),
+                           'pid': pid, 'tid': 0})
+        with self.lock:
+            recorded = list(self.events)
+            totals = {k: list(v) for k, v in self.totals.items()}
+        for category, name, start, duration, tid, args in recorded:
+            events.append({'name': name, 'cat': category, 'ph': 'X',
+                           'ts': us(start - origin), 'dur': us(duration),
+                           'pid': pid, 'tid': tid, 'args': args})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'totals': totals}}
+
+    def write_trace(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.trace(), f)
+
+
+def summary(trace, out=None, n=10):
+    """Write the duration of each phase, the calls and time for each
+    category and builder, and the ``n`` slowest SConscript files and
+    targets in ``trace`` (see ``Profiler.trace``) to ``out`` (default
+    stdout).
+
+    """
+
+    out = out or sys.stdout
+    events = [e for e in trace['traceEvents'] if e.get('ph') == 'X']
+
+    out.write('{:<24} {:>10}\n'.format('phase', 'seconds'))
+    for e in events:
+        if e['cat'] == 'phase':
+            out.write('{:<24} {:>10.3f}\n'.format(e['name'], e['dur'] / 1e6))
+
+    totals = trace.get('otherData', {}).get('totals', {})
+    fmt = '{:<24} {:>10} {:>10} {:>10}\n'
+    out.write('\n' + fmt.format('category', 'calls', 'seconds', 'max'))
+    for category in CATEGORIES:
+        if category in totals:
+            calls, seconds, longest = totals[category]
+            out.write(fmt.format(category, calls, '{:.3f}'.format(seconds),
+                                 '{:.3f}'.format(longest)))
+
+    builders = collections.defaultdict(lambda: [0, 0.0])
+    for e in events:
+        if e['cat'] == 'execute':
+            builder = builders[e['args'].get('builder', 'unknown')]
+            builder[0] += 1
+            builder[1] += e['dur'] / 1e6
+    fmt = '{:<24} {:>10} {:>10}\n'
+    out.write('\n' + fmt.format('builder', 'targets', 'seconds'))
+    for name, (count, seconds) in sorted(
+            builders.items(), key=lambda item: -item[1][1]):
+        out.write(fmt.format(name, count, '{:.3f}'.format(seconds)))
+
+    for category, title in [('read', 'slowest SConscript files'),
+                            ('execute', 'slowest targets')]:
+        slowest = sorted((e for e in events if e['cat'] == category),
+                         key=lambda e: -e['dur'])[:n]
+        if slowest:
+            out.write('\n{}\n'.format(title))
+            for e in slowest:
+                out.write('{:>10.3f}  {}\n'.format(e['dur'] / 1e6, e['name']))
+
+
+def enable(trace=None, summary=False, min_duration=0.001):
+    """Start profiling the build (see the module documentation) and
+    return the :class:`Profiler`. When scons exits, the trace is
+    written to the file ``trace`` if provided, and the summary is
+    written to ``summary``, either a file name or True for stdout.
+
+    """
+
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+
+    profiler = _profiler = Profiler(min_duration)
+    profiler.start()
+    atexit.register(_finish, profiler, trace, summary)
+    return profiler
+
+
+def _finish(profiler, trace, summary_file):
+    profiler.stop()
+    if trace:
+        profiler.write_trace(trace)
+    if summary_file is True:
+        summary(profiler.trace())
+    elif summary_file:
+        with open(summary_file, 'w') as f:
+            summary(profiler.trace(), f)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bioscons.profiling', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    report_parser = subparsers.add_parser(
+        'report', help='summarize a trace written by enable()')
+    report_parser.add_argument('trace')
+    report_parser.add_argument(
+        '-n', type=int, default=10,
+        help='number of slowest files and targets to list [%(default)s]')
+
+    args = parser.parse_args(arguments)
+    with open(args.trace) as f:
+        summary(json.load(f), n=args.n)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+"""
+Prioritize commands on the critical path of a build.
+
+A build is described by a dict mapping each target to the targets it
+depends on, and a dict of the (eg, historical) runtime of each
+target. The priority of a target is the length of the longest path
+from the start of its command to the end of the build, ie its own
+runtime plus the longest remaining path among the targets depending
+on it. Starting ready commands in order of decreasing priority keeps
+long chains of dependencies from being started last.
+"""
+
+import heapq
+import itertools
+import statistics
+import threading
+
+
+def _dependents(deps):
+    """Return a dict mapping each target in ``deps`` (or listed as a
+    dependency) to a list of the targets depending on it.
+
+    """
+
+    dependents = {}
+    for target, prereqs in deps.items():
+        dependents.setdefault(target, [])
+        for prereq in prereqs:
+            dependents.setdefault(prereq, []).append(target)
+    return dependents
+
+
+def topological_order(deps):
+    """Return a list of the targets in ``deps`` (and their
+    dependencies) with each target following its dependencies,
+    raising ValueError if there is a cycle.
+
+    """
+
+    dependents = _dependents(deps)
+    remaining = {t: len(set(deps.get(t, ()))) for t in dependents}
+    ready = [t for t, n in remaining.items() if n == 0]
+    order = []
+    while ready:
+        target = ready.pop()
+        order.append(target)
+        for dependent in set(dependents[target]):
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    if len(order) != len(dependents):
+        raise ValueError('dependency graph contains a cycle')
+    return order
+
+
+def longest_paths(deps, runtimes, default=0):
+    """Return a dict mapping each target in ``deps`` to the length of
+    the longest path from its start to the end of the build, using
+    ``runtimes`` (with ``default`` for targets not in ``runtimes``).
+
+    """
+
+    dependents = _dependents(deps)
+    paths = {}
+    for target in reversed(topological_order(deps)):
+        after = max((paths[d] for d in dependents[target]), default=0)
+        paths[target] = runtimes.get(target, default) + after
+    return paths
+
+
+def simulate(deps, runtimes, slots, priority=None, default=0):
+    """Simulate running the commands for the targets in ``deps``
+    using at most ``slots`` at once (as with ``scons -j``), starting
+    ready commands in order of decreasing ``priority`` (a dict), or
+    in the order they became ready if None. Returns a dict mapping
+    each target to a tuple (start, finish).
+
+    """
+
+    dependents = _dependents(deps)
+    remaining = {t: len(set(deps.get(t, ()))) for t in dependents}
+    counter = itertools.count()
+
+    def key(target):
+        return (-priority.get(target, 0) if priority else 0, next(counter))
+
+    ready = [(key(t), t) for t in dependents if remaining[t] == 0]
+    heapq.heapify(ready)
+    running = []  # heap of (finish, target)
+    schedule = {}
+    now = 0
+    while ready or running:
+        while ready and len(running) < slots:
+            __, target = heapq.heappop(ready)
+            finish = now + runtimes.get(target, default)
+            schedule[target] = (now, finish)
+            heapq.heappush(running, (finish, next(counter), target))
+        now, __, target = heapq.heappop(running)
+        for dependent in set(dependents[target]):
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                heapq.heappush(ready, (key(dependent), dependent))
+    return schedule
+
+
+def makespan(schedule):
+    """Return the time at which the last command in ``schedule`` (as
+    returned by ``simulate``) finishes
+
+    """
+
+    return max((finish for __, finish in schedule.values()), default=0)
+
+
+def peak_concurrency(schedule, weights=None):
+    """Return the largest number of commands in ``schedule`` running
+    at once, or the largest sum of their ``weights`` (a dict, eg of
+    the cores used by each command)
+
+    """
+
+    events = []
+    for target, (start, finish) in schedule.items():
+        if finish > start:
+            weight = weights.get(target, 1) if weights else 1
+            events.append((start, weight))
+            events.append((finish, -weight))
+    # commands finishing at a given time release resources before
+    # others start
+    events.sort(key=lambda e: (e[0], e[1]))
+    peak = current = 0
+    for __, weight in events:
+        current += weight
+        peak = max(peak, current)
+    return peak
+
+
+def estimate(deps, runtimes, ncores, slots, priority=None):
+    """Return a dict estimating the cost of building the targets in
+    ``deps`` given ``runtimes`` (seconds) and ``ncores`` (dicts keyed
+    by target) using ``slots`` concurrent commands, with keys
+    ``targets``, ``core_hours``, ``makespan`` and ``critical_path``
+    (seconds), ``peak_jobs`` and ``peak_cores``.
+
+    """
+
+    schedule = simulate(deps, runtimes, slots, priority)
+    paths = longest_paths(deps, runtimes)
+    return {
+        'targets': len(schedule),
+        'core_hours': sum(runtimes.get(t, 0) * ncores.get(t, 1)
+                          for t in schedule) / 3600,
+        'makespan': makespan(schedule),
+        'critical_path': max(paths.values(), default=0),
+        'peak_jobs': peak_concurrency(schedule),
+        'peak_cores': peak_concurrency(schedule, ncores),
+    }
+
+
+def node_dependencies(nodes, key=str):
+    """Return a dict mapping ``key(node)`` for each SCons node in
+    ``nodes`` to the set of keys of the nodes in ``nodes`` it depends
+    on, directly or through other derived files. Nodes with the same
+    key (eg, targets of the same command) are combined.
+
+    """
+
+    names = {node: key(node) for node in nodes}
+
+    def prereqs(node):
+        # nodes in names reachable from node through other derived
+        # nodes
+        result = set()
+        stack = list(node.children(scan=0))
+        seen = set()
+        while stack:
+            child = stack.pop()
+            if child in seen:
+                continue
+            seen.add(child)
+            if child in names:
+                result.add(names[child])
+            elif child.has_builder():
+                stack.extend(child.children(scan=0))
+        return result
+
+    deps = {}
+    for node, name in names.items():
+        deps.setdefault(name, set()).update(prereqs(node))
+    for name, prereqs in deps.items():
+        prereqs.discard(name)
+    return deps
+
+
+class CriticalPath(object):
+    """
+    Assigns priorities to the targets of a SlurmEnvironment using
+    historical ``runtimes`` (a dict of seconds keyed by target name,
+    or a function returning one, called when the build starts).
+    Targets without a recorded runtime are assumed to take the median
+    of those recorded (or 1 second).
+
+    Targets are registered with ``add`` (or provided as a list
+    ``nodes``) while SConscript files are read; the dependency graph
+    is computed the first time a priority is requested, once the
+    build has started.
+
+    ``max_nice`` is the largest value returned by ``nice``, which is
+    used for ``srun --nice`` to let slurm start jobs on the critical
+    path first.
+    """
+
+    def __init__(self, runtimes=None, max_nice=1000, nodes=None):
+        self.runtimes = runtimes
+        self.max_nice = max_nice
+        self.nodes = [] if nodes is None else nodes
+        self.paths = None
+        self.lock = threading.Lock()
+
+    def add(self, nodes):
+        self.nodes.extend(nodes)
+
+    def dependencies(self):
+        """Return a dict mapping the name of each registered target to
+        the names of the registered targets it depends on, directly or
+        through other derived files.
+
+        """
+
+        return node_dependencies(self.nodes)
+
+    def _paths(self):
+        with self.lock:
+            if self.paths is None:
+                runtimes = self.runtimes
+                if callable(runtimes):
+                    runtimes = runtimes()
+                runtimes = runtimes or {}
+                default = statistics.median(runtimes.values()) \
+                    if runtimes else 1
+                self.paths = longest_paths(
+                    self.dependencies(), runtimes, default)
+                self.longest = max(self.paths.values(), default=0)
+            return self.paths
+
+    def priority(self, target):
+        """Return the length of the longest path from the start of
+        ``target`` to the end of the build
+
+        """
+
+        return self._paths().get(str(target), 0)
+
+    def nice(self, target):
+        """Return a value for ``srun --nice`` between 0 (for targets on
+        the critical path) and ``max_nice``
+
+        """
+
+        paths = self._paths()
+        if not self.longest:
+            return 0
+        fraction = paths.get(str(target), 0) / self.longest
+        return int(round(self.max_nice * (1 - fraction)))
@@ -3,12 +3,32 @@ Functions for dispatching to SLURM (https://computing.llnl.gov/linux/slurm/)
 from scons.
 """
 
+import asyncio
+import atexit
+import collections
+import copy
+import heapq
+import itertools
+import json
+import math
+import os
 import re
+import shutil
+import statistics
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 import SCons
 from SCons.Script.SConscript import SConsEnvironment
 
+from bioscons import telemetry as _telemetry
+from bioscons.cache import DerivedCache
+from bioscons.scheduling import (
+    CriticalPath, estimate, longest_paths, node_dependencies)
+
 # From py3.3 argparse
 _find_unsafe = re.compile(r'[^\w@%+=:,./-]').search
 
@@ -27,6 +47,20 @@ def check_srun():
     return srun
 
 
+# File nodes for executables used by commands run with srun or
+# salloc, keyed on (command, PATH)
+_whereis_cache = {}
+
+
+def clear_whereis_cache():
+    """Discard cached locations of executables, eg after installing
+    or removing programs on PATH during a build.
+
+    """
+
+    _whereis_cache.clear()
+
+
 def _check_type(bool_vars):
     """list((var, varname, type)) checking variable types
     """
@@ -37,6 +71,106 @@ def _check_type(bool_vars):
                 name, tp, type(var)))
 
 
+def _shell_env(env):
+    """Return the execution environment of ``env`` as a dict of strings."""
+    ENV = {}
+    for key, value in SCons.Action.get_default_ENV(env).items():
+        if SCons.Util.is_List(value):
+            value = os.pathsep.join(map(str, SCons.Util.flatten(value)))
+        ENV[key] = str(value)
+    return ENV
+
+
+def _parse_mem(mem):
+    """Return ``mem`` in megabytes, given an integer (megabytes) or a
+    string with an optional K, M, G or T suffix as used by slurm.
+
+    """
+
+    if mem is None:
+        return None
+    match = re.match(r'^(\d+(?:\.\d+)?)([KMGT]?)B?$', str(mem).strip().upper())
+    if not match:
+        raise ValueError('invalid memory specification "{}"'.format(mem))
+    num, unit = match.groups()
+    return int(float(num) * {'K': 1 / 1024, '': 1, 'M': 1,
+                             'G': 1024, 'T': 1024 ** 2}[unit])
+
+
+# Keyword arguments of SRun and SAlloc (and resource profiles)
+# describing the resources requested, with the corresponding option
+# for srun and salloc. ncores is the number of cpus per task for srun
+# and the number of tasks for salloc.
+RESOURCES = [
+    ('ncores', None),
+    ('timelimit', '--time'),
+    ('slurm_queue', '--partition'),
+    ('mem', '--mem'),
+    ('mem_per_cpu', '--mem-per-cpu'),
+    ('nodes', '--nodes'),
+    ('exclusive', '--exclusive'),
+    ('constraint', '--constraint'),
+    ('qos', '--qos'),
+]
+
+
+def _resource_args(resources, slurm_cmd='srun', exclude=()):
+    """Return a string of options for ``slurm_cmd`` ('srun' or
+    'salloc') requesting ``resources`` (a dict with keys from
+    RESOURCES), omitting keys in ``exclude``.
+
+    """
+
+    args = []
+    ncores = resources.get('ncores')
+    if ncores and 'ncores' not in exclude:
+        if slurm_cmd == 'salloc':
+            args.append('--ntasks={}'.format(ncores))
+        elif ncores > 1:
+            args.append('--cpus-per-task={}'.format(ncores))
+
+    for key, opt in RESOURCES:
+        value = resources.get(key)
+        if opt is None or key in exclude or value is None or value is False:
+            continue
+        elif value is True:
+            args.append(opt)
+        else:
+            args.append('{}={}'.format(opt, _quote(str(value))))
+    return ' '.join(args)
+
+
+def _resource_mem(resources):
+    """Return the total memory requested by ``resources``, or None"""
+    if resources.get('mem'):
+        return resources['mem']
+    elif resources.get('mem_per_cpu'):
+        return (_parse_mem(resources['mem_per_cpu']) *
+                (resources.get('ncores') or 1))
+    return None
+
+
+# Number of lines at the end of the stderr of a job retained to
+# identify the reason for a failure
+STDERR_LINES = 1000
+
+
+def _run_captured(cmd, ENV):
+    """Run ``cmd`` using a shell, copying its stderr to sys.stderr,
+    and return a tuple (status, stderr) of its exit status and the
+    last STDERR_LINES lines of stderr.
+
+    """
+
+    proc = subprocess.Popen(cmd, shell=True, env=ENV, stderr=subprocess.PIPE,
+                            universal_newlines=True, errors='replace')
+    lines = collections.deque(maxlen=STDERR_LINES)
+    for line in proc.stderr:
+        sys.stderr.write(line)
+        lines.append(line)
+    return proc.wait(), ''.join(lines)
+
+
 def _quote(s):
     """Return a shell-escaped version of the string *s*."""
     if not s:
@@ -54,40 +188,179 @@ class SlurmEnvironment(SConsEnvironment):
 
     The SRun and SAlloc methods can be used to use multiple cores for
     multithreaded and MPI jobs, respectively.
+
+    If ``batch_size`` is provided, commands that would be run with srun
+    are instead collected and submitted as sbatch job arrays of up to
+    ``batch_size`` tasks; a partial batch is submitted ``batch_wait``
+    seconds after its first command was added. Commands are batched
+    together only if they request the same resources. Use a large
+    value for ``scons -j`` so that enough commands are dispatched at
+    once to fill each batch.
+
+    If ``allocation_size`` is provided, a single allocation of
+    ``allocation_size`` tasks is requested using ``salloc`` (with
+    additional arguments ``allocation_args``, eg a time limit) when
+    the first command is run, and each command that would be run
+    with srun is instead run as a job step within this allocation,
+    avoiding the scheduling latency of a new job for each command.
+    The allocation is released when scons exits.
+
+    If ``max_in_flight`` is provided, srun processes are started and
+    monitored by a single asyncio event loop, which runs at most
+    ``max_in_flight`` of them at once; threads used by scons to run
+    actions wait for the result without managing a subprocess.
+
+    Only one of ``batch_size``, ``allocation_size`` and
+    ``max_in_flight`` may be used.
+
+    If ``local_scheduler`` is True, commands run locally (when
+    ``use_cluster`` is False, or using ``Local``) start only when the
+    number of cores (``ncores``) and amount of memory (``mem``)
+    requested by the command are available. ``local_cores`` and
+    ``local_mem`` set the resources available (defaulting to all cpus
+    and physical memory); ``scons -j`` should be at least the number
+    of cores to keep them busy.
+
+    Resources requested by ``SRun`` and ``SAlloc`` may be given
+    individually or as a named profile defined using ``AddProfile``.
+
+    If ``telemetry`` is True (or the name of a file, or a
+    ``bioscons.telemetry.Telemetry`` instance, eg to set the python
+    interpreter used on compute nodes), the wall time, cpu time,
+    memory use and queue wait of each command are recorded (see
+    bioscons.telemetry).
+
+    If ``retry`` is provided (a RetryPolicy, or a maximum number of
+    attempts), srun and salloc commands that run out of memory or time
+    are resubmitted with more; ``retry`` may also be given to
+    ``Command``, ``SRun`` and ``SAlloc`` to override the default.
+
+    If ``critical_path`` is True (or the name of a telemetry file),
+    runtimes recorded by previous builds with ``telemetry`` are used
+    to prioritize commands on the longest remaining path to the end
+    of the build: they are started first by the local scheduler and
+    ``max_in_flight``, and others are run with ``srun --nice`` (see
+    bioscons.scheduling).
+
+    If ``cache`` is provided (a directory, or a
+    bioscons.cache.DerivedCache), the targets of each command are
+    stored in a cache that may be shared with other checkouts, and
+    retrieved rather than rebuilt when the command and its inputs
+    are unchanged; ``cache=False`` may be given to ``Command``,
+    ``SRun`` and ``SAlloc`` to disable it for a command.
     """
 
     def __init__(self, use_cluster=True, slurm_queue=None,
-                 all_precious=False, verbose=False, **kwargs):
+                 all_precious=False, verbose=False, batch_size=None,
+                 batch_wait=5, allocation_size=None, allocation_args='',
+                 max_in_flight=None, local_scheduler=False,
+                 local_cores=None, local_mem=None, telemetry=False,
+                 critical_path=False, retry=None, cache=None, **kwargs):
         super(SlurmEnvironment, self).__init__(**kwargs)
 
         # check boolean types because so often these are accidentally strings
         _check_type([(use_cluster, 'use_cluster', bool),
                      (all_precious, 'all_precious', bool),
+                     (local_scheduler, 'local_scheduler', bool),
                      ])
 
         self.use_cluster = use_cluster
         self.all_precious = all_precious
         self.verbose = verbose
+        self.launcher = None
+        if len([x for x in (batch_size, allocation_size, max_in_flight)
+                if x]) > 1:
+            raise ValueError('only one of batch_size, allocation_size and '
+                             'max_in_flight may be used')
+        elif batch_size:
+            self.launcher = _BatchLauncher(batch_size, batch_wait)
+        elif allocation_size:
+            self.launcher = _AllocationLauncher(
+                allocation_size, allocation_args)
+        elif max_in_flight:
+            self.launcher = _AsyncLauncher(max_in_flight)
+        self.local_scheduler = None
+        if local_scheduler:
+            self.local_scheduler = _LocalScheduler(local_cores, local_mem)
+        self.telemetry = None
+        if isinstance(telemetry, _telemetry.Telemetry):
+            self.telemetry = telemetry
+        elif telemetry:
+            self.telemetry = _telemetry.Telemetry(
+                None if telemetry is True else telemetry)
+        # targets of commands, used by critical_path and Estimate
+        self.slurm_nodes = []
+        self.critical_path = None
+        if critical_path:
+            filename = None if critical_path is True else critical_path
+            if filename is None and self.telemetry:
+                filename = self.telemetry.filename
+            self.critical_path = CriticalPath(
+                lambda: _telemetry.runtimes(filename),
+                nodes=self.slurm_nodes)
+        self.retry = self._retry_policy(retry)
+        self.cache = cache
+        if cache and not isinstance(cache, DerivedCache):
+            self.cache = DerivedCache(cache)
+        self.profiles = {}
         if slurm_queue:
             self.SetPartition(slurm_queue)
         self.shell = kwargs.get('SHELL', 'sh')
 
-    def _SlurmCommand(self, target, source, action, slurm_cmd, **kw):
+    def _retry_policy(self, retry):
+        """Return a RetryPolicy (or None) given ``retry``, which may be
+        a RetryPolicy, a maximum number of attempts, or False.
+
+        """
+
+        if not retry:
+            return None
+        elif isinstance(retry, RetryPolicy):
+            return retry
+        elif retry is True:
+            return getattr(self, 'retry', None) or RetryPolicy()
+        elif getattr(self, 'retry', None):
+            policy = copy.copy(self.retry)
+            policy.max_attempts = retry
+            return policy
+        return RetryPolicy(max_attempts=retry)
+
+    def _SlurmCommand(self, target, source, action, slurm_cmd,
+                      resources=None, **kw):
         if not isinstance(action, list):
             action = [action]
         if slurm_cmd:
             kw['IMPLICIT_COMMAND_DEPENDENCIES'] = False
             for a in action:
-                cmd = self.subst(a, SCons.Subst.SUBST_RAW, target, source)
-                cmd = cmd.split(maxsplit=1)[0]
-                self.Depends(target, self.WhereIs(cmd))
+                cmd = a.split(maxsplit=1)[0] if isinstance(a, str) else ''
+                if not cmd or '$' in cmd:
+                    cmd = self.subst(a, SCons.Subst.SUBST_RAW, target, source)
+                    cmd = cmd.split(maxsplit=1)[0]
+                executable = self._executable(cmd)
+                if executable is not None:
+                    self.Depends(target, executable)
+
+        retry = self.retry
+        if 'retry' in kw:
+            retry = self._retry_policy(kw.pop('retry'))
+        cache = self.cache if kw.pop('cache', True) else None
+
+        if slurm_cmd is None:
+            launcher = self.local_scheduler
+        elif slurm_cmd == 'srun':
+            launcher = self.launcher
+        else:
+            launcher = None
 
         actions = []
         for a in action:
             if isinstance(a, str):
                 actions.append(
                     _SlurmAction(a, self.shell, slurm_cmd,
-                                 kw.pop('slurm_args', ''), self.verbose)
+                                 kw.pop('slurm_args', ''), self.verbose,
+                                 launcher, resources, self.telemetry,
+                                 self.critical_path,
+                                 retry if slurm_cmd else None, cache)
                     )
             else:
                 actions.append(a)
@@ -95,11 +368,31 @@ class SlurmEnvironment(SConsEnvironment):
         env = super(SlurmEnvironment, self)
         result = env.Command(target, source, actions, **kw)
 
+        self.slurm_nodes.extend(result)
+
         if kw.pop('precious', self.all_precious):
             self.Precious(result)
 
         return result
 
+    def _executable(self, cmd):
+        """Return a File node for the executable ``cmd`` found on
+        ``ENV['PATH']``, or None. Results are cached (see
+        ``clear_whereis_cache``).
+
+        """
+
+        path = self['ENV'].get('PATH')
+        if SCons.Util.is_List(path):
+            path = os.pathsep.join(path)
+        key = (cmd, path)
+        try:
+            return _whereis_cache[key]
+        except KeyError:
+            found = self.WhereIs(cmd)
+            node = _whereis_cache[key] = self.File(found) if found else None
+            return node
+
     def Command(
             self, target, source, action, use_cluster=True, **kw):
         """Dispatches ``action`` (and extra arguments) to ``SRun`` if
@@ -110,7 +403,130 @@ class SlurmEnvironment(SConsEnvironment):
         return self._SlurmCommand(
             target, source, action, slurm_cmd, **kw)
 
-    def SAlloc(self, target, source, action, ncores, timelimit=None, **kw):
+    def Estimate(self, jobs=1, telemetry=None, out=None):
+        """
+        Estimate the cost of building all targets defined using this
+        environment (or its clones) with ``scons -j jobs`` without
+        running anything, and write a summary to ``out`` (default
+        stdout). Returns a dict (see bioscons.scheduling.estimate)
+        with additional keys ``runtime_sources`` counting targets for
+        which runtimes were recorded by telemetry ('history', read
+        from ``telemetry``, by default the file used by this
+        environment), taken from the time limit ('timelimit'), or
+        assumed to be the median of the others ('default').
+
+        The cores requested by each command are taken from ``ncores``.
+        For example::
+
+          AddOption('--estimate', action='store_true')
+          ...
+          if GetOption('estimate'):
+              env.Estimate(jobs=GetOption('num_jobs'))
+              Exit(0)
+        """
+
+        out = out or sys.stdout
+        if telemetry is None and self.telemetry is not None:
+            telemetry = self.telemetry.filename
+        history = _telemetry.runtimes(telemetry)
+
+        def key(node):
+            return str(node.get_executor().get_all_targets()[0])
+
+        deps = node_dependencies(self.slurm_nodes, key)
+        known, ncores, commands = {}, {}, {}
+        for node in self.slurm_nodes:
+            name = key(node)
+            if name in commands:
+                continue
+            actions = node.get_executor().get_action_list()
+            action = actions[0] if actions else None
+            commands[name] = action
+            ncores[name] = getattr(action, 'ncores', 1)
+            if str(node) in history:
+                known[name] = history[str(node)]
+
+        default = statistics.median(known.values()) if known else 0
+        runtimes, sources = {}, collections.Counter()
+        for name, action in commands.items():
+            resources = getattr(action, 'resources', {})
+            timelimit = resources.get('timelimit') or \
+                self['ENV'].get('SLURM_TIMELIMIT')
+            if name in known:
+                runtimes[name] = known[name]
+                sources['history'] += 1
+            elif timelimit and _parse_time(timelimit) is not None:
+                runtimes[name] = _parse_time(timelimit) * 60
+                sources['timelimit'] += 1
+            else:
+                runtimes[name] = default
+                sources['default'] += 1
+
+        result = estimate(deps, runtimes, ncores, jobs,
+                          self.critical_path and longest_paths(
+                              deps, runtimes))
+        result['runtime_sources'] = dict(sources)
+
+        def hms(seconds):
+            seconds = int(round(seconds))
+            return '{}:{:02d}:{:02d}'.format(
+                seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+        out.write(
+            'targets: {} ({} with recorded runtimes, {} using time limits, '
+            '{} assumed {})\n'.format(
+                result['targets'], sources['history'], sources['timelimit'],
+                sources['default'], hms(default)))
+        out.write('core-hours: {:.1f}\n'.format(result['core_hours']))
+        out.write('makespan (-j {}): {}\n'.format(
+            jobs, hms(result['makespan'])))
+        out.write('critical path: {}\n'.format(hms(result['critical_path'])))
+        out.write('peak concurrency: {} jobs, {} cores\n'.format(
+            result['peak_jobs'], result['peak_cores']))
+        return result
+
+    def _resources(self, profile, kw, **resources):
+        """
+        Return a dict of resources requested by a call to SRun or
+        SAlloc: values from ``profile`` are updated with
+        ``resources`` and those in ``kw`` (which are removed) that are
+        not None.
+        """
+        if profile is None:
+            result = {}
+        elif profile in self.profiles:
+            result = dict(self.profiles[profile])
+        else:
+            raise ValueError('no resource profile named "{}"'.format(profile))
+
+        for key, __ in RESOURCES:
+            value = kw.pop(key, resources.get(key))
+            if value is not None:
+                result[key] = value
+        return result
+
+    def AddProfile(self, name, **resources):
+        """
+        Define a named set of resources that can be requested in
+        subsequent calls to SRun and SAlloc using ``profile=name``;
+        arguments provided in the call override those in the
+        profile. Keyword arguments are ``ncores``, ``timelimit``,
+        ``slurm_queue``, ``mem``, ``mem_per_cpu``, ``nodes``,
+        ``exclusive``, ``constraint`` and ``qos``.
+
+        Example::
+
+          env.AddProfile('bigmem', ncores=8, mem='128G', qos='long')
+          env.SRun(target, source, action, profile='bigmem')
+        """
+        unknown = set(resources) - {key for key, __ in RESOURCES}
+        if unknown:
+            raise TypeError('unknown resources: {}'.format(
+                ', '.join(sorted(unknown))))
+        self.profiles[name] = resources
+
+    def SAlloc(self, target, source, action, ncores=None, timelimit=None,
+               profile=None, **kw):
         """
         Run ``action`` with salloc.
 
@@ -118,57 +534,65 @@ class SlurmEnvironment(SConsEnvironment):
         with ``mpirun`` (with no arguments) will use all nodes allocated
         automatically.
 
+        ``ncores`` is required unless provided by ``profile``, and
+        provides a value for ``salloc -n/--ntasks``.
+
         Optional arguments:
         ``slurm_args``: Additional arguments to pass to salloc
-        ``timelimit``: value to use for environment variable SALLOC_TIMELIMIT
+        ``timelimit``: value for ``salloc --time``
+        ``profile``: name of a set of resources defined using ``AddProfile``
+        ``mem``, ``mem_per_cpu``, ``nodes``, ``exclusive``,
+        ``constraint``, ``qos``: values for the corresponding
+        salloc options (eg, ``mem='4G'`` for ``--mem=4G``)
         """
-        slurm_args = kw.pop('slurm_args', '')
-        slurm_args = ' '.join(['-n {0}'.format(ncores), slurm_args])
-        e = self
-
-        if timelimit is not None:
-            clone = self.Clone()
-            clone.SetTimeLimit(timelimit)
-            e = clone
+        resources = self._resources(
+            profile, kw, ncores=ncores, timelimit=timelimit)
+        if 'ncores' not in resources:
+            raise TypeError('SAlloc requires ncores')
 
         slurm_cmd = 'salloc' if self.use_cluster else None
 
-        return e._SlurmCommand(target, source, action, slurm_cmd,
-                               slurm_args=slurm_args, **kw)
+        return self._SlurmCommand(target, source, action, slurm_cmd,
+                                  resources=resources, **kw)
 
-    def SRun(self, target, source, action, ncores=1,
-             timelimit=None, slurm_queue=None, **kw):
+    def SRun(self, target, source, action, ncores=None,
+             timelimit=None, slurm_queue=None, profile=None, **kw):
         """
         Run ``action`` with srun.
 
         This method should be used for multithreaded jobs on a single
         machine only. By default, calls to SlurmEnvironment.Command
-        use srun. Specify a number of processors with ``ncores``,
-        which provides a value for ``srun -c/--cpus-per-task``.
+        use srun. Specify a number of processors with ``ncores``
+        (default 1), which provides a value for ``srun
+        -c/--cpus-per-task``.
 
         Optional arguments:
         ``slurm_args``: Additional arguments to pass to salloc
-        ``timelimit``: Value to use for environment variable SLURM_TIMELIMIT
+        ``timelimit``: Value for ``srun --time``
+        ``slurm_queue``: Value for ``srun --partition``
+        ``profile``: name of a set of resources defined using ``AddProfile``
+        ``mem``, ``mem_per_cpu``, ``nodes``, ``exclusive``,
+        ``constraint``, ``qos``: values for the corresponding srun
+        options (eg, ``mem='4G'`` for ``--mem=4G``)
         """
 
-        clone = self.Clone()
-        if ncores > 1:
-            clone.SetCpusPerTask(ncores)
-        if timelimit is not None:
-            clone.SetTimeLimit(timelimit)
-        if slurm_queue is not None:
-            clone.SetPartition(slurm_queue)
+        resources = self._resources(
+            profile, kw, ncores=ncores, timelimit=timelimit,
+            slurm_queue=slurm_queue)
 
         slurm_cmd = 'srun' if self.use_cluster else None
 
-        return clone._SlurmCommand(target, source, action, slurm_cmd, **kw)
+        return self._SlurmCommand(target, source, action, slurm_cmd,
+                                  resources=resources, **kw)
 
-    def Local(self, target, source, action, **kw):
+    def Local(self, target, source, action, ncores=1, mem=None, **kw):
         """
-        Run a command locally, without SLURM
+        Run a command locally, without SLURM. ``ncores`` and ``mem``
+        are used only by the local scheduler.
         """
-        return self.Command(
-            target, source, action, use_cluster=False, **kw)
+        return self._SlurmCommand(
+            target, source, action, None,
+            resources={'ncores': ncores, 'mem': mem}, **kw)
 
     def SetPartition(self, partition):
         """
@@ -202,18 +626,60 @@ class SlurmEnvironment(SConsEnvironment):
         self['ENV']['SALLOC_TIMELIMIT'] = timelimit
 
 
+def _actions(executor):
+    """Return the actions run by ``executor``, with those of a
+    command with several actions (a ListAction) listed separately.
+
+    """
+
+    actions = []
+    for action in executor.get_action_list():
+        actions.extend(getattr(action, 'list', [action]))
+    return actions
+
+
 class _SlurmAction(SCons.Action.CommandAction):
-    def __init__(
-            self, command, shell, slurm_cmd, slurm_args, verbose=False):
+
+    _presig_memo = None
+
+    def __init__(self, command, shell, slurm_cmd, slurm_args,
+                 verbose=False, launcher=None, resources=None,
+                 telemetry=None, critical_path=None, retry=None,
+                 cache=None):
         '''
         Prepend command with slurm binary
         Slurm is ignored as part of the scons decision tree
+
+        If provided, ``launcher`` runs the command in place of
+        ``slurm_cmd`` (see ``execute``). ``resources`` is a dict
+        describing the resources requested by the command (see
+        RESOURCES), which are provided as options to ``slurm_cmd``
+        preceding ``slurm_args``. If provided, ``telemetry`` (a
+        bioscons.telemetry.Telemetry instance) records the resources
+        used by the command, and ``critical_path`` (a
+        bioscons.scheduling.CriticalPath instance) sets its priority.
+        ``retry`` (a RetryPolicy) resubmits the command if it runs out of
+        memory or time. If provided, ``cache`` (a
+        bioscons.cache.DerivedCache) stores the targets of the command.
         '''
         action = command
         self.presig_cmd = action
+        self.shell = shell
+        self.slurm_args = slurm_args
+        self.launcher = launcher
+        self.telemetry = telemetry
+        self.critical_path = critical_path
+        self.retry = retry
+        self.cache = cache
+        self.slurm_cmd = slurm_cmd
+        self.resources = resources or {}
+        self.ncores = self.resources.get('ncores') or 1
+        self.mem = _resource_mem(self.resources)
         if slurm_cmd:
             action = self._quote_action(shell, command)
             name = self.job_name(command)
+            slurm_args = ' '.join(filter(None, [
+                _resource_args(self.resources, slurm_cmd), slurm_args]))
             if slurm_args:
                 action = f'{slurm_cmd} {slurm_args} -J "{name}" {action}'
             else:
@@ -232,9 +698,844 @@ class _SlurmAction(SCons.Action.CommandAction):
         return name
 
     def get_presig(self, target, source, env, executor=None):
-        return env.subst_target_source(
+        # SCons computes the signature of a target before and after
+        # building it; the most recent result is reused if the
+        # targets, sources and environment are the same. The memo holds
+        # a reference to the environment so that its identity cannot
+        # be reused by another.
+        key = (tuple(target), tuple(source))
+        memo = self._presig_memo
+        if memo is not None and memo[0] == key and memo[1] is env:
+            return memo[2]
+        presig = env.subst_target_source(
             self.presig_cmd, SCons.Subst.SUBST_SIG, target, source)
+        self._presig_memo = (key, env, presig)
+        return presig
 
     def print_cmd_line(self, _, target, source, env):
         c = env.subst(self.print_cmd, SCons.Subst.SUBST_RAW, target, source)
         SCons.Action.CommandAction.print_cmd_line(self, c, target, source, env)
+
+    def execute(self, target, source, env, executor=None):
+        if self.cache is None:
+            return self._execute(target, source, env, executor)
+
+        cache_executor = executor or target[0].get_executor()
+        targets = cache_executor.get_all_targets()
+        actions = _actions(cache_executor)
+        name = self.job_name(self.presig_cmd)
+        key = self.cache.key(targets, cache_executor)
+        # targets of a command with several actions are looked up
+        # before the first and stored after the last; later actions
+        # are skipped if the targets were retrieved
+        if actions[0] is not self:
+            if key in self.cache.retrieved:
+                return 0
+        elif key and self.cache.retrieve(key, targets, name):
+            if SCons.Action.print_actions:
+                print('Retrieved `{}\' from {}'.format(
+                    targets[0], self.cache.directory))
+            return 0
+
+        status = self._execute(target, source, env, executor)
+        if key and not status and actions[-1] is self:
+            self.cache.store(key, targets, name)
+        return status
+
+    def _execute(self, target, source, env, executor=None):
+        if (self.launcher is None and self.telemetry is None and
+                self.critical_path is None and self.retry is None):
+            return SCons.Action.CommandAction.execute(
+                self, target, source, env, executor=executor)
+
+        job = _SlurmJob(self, target, source, env, executor)
+        if self.critical_path is not None:
+            job.priority = self.critical_path.priority(job.target[0])
+            if self.slurm_cmd:
+                job.nice = self.critical_path.nice(job.target[0])
+        if self.retry is not None:
+            status = self.retry.run(job, self._launch)
+        else:
+            status = self._launch(job)
+        if isinstance(status, SCons.Errors.BuildError):
+            return status
+        elif status:
+            return SCons.Errors.BuildError(
+                errstr='Error {}'.format(status), status=status,
+                action=self, command=job.command)
+        return 0
+
+    def _launch(self, job):
+        if self.telemetry is not None:
+            return self.telemetry.run(job, self.launcher)
+        elif self.launcher is not None:
+            return self.launcher.run(job)
+        return job.spawn()
+
+
+class _SlurmJob(object):
+    """
+    A command from a _SlurmAction with construction variables
+    substituted, to be run by a launcher.
+    """
+
+    # Variables in the execution environment describing resources
+    # requested from slurm and the corresponding sbatch options.
+    resource_vars = [
+        ('SLURM_PARTITION', '--partition'),
+        ('SLURM_CPUS_PER_TASK', '--cpus-per-task'),
+        ('SLURM_TIMELIMIT', '--time'),
+    ]
+
+    def __init__(self, action, target, source, env, executor=None):
+        self._execute_args = (action, target, source, env, executor)
+        if executor:
+            target = executor.get_all_targets()
+            source = executor.get_all_sources()
+        self.target = target
+        self.shell = action.shell
+        self.ncores = action.ncores
+        self.mem = _parse_mem(action.mem)
+        self.command = self._command = env.subst(
+            action.presig_cmd, SCons.Subst.SUBST_CMD, target, source)
+        self.slurm_cmd = action.slurm_cmd
+        self.priority = 0
+        self.nice = None
+        # set by launchers and used to identify the reason for a failure
+        self.stderr = ''
+        self.slurm_job_id = None
+        # if True, spawn captures stderr
+        self.capture = False
+        self.name = action.job_name(action.presig_cmd)
+        self.ENV = _shell_env(env)
+        self.resources = action.resources
+        self.slurm_args = env.subst(action.slurm_args)
+
+    def spawn(self):
+        """Run the command in the same way as an ordinary action, and
+        return 0 or a BuildError.
+
+        """
+
+        action, target, source, env, executor = self._execute_args
+        if self.capture and self.slurm_cmd:
+            status, self.stderr = _run_captured(
+                self.command_line(), self.ENV)
+            return status
+        if (self.command != self._command or self.nice or
+                self.resources != action.resources):
+            # the command was modified (eg, by telemetry): escape it
+            # so that it is not substituted again
+            cmd = self.command_line() if self.slurm_cmd else self.command
+            action = SCons.Action.CommandAction(cmd.replace('$', '$$'))
+        return SCons.Action.CommandAction.execute(
+            action, target, source, env, executor=executor)
+
+    def command_line(self):
+        """Return a command line running this job with ``slurm_cmd``"""
+        return ' '.join(filter(None, [
+            self.slurm_cmd, self.srun_args(), '-J', _quote(self.name),
+            self.shell, '-c', _quote(self.command)]))
+
+    def set_resources(self, resources):
+        self.resources = resources
+        self.mem = _parse_mem(_resource_mem(resources))
+
+    def _nice_arg(self):
+        return '--nice={}'.format(self.nice) if self.nice else ''
+
+    def srun_args(self, exclude=()):
+        """Return a string of srun options requesting the resources for
+        this job, omitting resources (or 'nice') named in ``exclude``.
+
+        """
+
+        return ' '.join(filter(None, [
+            _resource_args(self.resources, self.slurm_cmd or 'srun', exclude),
+            '' if 'nice' in exclude else self._nice_arg(),
+            self.slurm_args]))
+
+    def sbatch_args(self):
+        """Return a string of sbatch options requesting the resources
+        for this job, including those set in the execution
+        environment.
+
+        """
+
+        args = ['{}={}'.format(opt, _quote(self.ENV[var]))
+                for var, opt in self.resource_vars if self.ENV.get(var)]
+        # jobs with different priorities are batched together
+        args.append(self.srun_args(exclude=['nice']))
+        return ' '.join(filter(None, args))
+
+
+class _BatchLauncher(object):
+    """
+    Runs jobs as tasks of sbatch job arrays.
+
+    Each call to ``run`` blocks until its task is complete. Jobs are
+    added to a pending batch for their resource request; a batch is
+    submitted by the thread adding its ``batch_size``-th job, or by a
+    timer thread ``batch_wait`` seconds after its first job was
+    added. Task scripts, exit statuses and logs are written to a
+    subdirectory of ``workdir``, which must be readable from the
+    compute nodes. The exit status of each task is checked every
+    ``poll_interval`` seconds, so that its job is released when the
+    task finishes rather than when the whole array does.
+    """
+
+    def __init__(self, batch_size, batch_wait=5, workdir='.bioscons',
+                 poll_interval=1):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.workdir = workdir
+        self.poll_interval = poll_interval
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def run(self, job):
+        # tasks of an array share the execution environment and shell
+        # of the batch
+        sbatch_args = job.sbatch_args()
+        key = (sbatch_args, job.shell, tuple(sorted(job.ENV.items())))
+        with self.lock:
+            batch = self.pending.get(key)
+            if batch is None:
+                batch = self.pending[key] = _Batch(
+                    job.ENV, sbatch_args, job.shell, self.poll_interval)
+            index = batch.add(job)
+            full = len(batch.jobs) >= self.batch_size
+            if full:
+                del self.pending[key]
+                if batch.timer:
+                    batch.timer.cancel()
+            elif batch.timer is None:
+                batch.timer = threading.Timer(
+                    self.batch_wait, self._submit_pending, [key, batch])
+                batch.timer.daemon = True
+                batch.timer.start()
+
+        if full:
+            batch.submit(self.workdir)
+        batch.done[index].wait()
+        job.stderr = batch.logs[index]
+        return batch.result(index)
+
+    def _submit_pending(self, key, batch):
+        with self.lock:
+            if self.pending.get(key) is not batch:
+                return
+            del self.pending[key]
+        batch.submit(self.workdir)
+
+
+class _Batch(object):
+    """A list of jobs to be submitted as a single job array."""
+
+    def __init__(self, ENV, sbatch_args, shell, poll_interval=1):
+        self.ENV = ENV
+        self.sbatch_args = sbatch_args
+        self.shell = shell
+        self.poll_interval = poll_interval
+        self.jobs = []
+        self.timer = None
+        # one event per task, set when its exit status is known
+        self.done = []
+        self.statuses = []
+        self.logs = []
+
+    def add(self, job):
+        self.jobs.append(job)
+        self.done.append(threading.Event())
+        self.statuses.append(None)
+        self.logs.append(None)
+        return len(self.jobs) - 1
+
+    def result(self, index):
+        """Print the output of task ``index`` and return its exit status."""
+        sys.stdout.write(self.logs[index])
+        sys.stdout.flush()
+        return self.statuses[index]
+
+    def script(self, dirname):
+        return '\n'.join([
+            '#!/bin/sh',
+            'task={}/$SLURM_ARRAY_TASK_ID'.format(_quote(dirname)),
+            '{} "$task.sh"'.format(self.shell),
+            'echo $? > "$task.status"',
+            ''])
+
+    def submit(self, workdir):
+        """Submit the job array, and start a thread releasing each task
+        as it finishes.
+
+        """
+
+        try:
+            dirname, proc = self._submit(workdir)
+        except Exception as err:
+            self._fail(range(len(self.jobs)),
+                       'batch submission failed: {}\n'.format(err))
+            return
+        thread = threading.Thread(target=self._monitor, args=(dirname, proc))
+        thread.daemon = True
+        thread.start()
+
+    def _submit(self, workdir):
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir, exist_ok=True)
+        dirname = os.path.abspath(tempfile.mkdtemp(prefix='batch-', dir=workdir))
+        for i, job in enumerate(self.jobs):
+            with open(os.path.join(dirname, '{}.sh'.format(i)), 'w') as f:
+                f.write(job.command + '\n')
+        script = os.path.join(dirname, 'array.sh')
+        with open(script, 'w') as f:
+            f.write(self.script(dirname))
+
+        cmd = ('sbatch --wait --parsable --job-name=bioscons-batch '
+               '--array=0-{} --output={} {} {}').format(
+                   len(self.jobs) - 1, _quote(os.path.join(dirname, '%a.log')),
+                   self.sbatch_args, _quote(script))
+        # sbatch --wait exits when all tasks are finished
+        with open(os.path.join(dirname, 'sbatch.err'), 'w') as stderr:
+            proc = subprocess.Popen(cmd, shell=True, env=self.ENV,
+                                    stdout=subprocess.DEVNULL, stderr=stderr)
+        return dirname, proc
+
+    def _monitor(self, dirname, proc):
+        running = list(range(len(self.jobs)))
+        try:
+            while running:
+                # statuses of all tasks are written before sbatch exits
+                finished = proc.poll() is not None
+                for i in list(running):
+                    status = self._status(dirname, i)
+                    if status is None and finished:
+                        status = proc.returncode or 1
+                    if status is not None:
+                        running.remove(i)
+                        self._finish(i, status, self._log(dirname, i))
+                if running:
+                    time.sleep(self.poll_interval)
+        except Exception as err:
+            self._fail(running, 'batch failed: {}\n'.format(err))
+            return
+        proc.wait()
+
+        if not any(self.statuses):
+            shutil.rmtree(dirname, ignore_errors=True)
+
+    def _status(self, dirname, index):
+        """Return the exit status of task ``index``, or None if it has
+        not finished.
+
+        """
+
+        try:
+            with open(os.path.join(dirname, '{}.status'.format(index))) as f:
+                return int(f.read())
+        except (OSError, ValueError):
+            # missing, or not yet written
+            return None
+
+    def _log(self, dirname, index):
+        for fname in ['{}.log'.format(index), 'sbatch.err']:
+            try:
+                with open(os.path.join(dirname, fname)) as f:
+                    return f.read()
+            except OSError:
+                pass
+        return ''
+
+    def _finish(self, index, status, log):
+        self.statuses[index] = status
+        self.logs[index] = log
+        self.done[index].set()
+
+    def _fail(self, indices, message):
+        for i in list(indices):
+            self._finish(i, 1, message)
+
+
+class _AllocationLauncher(object):
+    """
+    Runs jobs as job steps within a single allocation.
+
+    The allocation is requested with ``salloc --no-shell`` by the first
+    call to ``run`` and cancelled at exit. Job steps use ``srun
+    --exact`` so that concurrent steps share the allocation.
+    """
+
+    def __init__(self, ntasks, salloc_args=''):
+        self.ntasks = ntasks
+        self.salloc_args = salloc_args
+        self.jobid = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def allocate(self, ENV):
+        """Return the id of the allocation, requesting it if necessary."""
+
+        with self.lock:
+            if self.jobid is None and self.error is None:
+                cmd = ('salloc --no-shell --job-name=bioscons-allocation '
+                       '-n {} {}').format(self.ntasks, self.salloc_args)
+                proc = subprocess.run(
+                    cmd, shell=True, env=ENV, stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT, universal_newlines=True)
+                match = re.search(r'Granted job allocation (\d+)', proc.stdout)
+                if match:
+                    self.jobid = match.group(1)
+                    atexit.register(self.release, ENV)
+                else:
+                    self.error = '{} failed:\n{}'.format(cmd, proc.stdout)
+            if self.error:
+                sys.stderr.write(self.error)
+            return self.jobid
+
+    def release(self, ENV):
+        subprocess.call(['scancel', self.jobid], env=ENV)
+
+    def run(self, job):
+        jobid = self.allocate(job.ENV)
+        if jobid is None:
+            return 1
+
+        # steps run in the partition of the allocation
+        ENV = dict(job.ENV)
+        ENV.pop('SLURM_PARTITION', None)
+        cmd = 'srun --jobid={} --exact -n 1 {} -J {} {} -c {}'.format(
+            jobid, job.srun_args(exclude=['slurm_queue', 'nice']),
+            _quote(job.name), job.shell,
+            _quote(job.command))
+        status, job.stderr = _run_captured(cmd, ENV)
+        return status
+
+
+class _AsyncLauncher(object):
+    """
+    Runs srun for each job from a single asyncio event loop running in
+    a background thread, with at most ``max_in_flight`` concurrent
+    srun processes. Waiting jobs are started in order of decreasing
+    priority.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.loop = None
+        self.running = 0
+        self.waiting = []  # heap of (-priority, seq, future)
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._run_loop, args=(loop,), daemon=True)
+                thread.start()
+                self.loop = loop
+        return self.loop
+
+    def _run_loop(self, loop):
+        asyncio.set_event_loop(loop)
+        # Before python 3.12 the default child watcher uses a thread
+        # per process; a pidfd watcher (linux 5.3+) needs none.
+        if sys.version_info < (3, 12) and hasattr(
+                asyncio, 'PidfdChildWatcher'):
+            try:
+                watcher = asyncio.PidfdChildWatcher()
+                watcher.attach_loop(loop)
+                asyncio.set_child_watcher(watcher)
+            except OSError:
+                pass
+        loop.run_forever()
+
+    async def _acquire(self, priority):
+        if self.running < self.max_in_flight and not self.waiting:
+            self.running += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (-priority, next(self.counter), future))
+        # the slot is passed on by _release
+        await future
+
+    def _release(self):
+        if self.waiting:
+            __, __, future = heapq.heappop(self.waiting)
+            future.set_result(None)
+        else:
+            self.running -= 1
+
+    async def _run(self, job):
+        await self._acquire(job.priority)
+        try:
+            cmd = 'srun {} -J {} {} -c {}'.format(
+                job.srun_args(), _quote(job.name), job.shell,
+                _quote(job.command))
+            proc = await asyncio.create_subprocess_shell(
+                cmd, env=job.ENV, stderr=asyncio.subprocess.PIPE)
+            lines = collections.deque(maxlen=STDERR_LINES)
+            async for line in proc.stderr:
+                line = line.decode(errors='replace')
+                sys.stderr.write(line)
+                lines.append(line)
+            job.stderr = ''.join(lines)
+            return await proc.wait()
+        finally:
+            self._release()
+
+    def run(self, job):
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(self._run(job), loop).result()
+
+
+class _LocalScheduler(object):
+    """
+    Runs jobs locally once the cores and memory (in MB) they request
+    are available. A job requesting more than the total is run when
+    nothing else is running. When resources are freed, waiting jobs
+    are started in order of decreasing priority.
+    """
+
+    def __init__(self, ncores=None, mem=None):
+        self.ncores = ncores or os.cpu_count()
+        if mem is None:
+            try:
+                mem = (os.sysconf('SC_PAGE_SIZE') *
+                       os.sysconf('SC_PHYS_PAGES')) // 1024 ** 2
+            except (ValueError, OSError, AttributeError):
+                mem = None
+        self.mem = _parse_mem(mem)
+        self.free_cores = self.ncores
+        self.free_mem = self.mem
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def _request(self, job):
+        ncores = min(job.ncores or 1, self.ncores)
+        mem = min(job.mem or 0, self.mem) if self.mem else 0
+        return ncores, mem
+
+    def _fits(self, ncores, mem):
+        return ncores <= self.free_cores and (
+            not self.mem or mem <= self.free_mem)
+
+    def _next(self, request):
+        # true if request fits and no waiting request of higher
+        # priority also fits
+        return self._fits(*request[2:]) and not any(
+            other[:2] < request[:2] and self._fits(*other[2:])
+            for other in self.waiting)
+
+    def run(self, job):
+        ncores, mem = self._request(job)
+        with self.condition:
+            request = (-job.priority, next(self.counter), ncores, mem)
+            self.waiting.append(request)
+            try:
+                self.condition.wait_for(lambda: self._next(request))
+            finally:
+                self.waiting.remove(request)
+            self.free_cores -= ncores
+            if self.mem:
+                self.free_mem -= mem
+        try:
+            return job.spawn()
+        finally:
+            with self.condition:
+                self.free_cores += ncores
+                if self.mem:
+                    self.free_mem += mem
+                self.condition.notify_all()
+
+
+def _parse_time(timelimit):
+    """Return the number of minutes in a slurm time limit (eg,
+    '90', '1:30:00', '2-12'), rounding seconds up, or None if there is
+    no limit ('UNLIMITED' or 'infinite').
+
+    """
+
+    timelimit = str(timelimit).strip()
+    if timelimit.lower() in ('unlimited', 'infinite'):
+        return None
+    days, __, rest = timelimit.rpartition('-')
+    parts = [int(x) for x in rest.split(':')]
+    if days:
+        # days-hours[:minutes[:seconds]]
+        parts += [0] * (3 - len(parts))
+        hours, minutes, seconds = parts
+        hours += int(days) * 24
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        # minutes[:seconds]
+        hours = 0
+        minutes, seconds = (parts + [0])[:2]
+    return hours * 60 + minutes + (1 if seconds else 0)
+
+
+class RetryPolicy(object):
+    """
+    Resubmits srun and salloc commands that fail because they ran out
+    of memory or time, with ``mem`` (or ``mem_per_cpu``) or
+    ``timelimit`` multiplied by ``mem_factor`` or ``time_factor``, up
+    to a total of ``max_attempts`` attempts. ``default_mem`` and
+    ``default_time`` are used as the starting point when a command
+    did not request memory or a time limit.
+
+    The reason for a failure is identified by the state reported by
+    ``sacct`` if the id of the job is known (eg, when telemetry is
+    enabled), or from messages written to stderr by srun and
+    slurmstepd. Limits not
+    requested by the command are taken from the execution
+    environment (eg, ``SLURM_TIMELIMIT`` set by ``SetTimeLimit``) or
+    from ``sacct``, and resources are never decreased.
+
+    Attempts are appended to ``log`` (by default
+    ``.bioscons_retries.jsonl`` in the same directory as the .sconsign
+    database), and the resources of the last successful attempt for
+    a target are used for its first attempt in subsequent builds
+    where they exceed the resources requested.
+    """
+
+    # variables in the execution environment providing limits not
+    # given as options to srun or salloc
+    env_vars = {
+        'srun': {'timelimit': 'SLURM_TIMELIMIT',
+                 'mem': 'SLURM_MEM_PER_NODE',
+                 'mem_per_cpu': 'SLURM_MEM_PER_CPU'},
+        'salloc': {'timelimit': 'SALLOC_TIMELIMIT',
+                   'mem': 'SALLOC_MEM_PER_NODE',
+                   'mem_per_cpu': 'SALLOC_MEM_PER_CPU'},
+    }
+
+    # messages written to stderr by slurm identifying the reason for a
+    # failure; output of the command itself is not matched
+    reasons = [
+        ('OUT_OF_MEMORY', re.compile(
+            r'^(slurmstepd|srun): error: .*(oom-kill event|'
+            r'Exceeded (job|step) memory limit|task \d+: Out Of Memory)',
+            re.MULTILINE)),
+        ('TIMEOUT', re.compile(
+            r'^(slurmstepd|srun): error: \*\*\* (JOB|STEP) \S+ '
+            r'.*CANCELLED.* DUE TO TIME LIMIT', re.MULTILINE)),
+    ]
+
+    def __init__(self, max_attempts=3, mem_factor=2, time_factor=2,
+                 default_mem='4G', default_time=60, log=None):
+        self.max_attempts = max_attempts
+        self.mem_factor = mem_factor
+        self.time_factor = time_factor
+        self.default_mem = default_mem
+        self.default_time = default_time
+        self.log = log
+        self.learned = None
+        self.lock = threading.Lock()
+
+    def _log_file(self):
+        return self.log or os.path.join(
+            _telemetry._sconsign_dir(), '.bioscons_retries.jsonl')
+
+    def _learned(self):
+        """Return a dict of the resources of the most recent successful
+        attempt for each logged target
+
+        """
+
+        with self.lock:
+            if self.learned is None:
+                self.learned = {}
+                try:
+                    with open(self._log_file()) as f:
+                        for line in f:
+                            try:
+                                rec = json.loads(line)
+                            except ValueError:
+                                continue
+                            if rec['status'] == 0:
+                                self.learned[rec['target']] = rec['resources']
+                except FileNotFoundError:
+                    pass
+            return self.learned
+
+    def reason(self, job, status):
+        """Return 'OUT_OF_MEMORY', 'TIMEOUT' or None for ``job``, which
+        failed with exit status ``status``
+
+        """
+
+        state = self._accounting(job, ['State']).get('State', '')
+        for reason, __ in self.reasons:
+            if reason in state:
+                return reason
+
+        for reason, pattern in self.reasons:
+            if pattern.search(job.stderr or ''):
+                return reason
+        return None
+
+    def _accounting(self, job, fields):
+        """Return a dict of ``fields`` reported by sacct for ``job``,
+        which is empty if the id of the job is not known
+
+        """
+
+        if not job.slurm_job_id:
+            return {}
+        try:
+            output = subprocess.run(
+                ['sacct', '-j', job.slurm_job_id, '-X', '-n', '-P',
+                 '-o', ','.join(fields)], env=job.ENV,
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                universal_newlines=True).stdout
+        except OSError:
+            return {}
+        lines = output.splitlines()
+        return dict(zip(fields, lines[0].split('|'))) if lines else {}
+
+    def _accounting_limit(self, job, key):
+        """Return the limit named by ``key`` reported by sacct for
+        ``job`` as a string, or None
+
+        """
+
+        if key == 'timelimit':
+            return self._accounting(job, ['Timelimit']).get('Timelimit')
+        # eg, '4G' or (in older versions) '4000Mn' per node or '1000Mc'
+        # per cpu
+        mem = self._accounting(job, ['ReqMem']).get('ReqMem', '')
+        suffix = 'c' if key == 'mem_per_cpu' else 'n'
+        if mem.endswith(suffix):
+            return mem[:-1]
+        elif mem[-1:].isalpha() and key == 'mem':
+            return mem
+        return None
+
+    def limit(self, job, resources, key, accounting=False):
+        """Return the limit named by ``key`` ('mem' or 'mem_per_cpu'
+        in MB, or 'timelimit' in minutes) for ``job`` given the
+        requested ``resources``, ``math.inf`` if there is no limit
+        (eg, 'UNLIMITED'), or None if unknown. Limits not in
+        ``resources`` are taken from the execution environment. If
+        ``accounting`` is True and the limit is unknown or unlimited,
+        the limit reported by sacct is used if available.
+
+        """
+
+        parse = _parse_time if key == 'timelimit' else _parse_mem
+
+        def first(values):
+            for value in values:
+                if value:
+                    try:
+                        limit = parse(value)
+                    except ValueError:
+                        continue
+                    return math.inf if limit is None else limit
+            return None
+
+        var = self.env_vars.get(job.slurm_cmd, {}).get(key)
+        limit = first([resources.get(key), job.ENV.get(var) if var else None])
+        if accounting and limit in (None, math.inf):
+            # eg, the limit of the partition
+            limit = first([self._accounting_limit(job, key)]) or limit
+        return limit
+
+    def _mem_key(self, job, resources):
+        """Return 'mem_per_cpu' if only memory per cpu is requested,
+        otherwise 'mem'
+
+        """
+
+        env = job.ENV if job else {}
+        env_vars = self.env_vars.get(getattr(job, 'slurm_cmd', None), {})
+
+        def requested(key):
+            return resources.get(key) or env.get(env_vars.get(key))
+
+        if requested('mem_per_cpu') and not requested('mem'):
+            return 'mem_per_cpu'
+        return 'mem'
+
+    def escalate(self, resources, reason, job=None):
+        """Return a copy of ``resources`` with memory or time increased
+        to address ``reason``, starting from the limits of the last
+        attempt of ``job`` if provided (see ``limit``)
+
+        """
+
+        resources = dict(resources)
+        if reason == 'OUT_OF_MEMORY':
+            key = self._mem_key(job, resources)
+            mem = job and self.limit(job, resources, key, accounting=True)
+            mem = mem or _parse_mem(resources.get(key) or self.default_mem)
+            resources[key] = '{}M'.format(
+                max(math.ceil(mem * self.mem_factor), mem))
+        elif reason == 'TIMEOUT':
+            if job is not None:
+                minutes = self.limit(
+                    job, resources, 'timelimit', accounting=True)
+            else:
+                minutes = _parse_time(
+                    resources.get('timelimit') or self.default_time)
+            if minutes in (None, math.inf):
+                minutes = _parse_time(self.default_time)
+            resources['timelimit'] = str(
+                max(math.ceil(minutes * self.time_factor), minutes))
+        return resources
+
+    def record(self, job, attempt, status, reason):
+        rec = {'target': str(job.target[0]), 'attempt': attempt,
+               'time': time.time(), 'status': status, 'reason': reason,
+               'resources': {k: job.resources.get(k)
+                             for k in ('mem', 'mem_per_cpu', 'timelimit')
+                             if job.resources.get(k)}}
+        with self.lock:
+            with open(self._log_file(), 'a') as f:
+                f.write(json.dumps(rec) + '\n')
+            if status == 0 and self.learned is not None:
+                self.learned[rec['target']] = rec['resources']
+
+    def run(self, job, launch):
+        """Run ``job`` using ``launch(job)`` until it succeeds, fails for
+        a reason other than memory or time, or ``max_attempts`` is
+        reached. Returns the result of the last attempt.
+
+        """
+
+        target = str(job.target[0])
+        learned = self._learned().get(target)
+        if learned:
+            # unless the requested resources are larger
+            resources = dict(job.resources)
+            for key, value in learned.items():
+                parse = _parse_time if key == 'timelimit' else _parse_mem
+                current = self.limit(job, resources, key)
+                try:
+                    value_limit = parse(value)
+                except ValueError:
+                    continue
+                if value_limit is not None and (
+                        current is None or value_limit > current):
+                    resources[key] = value
+            job.set_resources(resources)
+
+        job.capture = True
+        for attempt in range(1, self.max_attempts + 1):
+            job.stderr = ''
+            job.slurm_job_id = None
+            result = launch(job)
+            status = getattr(result, 'status', result) or 0
+            reason = self.reason(job, status) if status else None
+            if reason or attempt > 1:
+                self.record(job, attempt, status, reason)
+            if not reason or attempt == self.max_attempts:
+                return result
+            job.set_resources(self.escalate(job.resources, reason, job))
+            sys.stderr.write('{} failed ({}); retrying with {}\n'.format(
+                target, reason, _resource_args(job.resources, job.slurm_cmd)))
+        return result
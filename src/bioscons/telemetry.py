@@ -0,0 +1,325 @@
+"""
+Record the resources used by commands run by a SlurmEnvironment.
+
+When telemetry is enabled (``SlurmEnvironment(telemetry=True)``),
+each command is run by a small wrapper (``python -m bioscons.telemetry
+run``) inside srun, which records the time the command started, its
+wall time, cpu time (user + system, including all child processes),
+maximum resident set size and exit status. After the command finishes
+a record for each target is appended to a JSON lines file in the same
+directory as the ``.sconsign`` database.
+
+Records have the following fields:
+
+* ``target`` - list of targets of the command
+* ``name`` - the job name (usually the name of the executable)
+* ``host``, ``slurm_job_id`` - where the command ran
+* ``submitted`` - time (seconds since the epoch) the command was
+  dispatched by scons
+* ``queue_wait`` - seconds between dispatch and the start of the
+  command (this includes the time waiting for resources and depends
+  on the clocks of the submit and compute hosts agreeing)
+* ``wall``, ``cpu`` - elapsed and cpu time of the command in seconds
+* ``maxrss`` - maximum resident set size of the largest process in MB
+* ``ncores``, ``mem`` - cores and memory (MB) requested
+* ``status`` - exit status
+* ``state`` - one of COMPLETED, FAILED, SIGNALED or NOT_STARTED
+
+Summarize the records with::
+
+  python -m bioscons.telemetry report [.bioscons_telemetry.jsonl]
+
+which lists the slowest targets and those using the smallest fraction
+of the cpus they requested.
+"""
+
+import argparse
+import json
+import math
+import os
+import resource
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+TELEMETRY_FILE = '.bioscons_telemetry.jsonl'
+
+
+def _sconsign_dir():
+    """Return the directory containing the .sconsign database"""
+    try:
+        import SCons.SConsign
+        return os.path.dirname(SCons.SConsign.DB_Name or '')
+    except (ImportError, AttributeError):
+        return ''
+
+
+class Telemetry(object):
+    """
+    Runs jobs from a launcher (or directly) with a wrapper recording
+    resource usage, and appends a record for each to ``filename``
+    (by default ``TELEMETRY_FILE`` in the directory containing the
+    .sconsign database). Statistics are passed from the wrapper using
+    files in ``workdir``, which must be readable from the compute
+    nodes. ``python`` is the interpreter used to run the wrapper.
+    """
+
+    def __init__(self, filename=None, workdir='.bioscons', python=None):
+        self.filename = filename
+        self.workdir = workdir
+        self.python = python or sys.executable
+        self.lock = threading.Lock()
+
+    def wrap(self, command, shell, statfile):
+        """Return a command running ``command`` with ``shell`` that
+        writes statistics to ``statfile``.
+
+        """
+
+        return '{} -m bioscons.telemetry run --stats {} -- {} -c {}'.format(
+            shlex.quote(self.python), shlex.quote(statfile), shell,
+            shlex.quote(command))
+
+    def run(self, job, launcher=None):
+        """Run ``job`` with ``launcher`` (or ``job.spawn()`` if None)
+        and record its resource usage. Returns the result of the
+        launcher.
+
+        """
+
+        os.makedirs(self.workdir, exist_ok=True)
+        fd, statfile = tempfile.mkstemp(
+            prefix='telemetry-', suffix='.json', dir=self.workdir)
+        os.close(fd)
+        statfile = os.path.abspath(statfile)
+
+        command = job.command
+        submitted = time.time()
+        job.command = self.wrap(command, job.shell, statfile)
+        try:
+            status = launcher.run(job) if launcher else job.spawn()
+        finally:
+            job.command = command
+
+        try:
+            self.record(job, submitted, statfile, status)
+        finally:
+            os.remove(statfile)
+        return status
+
+    def record(self, job, submitted, statfile, status):
+        """Append a record for ``job`` using statistics in ``statfile``"""
+
+        try:
+            with open(statfile) as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+
+        job.slurm_job_id = stats.get('slurm_job_id')
+        status = getattr(status, 'status', status) or 0
+        rec = {
+            'target': [str(t) for t in job.target],
+            'name': job.name,
+            'host': stats.get('host'),
+            'slurm_job_id': stats.get('slurm_job_id'),
+            'submitted': submitted,
+            'queue_wait': None,
+            'wall': stats.get('wall'),
+            'cpu': stats.get('cpu'),
+            'maxrss': stats.get('maxrss'),
+            'ncores': job.ncores,
+            'mem': job.mem,
+            'status': stats.get('status', status),
+            'state': stats.get('state', 'NOT_STARTED'),
+        }
+        if 'start' in stats:
+            rec['queue_wait'] = max(stats['start'] - submitted, 0)
+
+        filename = self.filename or os.path.join(
+            _sconsign_dir(), TELEMETRY_FILE)
+        line = json.dumps(rec) + '\n'
+        with self.lock:
+            with open(filename, 'a') as f:
+                f.write(line)
+
+
+def run_command(command, statfile):
+    """Run ``command`` (a list of arguments), write statistics to
+    ``statfile`` and return an exit status.
+
+    """
+
+    start = time.time()
+    try:
+        proc = subprocess.Popen(command)
+    except OSError as err:
+        sys.stderr.write('{}: {}\n'.format(command[0], err))
+        returncode = 127
+    else:
+        # let the command handle interrupts
+        handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            returncode = proc.wait()
+        finally:
+            signal.signal(signal.SIGINT, handler)
+    wall = time.time() - start
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if returncode < 0:
+        status, state = 128 - returncode, 'SIGNALED'
+    else:
+        status, state = returncode, 'COMPLETED' if returncode == 0 else 'FAILED'
+
+    stats = {
+        'host': socket.gethostname(),
+        'slurm_job_id': os.environ.get('SLURM_JOB_ID'),
+        'start': start,
+        'wall': wall,
+        'cpu': usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in KB on linux and bytes on macOS
+        'maxrss': usage.ru_maxrss / (
+            1024 ** 2 if sys.platform == 'darwin' else 1024),
+        'status': status,
+        'state': state,
+    }
+    tmp = statfile + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(stats, f)
+    os.replace(tmp, statfile)
+    return status
+
+
+def read_records(filename):
+    """Return a dict of the most recent record for each target in
+    ``filename`` keyed by the first target.
+
+    """
+
+    records = {}
+    with open(filename) as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            records[rec['target'][0]] = rec
+    return records
+
+
+def runtimes(filename=None):
+    """Return a dict of the wall time of the most recent successful
+    run of each target recorded in ``filename`` (by default
+    ``TELEMETRY_FILE`` next to the .sconsign database), or an empty
+    dict if the file does not exist.
+
+    """
+
+    filename = filename or os.path.join(_sconsign_dir(), TELEMETRY_FILE)
+    try:
+        records = read_records(filename)
+    except FileNotFoundError:
+        return {}
+    result = {}
+    for rec in records.values():
+        if rec['state'] == 'COMPLETED' and rec.get('wall') is not None:
+            for target in rec['target']:
+                result[target] = rec['wall']
+    return result
+
+
+def efficiency(rec):
+    """Return the fraction of the requested cpu time used by the
+    command described by ``rec``, or None if not known.
+
+    """
+
+    if not rec.get('wall') or rec.get('cpu') is None:
+        return None
+    return rec['cpu'] / (rec['wall'] * (rec.get('ncores') or 1))
+
+
+def report(records, n=10, min_wall=1.0, out=None):
+    """Write tables of the ``n`` slowest targets and the ``n``
+    targets running at least ``min_wall`` seconds with the lowest
+    cpu efficiency to ``out`` (default stdout).
+
+    """
+
+    out = out or sys.stdout
+    finished = [r for r in records.values() if r.get('wall') is not None]
+    fmt = '{:>10} {:>10} {:>6} {:>6} {:>10} {:>9}  {}\n'
+    header = fmt.format('wall', 'queue', 'ncores', 'eff', 'maxrss_mb',
+                        'state', 'target')
+
+    def row(rec):
+        eff = efficiency(rec)
+        return fmt.format(
+            '{:.1f}'.format(rec['wall']),
+            '{:.1f}'.format(rec['queue_wait'] or 0),
+            rec.get('ncores') or 1,
+            '' if eff is None else '{:.2f}'.format(eff),
+            '{:.0f}'.format(rec.get('maxrss') or 0),
+            rec['state'], rec['target'][0])
+
+    out.write('slowest targets\n')
+    out.write(header)
+    for rec in sorted(finished, key=lambda r: r['wall'], reverse=True)[:n]:
+        out.write(row(rec))
+
+    out.write('\nlowest cpu efficiency (suggested ncores in brackets)\n')
+    out.write(header)
+    candidates = [r for r in finished
+                  if r['wall'] >= min_wall and efficiency(r) is not None]
+    for rec in sorted(candidates, key=efficiency)[:n]:
+        suggested = max(math.ceil(rec['cpu'] / rec['wall']), 1)
+        out.write(row(rec).rstrip('\n') + ' [{}]\n'.format(suggested))
+
+    failed = [r for r in records.values() if r['state'] != 'COMPLETED']
+    if failed:
+        out.write('\n{} targets did not complete\n'.format(len(failed)))
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bioscons.telemetry', description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='subcommand')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser(
+        'run', help='run a command, recording resource usage')
+    run_parser.add_argument('--stats', required=True,
+                            help='file to write statistics to')
+    run_parser.add_argument('command', nargs=argparse.REMAINDER)
+
+    report_parser = subparsers.add_parser(
+        'report', help='summarize recorded resource usage')
+    report_parser.add_argument('filename', nargs='?', default=TELEMETRY_FILE)
+    report_parser.add_argument('-n', type=int, default=10,
+                               help='number of targets to list [%(default)s]')
+    report_parser.add_argument(
+        '--min-wall', type=float, default=1.0,
+        help='minimum wall time (seconds) of targets listed by '
+        'efficiency [%(default)s]')
+
+    args = parser.parse_args(arguments)
+    if args.subcommand == 'run':
+        command = args.command
+        if command and command[0] == '--':
+            command = command[1:]
+        if not command:
+            parser.error('no command provided')
+        return run_command(command, args.stats)
+    else:
+        report(read_records(args.filename), args.n, args.min_wall)
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,10 @@
+import collections
+import functools
+import logging
+import os
 import os.path
+import sys
+import time
 from os.path import join
 
 try:
@@ -7,18 +13,169 @@ except ImportError:
     # we expect this to fail unless imported from within SConstruct
     pass
 
-class verbose(object):
+
+class _TraceState(object):
+    """Settings of verbose(); see enable_tracing()"""
+
+    enabled = False
+    every = 1
+    logger = None
+    buffer = None
+
+
+_trace = _TraceState()
+
+# decorated functions, for trace_summary()
+_traced = []
+
+TraceRecord = collections.namedtuple(
+    'TraceRecord', ['name', 'start', 'seconds', 'args', 'kwargs'])
+
+
+def _every(sample):
+    """Return n such that one in every n calls is sampled"""
+    if not 0 < sample <= 1:
+        raise ValueError('sample must be greater than 0 and at most 1')
+    return max(1, int(round(1 / sample)))
+
+
+def enable_tracing(sample=1.0, buffer_size=None, logger='bioscons.trace'):
+    """
+    Record calls to functions decorated with :func:`verbose`. The
+    number and total duration of all calls is counted, and one in
+    every ``1/sample`` calls is recorded as a :class:`TraceRecord`:
+
+    * logged at level DEBUG to ``logger`` (a name or
+      ``logging.Logger``; None to disable), which has no effect
+      unless a handler is configured, eg using
+      ``logging.basicConfig(level=logging.DEBUG)``
+    * appended to a buffer of the most recent ``buffer_size`` records
+      if provided (see :func:`trace_records`)
+
+    Tracing is also enabled when bioscons.utils is imported if the
+    environment variable ``BIOSCONS_TRACE`` is set to the sampling
+    rate (eg, ``BIOSCONS_TRACE=0.01``).
+    """
+
+    every = _every(sample)
+    if isinstance(logger, str):
+        logger = logging.getLogger(logger)
+    _trace.every = every
+    _trace.logger = logger
+    _trace.buffer = collections.deque(maxlen=buffer_size) \
+        if buffer_size else None
+    _trace.enabled = True
+
+
+def disable_tracing():
+    """Stop recording calls to functions decorated with :func:`verbose`"""
+
+    _trace.enabled = False
+
+
+def trace_records():
+    """Return a list of the records in the buffer (see
+    :func:`enable_tracing`), oldest first.
+
+    """
+
+    return list(_trace.buffer or [])
+
+
+def trace_summary(out=None):
+    """Write the calls and time spent in each function decorated with
+    :func:`verbose` to ``out`` (default stdout).
+
+    """
+
+    out = out or sys.stdout
+    fmt = '{:>10} {:>10} {:>12}  {}\n'
+    out.write(fmt.format('calls', 'seconds', 'mean (ms)', 'function'))
+    for t in sorted(_traced, key=lambda t: -t.seconds):
+        if t.calls:
+            out.write(fmt.format(
+                t.calls, '{:.3f}'.format(t.seconds),
+                '{:.3f}'.format(1000 * t.seconds / t.calls), t.name))
+
+
+class Traced(object):
     """
-    Decorator class to provide more verbose progress messages.
+    Records calls to the function ``f`` decorated with
+    :func:`verbose` (available as its attribute ``trace``). ``calls``
+    and ``seconds`` are the number and total duration of calls while
+    tracing was enabled; counts may be approximate when ``f`` is
+    called from several threads.
     """
-    def __init__(self, f):
+
+    def __init__(self, f, sample=None):
         self.f = f
+        self.name = getattr(f, '__qualname__', repr(f))
+        self.every = None if sample is None else _every(sample)
+        self.calls = 0
+        self.seconds = 0.0
+        _traced.append(self)
 
     def __call__(self, *args, **kwargs):
-        print("entering", self.f.__name__,
-              'called with arguments', args, kwargs)
-        self.f(*args, **kwargs)
-        print("exiting", self.f.__name__)
+        start = time.perf_counter()
+        try:
+            return self.f(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            self.calls += 1
+            self.seconds += seconds
+            if (self.calls - 1) % (self.every or _trace.every) == 0:
+                self.record(TraceRecord(self.name, start, seconds,
+                                        args, kwargs))
+
+    def record(self, rec):
+        if _trace.buffer is not None:
+            _trace.buffer.append(rec)
+        if _trace.logger is not None:
+            _trace.logger.debug('%s %.6fs args=%r kwargs=%r',
+                                rec.name, rec.seconds, rec.args, rec.kwargs)
+        # shown in the trace written by bioscons.profiling
+        from bioscons import profiling
+        if profiling._profiler is not None:
+            profiling._profiler.event('call', rec.name, rec.start, rec.seconds)
+
+
+def verbose(f=None, sample=None):
+    """
+    Decorator recording the duration of calls to ``f`` when tracing
+    is enabled (see :func:`enable_tracing`); otherwise ``f`` is
+    called with only the cost of checking a flag. ``sample`` overrides
+    the sampling rate of :func:`enable_tracing` for this function.
+    Returns the result of ``f``; the counts of calls are available as
+    ``f.trace`` (a :class:`Traced` instance).
+
+    Example::
+
+      @verbose
+      def helper(...):
+          ...
+
+      @verbose(sample=0.001)
+      def called_often(...):
+          ...
+    """
+
+    if f is None:
+        return functools.partial(verbose, sample=sample)
+
+    traced = Traced(f, sample)
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        if not _trace.enabled:
+            return f(*args, **kwargs)
+        return traced(*args, **kwargs)
+
+    wrapper.trace = traced
+    return wrapper
+
+
+if os.environ.get('BIOSCONS_TRACE'):
+    enable_tracing(float(os.environ['BIOSCONS_TRACE']))
 
 
 def getvars(config, secnames, indir=None, outdir=None,
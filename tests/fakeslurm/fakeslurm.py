@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+"""A local stand-in for the slurm commands srun, salloc, sbatch, sacct,
+scancel and scontrol, for testing and benchmarking bioscons.slurm without a
+cluster.
+
+Each command in this directory runs this script with its own name as
+the first argument. Commands are run on the local host; job ids,
+cores in use and an accounting log are kept in a state directory.
+
+Behavior is configured using environment variables:
+
+* FAKESLURM_STATE - state directory (default $TMPDIR/fakeslurm-$USER)
+* FAKESLURM_LATENCY - seconds each job waits in the "queue" before
+  starting; either a number or MIN,MAX for a uniform random delay
+  (default 0). Job steps within an allocation start immediately.
+* FAKESLURM_CPUS - number of cores available; jobs wait until the
+  cores they request (--cpus-per-task x --ntasks) are free (default:
+  unlimited)
+* FAKESLURM_MAX_MEM - largest memory request (MB) that can be
+  satisfied; larger requests fail immediately (default: unlimited)
+* FAKESLURM_JOB_MEM - memory (MB) used by each job; jobs requesting
+  less with --mem are killed with an out of memory error
+* FAKESLURM_JOB_TIME - minutes used by each job; jobs requesting less
+  with --time are cancelled with a time limit error
+* FAKESLURM_FAIL_RATE - probability that a job fails (default 0)
+* FAKESLURM_FAIL_REASON - OUT_OF_MEMORY, TIMEOUT or FAILED (default),
+  the reason for failures injected with FAKESLURM_FAIL_RATE
+* FAKESLURM_LOG - if set, each command line is appended to this file
+"""
+
+import fcntl
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# short options of srun, salloc and sbatch and their long forms
+ALIASES = {
+    '-A': '--account', '-C': '--constraint', '-J': '--job-name',
+    '-N': '--nodes', '-c': '--cpus-per-task', '-e': '--error',
+    '-n': '--ntasks', '-o': '--output', '-p': '--partition',
+    '-q': '--qos', '-t': '--time',
+}
+
+# options taking a value when not given as --opt=value
+VALUE_OPTIONS = set(ALIASES) | {
+    '--account', '--array', '--constraint', '--cpus-per-task', '--error',
+    '--job-name', '--jobid', '--mem', '--mem-per-cpu', '--nodes',
+    '--ntasks', '--output', '--partition', '--qos', '--time',
+}
+
+SACCT_ALIASES = {'-j': '--jobs', '-o': '--format', '-n': '--noheader',
+                 '-P': '--parsable2', '-X': '--allocations'}
+SACCT_VALUE_OPTIONS = {'-j', '-o', '--jobs', '--format'}
+
+OOM_MESSAGE = ('slurmstepd: error: Detected 1 oom-kill event(s) in '
+               'StepId={jobid}.0. Some of your processes may have been '
+               'killed by the cgroup out-of-memory handler.')
+TIMEOUT_MESSAGE = ('slurmstepd: error: *** STEP {jobid}.0 ON localhost '
+                   'CANCELLED AT {now} DUE TO TIME LIMIT ***')
+FAILED_MESSAGE = 'srun: error: localhost: task 0: Exited with exit code 1'
+
+
+def parse_args(args, value_options=VALUE_OPTIONS, aliases=ALIASES):
+    """Return a tuple (options, command) where options is a dict of
+    long option names and values (True for flags), and command is a
+    list of the remaining arguments.
+
+    """
+
+    options = {}
+    args = list(args)
+    while args and args[0].startswith('-'):
+        arg = args.pop(0)
+        if arg == '--':
+            break
+        if '=' in arg and arg.startswith('--'):
+            key, value = arg.split('=', 1)
+        elif arg in value_options:
+            key, value = arg, args.pop(0)
+        else:
+            key, value = arg, True
+        options[aliases.get(key, key)] = value
+    return options, args
+
+
+def parse_mem(mem):
+    """Return memory in MB given a slurm memory specification"""
+    match = re.match(r'^(\d+(?:\.\d+)?)([KMGT]?)B?$', str(mem).upper())
+    number, unit = match.groups()
+    scale = {'K': 1 / 1024, '': 1, 'M': 1, 'G': 1024, 'T': 1024 ** 2}[unit]
+    return int(float(number) * scale)
+
+
+def parse_time(timelimit):
+    """Return minutes given a slurm time limit"""
+    days, __, rest = str(timelimit).rpartition('-')
+    parts = [int(x) for x in rest.split(':')]
+    if days:
+        parts += [0] * (3 - len(parts))
+        return int(days) * 1440 + parts[0] * 60 + parts[1] + bool(parts[2])
+    elif len(parts) == 3:
+        return parts[0] * 60 + parts[1] + bool(parts[2])
+    return parts[0] + (len(parts) > 1 and bool(parts[1]))
+
+
+class State(object):
+    """Job ids, cores in use and accounting records shared among
+    commands, stored in ``dirname``
+
+    """
+
+    def __init__(self, dirname=None):
+        self.dirname = dirname or os.environ.get('FAKESLURM_STATE') or \
+            os.path.join(tempfile.gettempdir(),
+                         'fakeslurm-{}'.format(os.getuid()))
+        os.makedirs(self.dirname, exist_ok=True)
+        self.cpus = int(os.environ.get('FAKESLURM_CPUS') or 0)
+
+    @contextmanager
+    def locked(self):
+        with open(os.path.join(self.dirname, 'lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read(self, name, default):
+        try:
+            with open(os.path.join(self.dirname, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def _write(self, name, value):
+        with open(os.path.join(self.dirname, name), 'w') as f:
+            json.dump(value, f)
+
+    def new_jobid(self):
+        with self.locked():
+            jobid = self._read('jobid', 1000) + 1
+            self._write('jobid', jobid)
+        return str(jobid)
+
+    def acquire(self, ncores):
+        """Wait until ``ncores`` are free and mark them as used"""
+        if not self.cpus:
+            return
+        ncores = min(ncores, self.cpus)
+        while True:
+            with self.locked():
+                used = self._read('used', 0)
+                if used + ncores <= self.cpus:
+                    self._write('used', used + ncores)
+                    return
+            time.sleep(0.01)
+
+    def release(self, ncores):
+        if not self.cpus:
+            return
+        with self.locked():
+            used = self._read('used', 0)
+            self._write('used', max(used - min(ncores, self.cpus), 0))
+
+    def record(self, **rec):
+        with self.locked():
+            with open(os.path.join(self.dirname, 'accounting.jsonl'),
+                      'a') as f:
+                f.write(json.dumps(rec) + '\n')
+
+    def records(self):
+        try:
+            with open(os.path.join(self.dirname, 'accounting.jsonl')) as f:
+                return [json.loads(line) for line in f]
+        except OSError:
+            return []
+
+
+def queue_wait():
+    latency = os.environ.get('FAKESLURM_LATENCY')
+    if latency:
+        low, __, high = latency.partition(',')
+        time.sleep(random.uniform(float(low), float(high or low)))
+
+
+def check_limits(options):
+    """Return a tuple (state, message) if the job described by
+    ``options`` should fail before running, or None
+
+    """
+
+    max_mem = os.environ.get('FAKESLURM_MAX_MEM')
+    mem = options.get('--mem')
+    if max_mem and mem and parse_mem(mem) > int(max_mem):
+        return ('FAILED', 'srun: error: Memory specification can not be '
+                'satisfied')
+
+    job_mem = os.environ.get('FAKESLURM_JOB_MEM')
+    if job_mem and mem and parse_mem(mem) < int(job_mem):
+        return ('OUT_OF_MEMORY', OOM_MESSAGE)
+
+    job_time = os.environ.get('FAKESLURM_JOB_TIME')
+    timelimit = options.get('--time')
+    if job_time and timelimit and parse_time(timelimit) < int(job_time):
+        return ('TIMEOUT', TIMEOUT_MESSAGE)
+
+    fail_rate = float(os.environ.get('FAKESLURM_FAIL_RATE') or 0)
+    if fail_rate and random.random() < fail_rate:
+        reason = os.environ.get('FAKESLURM_FAIL_REASON') or 'FAILED'
+        if reason == 'OUT_OF_MEMORY':
+            return (reason, OOM_MESSAGE)
+        elif reason == 'TIMEOUT':
+            return (reason, TIMEOUT_MESSAGE)
+        return ('FAILED', FAILED_MESSAGE)
+    return None
+
+
+# exit statuses of srun for jobs failing for each reason
+FAILURE_STATUS = {'OUT_OF_MEMORY': 137, 'TIMEOUT': 140, 'FAILED': 1}
+
+
+def run_job(state, options, command, name, jobid=None, step=False,
+            env=None, stdout=None):
+    """Run ``command`` as a job (or a job step if ``step`` is True)
+    and return its exit status
+
+    """
+
+    jobid = jobid or state.new_jobid()
+    # steps are recorded as JOBID.STEP
+    recid = '{}.{}'.format(jobid, state.new_jobid()) if step else jobid
+    submitted = time.time()
+    if not step:
+        queue_wait()
+
+    ncores = int(options.get('--cpus-per-task') or 1) * \
+        int(options.get('--ntasks') or 1)
+    failure = check_limits(options)
+    if failure:
+        reason, message = failure
+        sys.stderr.write(message.format(
+            jobid=jobid, now=time.strftime('%Y-%m-%dT%H:%M:%S')) + '\n')
+        state.record(jobid=recid, name=name, state=reason,
+                     exitcode=FAILURE_STATUS[reason], elapsed=0)
+        return FAILURE_STATUS[reason]
+
+    state.acquire(ncores)
+    start = time.time()
+    env = dict(os.environ if env is None else env)
+    env.update(SLURM_JOB_ID=jobid, SLURM_JOB_NAME=name,
+               SLURM_CPUS_PER_TASK=str(ncores),
+               SLURMD_NODENAME='localhost')
+    try:
+        proc = subprocess.Popen(command, env=env, stdout=stdout)
+        try:
+            status = proc.wait()
+        except KeyboardInterrupt:
+            proc.send_signal(signal.SIGINT)
+            status = proc.wait()
+    except OSError as err:
+        sys.stderr.write('srun: error: {}: {}\n'.format(command[0], err))
+        status = 2
+    finally:
+        state.release(ncores)
+
+    if status < 0:
+        status = 128 - status
+    state.record(jobid=recid, name=name,
+                 state='COMPLETED' if status == 0 else 'FAILED',
+                 exitcode=status, elapsed=time.time() - start,
+                 queued=start - submitted)
+    return status
+
+
+def srun(state, args):
+    options, command = parse_args(args)
+    if not command:
+        sys.stderr.write('srun: fatal: No command given to execute.\n')
+        return 1
+    name = options.get('--job-name') or os.path.basename(command[0])
+    jobid = options.get('--jobid')
+    return run_job(state, options, command, name, jobid=jobid,
+                   step=bool(jobid))
+
+
+def salloc(state, args):
+    options, command = parse_args(args)
+    jobid = state.new_jobid()
+    queue_wait()
+    sys.stderr.write('salloc: Granted job allocation {}\n'.format(jobid))
+    if options.get('--no-shell'):
+        state.record(jobid=jobid, name=options.get('--job-name', 'salloc'),
+                     state='RUNNING', exitcode=0, elapsed=0)
+        return 0
+    command = command or [os.environ.get('SHELL', 'sh')]
+    return run_job(state, options, command, os.path.basename(command[0]),
+                   jobid=jobid, step=True)
+
+
+def _array_indices(spec):
+    spec = spec.split('%')[0]
+    indices = []
+    for part in spec.split(','):
+        start, __, end = part.partition('-')
+        indices.extend(range(int(start), int(end or start) + 1))
+    return indices
+
+
+def sbatch(state, args):
+    options, command = parse_args(args)
+    if not options.get('--fakeslurm-run'):
+        jobid = state.new_jobid()
+        if options.get('--wait'):
+            status = _sbatch_run(state, options, command, jobid)
+            print(jobid if options.get('--parsable') else
+                  'Submitted batch job {}'.format(jobid))
+            return status
+        # run in the background
+        subprocess.Popen(
+            [sys.executable, __file__, 'sbatch',
+             '--fakeslurm-run={}'.format(jobid)] + args,
+            start_new_session=True, stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL)
+        print(jobid if options.get('--parsable') else
+              'Submitted batch job {}'.format(jobid))
+        return 0
+    return _sbatch_run(state, options, command, options['--fakeslurm-run'])
+
+
+def _sbatch_run(state, options, command, jobid):
+    script, script_args = command[0], command[1:]
+    name = options.get('--job-name') or os.path.basename(script)
+    output = options.get('--output') or 'slurm-%j.out'
+    indices = _array_indices(options['--array']) \
+        if options.get('--array') else [None]
+
+    procs = []
+    for index in indices:
+        env = dict(os.environ)
+        fname = output.replace('%j', jobid)
+        if index is not None:
+            env['SLURM_ARRAY_TASK_ID'] = str(index)
+            env['SLURM_ARRAY_JOB_ID'] = jobid
+            fname = fname.replace('%a', str(index)).replace('%A', jobid)
+        procs.append((index, env, fname))
+
+    # array tasks are run one after another, each as a job
+    status = 0
+    for index, env, fname in procs:
+        taskid = jobid if index is None else '{}_{}'.format(jobid, index)
+        with open(fname, 'w') as out:
+            result = run_job(state, options, ['sh', script] + script_args,
+                             name, jobid=taskid, env=env, stdout=out)
+        status = status or result
+    return status
+
+
+def sacct(state, args):
+    options, __ = parse_args(args, SACCT_VALUE_OPTIONS, SACCT_ALIASES)
+    fields = (options.get('--format') or
+              'JobID,JobName,State,ExitCode').split(',')
+    columns = {'jobid': 'jobid', 'jobname': 'name', 'state': 'state',
+               'exitcode': 'exitcode', 'elapsed': 'elapsed'}
+    jobids = options.get('--jobs', '').split(',') if options.get(
+        '--jobs') else None
+
+    latest = {}
+    for rec in state.records():
+        latest[rec['jobid']] = rec
+    lines = []
+    if not options.get('--noheader'):
+        lines.append(fields)
+    for jobid, rec in latest.items():
+        if jobids and jobid not in jobids:
+            continue
+        row = []
+        for field in fields:
+            value = rec.get(columns.get(field.lower(), ''), '')
+            if field.lower() == 'exitcode':
+                value = '{}:0'.format(value)
+            row.append(str(value))
+        lines.append(row)
+    sep = '|' if options.get('--parsable2') or options.get(
+        '--parsable') else ' '
+    for row in lines:
+        print(sep.join(row))
+    return 0
+
+
+def scancel(state, args):
+    __, jobids = parse_args(args)
+    names = {rec['jobid']: rec['name'] for rec in state.records()}
+    for jobid in jobids:
+        state.record(jobid=jobid, name=names.get(jobid, ''),
+                     state='CANCELLED', exitcode=0, elapsed=0)
+    return 0
+
+
+def scontrol(state, args):
+    """Supports only ``scontrol show job JOBID``"""
+    if args[:2] != ['show', 'job'] or len(args) < 3:
+        sys.stderr.write('scontrol: only "show job JOBID" is supported\n')
+        return 1
+    for rec in state.records():
+        if rec['jobid'] == args[2]:
+            print('JobId={jobid} JobName={name} JobState={state}'.format(
+                **rec))
+    return 0
+
+
+COMMANDS = {'srun': srun, 'salloc': salloc, 'sbatch': sbatch,
+            'sacct': sacct, 'scancel': scancel, 'scontrol': scontrol}
+
+
+def main(argv):
+    command, args = os.path.basename(argv[0]), argv[1:]
+    if command not in COMMANDS:
+        sys.stderr.write('usage: fakeslurm.py {} [args]\n'.format(
+            '|'.join(COMMANDS)))
+        return 2
+    log = os.environ.get('FAKESLURM_LOG')
+    if log:
+        with open(log, 'a') as f:
+            f.write(' '.join([command] + args) + '\n')
+    return COMMANDS[command](State(), args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,122 @@
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+from bioscons import cache
+
+SCONSTRUCT = """
+import os
+from bioscons.slurm import SlurmEnvironment
+
+env = SlurmEnvironment(ENV=os.environ, use_cluster=False,
+                       cache=ARGUMENTS['cache'])
+count = env.Command('count.txt', 'in.txt',
+                    'wc -c $SOURCE > $TARGET; echo ran >> ran.log')
+env.Command('upper.txt', count, 'tr a-z A-Z < $SOURCE > $TARGET')
+env.Command('uncached.txt', 'in.txt', 'cp $SOURCE $TARGET', cache=False)
+"""
+
+
+class TestDerivedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cachedir = path.join(self.tmpdir.name, 'cache')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def checkout(self, name, text='input\n'):
+        dirname = path.join(self.tmpdir.name, name)
+        os.mkdir(dirname)
+        with open(path.join(dirname, 'SConstruct'), 'w') as f:
+            f.write(SCONSTRUCT)
+        with open(path.join(dirname, 'in.txt'), 'w') as f:
+            f.write(text)
+        return dirname
+
+    def scons(self, dirname):
+        proc = subprocess.run(
+            [sys.executable, '-m', 'SCons', '-Q', 'cache=' + self.cachedir],
+            cwd=dirname, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        return proc.stdout
+
+    def runs(self, dirname):
+        try:
+            with open(path.join(dirname, 'ran.log')) as f:
+                return len(f.readlines())
+        except FileNotFoundError:
+            return 0
+
+    def test_shared(self):
+        first = self.checkout('first')
+        self.scons(first)
+        self.assertEqual(self.runs(first), 1)
+
+        second = self.checkout('second')
+        output = self.scons(second)
+        self.assertEqual(self.runs(second), 0)
+        self.assertIn('Retrieved `count.txt', output)
+        self.assertIn('Retrieved `upper.txt', output)
+        self.assertIn('cp in.txt uncached.txt', output)
+        for fname in ['count.txt', 'upper.txt']:
+            with open(path.join(first, fname)) as a, \
+                    open(path.join(second, fname)) as b:
+                self.assertEqual(a.read(), b.read())
+
+        # different input
+        third = self.checkout('third', 'other input\n')
+        self.scons(third)
+        self.assertEqual(self.runs(third), 1)
+
+        records = cache.read_log(path.join(self.cachedir, cache.LOG_FILE))
+        events = [r['event'] for r in records]
+        self.assertEqual(events.count('hit'), 2)
+        self.assertEqual(events.count('store'), 4)
+
+        out = io.StringIO()
+        cache.report(records, self.cachedir, out)
+        self.assertIn('4 entries', out.getvalue())
+
+    def test_actions(self):
+        sconstruct = SCONSTRUCT + (
+            "env.Command('steps.txt', 'in.txt', "
+            "['cat $SOURCE > $TARGET', 'echo ran >> ran.log', "
+            "'echo done >> $TARGET'])\n")
+        dirnames = [self.checkout(name) for name in ['first', 'second']]
+        for dirname in dirnames:
+            with open(path.join(dirname, 'SConstruct'), 'w') as f:
+                f.write(sconstruct)
+            self.scons(dirname)
+        self.assertEqual([self.runs(d) for d in dirnames], [2, 0])
+        with open(path.join(dirnames[1], 'steps.txt')) as f:
+            self.assertEqual(f.read(), 'input\ndone\n')
+
+        # one lookup and one store per command
+        records = cache.read_log(path.join(self.cachedir, cache.LOG_FILE))
+        events = [r['event'] for r in records if r['target'] == 'steps.txt']
+        self.assertEqual(events, ['miss', 'store', 'hit'])
+
+    def test_evict(self):
+        self.scons(self.checkout('first'))
+        self.scons(self.checkout('second', 'other input\n'))
+        derived = cache.DerivedCache(self.cachedir)
+        entries = sorted(cache.iter_entries(self.cachedir))
+        self.assertEqual(len(entries), 4)
+
+        total = sum(size for __, __, size in entries)
+        removed, freed = derived.evict(total - 1)
+        self.assertEqual(removed, 1)
+        self.assertFalse(path.exists(entries[0][1]))
+        self.assertEqual(len(list(cache.iter_entries(self.cachedir))), 3)
+
+    def test_parse_size(self):
+        self.assertEqual(cache.parse_size(100), 100)
+        self.assertEqual(cache.parse_size('2K'), 2048)
+        self.assertEqual(cache.parse_size('1.5G'), 1.5 * 1024 ** 3)
+        self.assertRaises(ValueError, cache.parse_size, 'big')
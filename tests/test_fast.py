@@ -0,0 +1,133 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import shutil
+import unittest
+from os import path
+
+from bioscons import fast, fileutils
+
+SCONSTRUCT = """
+import os
+from bioscons.fast import fast
+
+env = Environment(ENV=os.environ)
+fast(env, ARGUMENTS['profile'], decider=ARGUMENTS.get('decider'))
+env.Command('out.txt', 'in.txt', 'cat $SOURCE > $TARGET')
+"""
+
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(path.join(self.tmpdir.name, 'SConstruct'), 'w') as f:
+            f.write(SCONSTRUCT)
+        self.mtime = time.time() - 3600
+        self.write('input\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, text):
+        fname = path.join(self.tmpdir.name, 'in.txt')
+        with open(fname, 'w') as f:
+            f.write(text)
+        # a distinct timestamp
+        self.mtime += 10
+        os.utime(fname, (self.mtime, self.mtime))
+
+    def built(self, profile, *args):
+        """Return True if out.txt was built"""
+        proc = subprocess.run(
+            [sys.executable, '-m', 'SCons', '-Q', 'profile=' + profile] +
+            list(args),
+            cwd=self.tmpdir.name, check=True, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        return 'cat in.txt' in proc.stdout
+
+
+class TestFast(BuildTest):
+
+    def test_profiles(self):
+        for profile in fast.PROFILES:
+            with self.subTest(profile=profile):
+                self.write(profile + '\n')
+                self.assertTrue(self.built(profile))
+                self.assertFalse(self.built(profile))
+
+                # new timestamp, same content
+                self.write(profile + '\n')
+                self.assertFalse(self.built(profile))
+
+                # new size
+                self.write(profile + '-modified\n')
+                self.assertTrue(self.built(profile))
+
+                # new content, same size
+                self.write(profile + '-changed!\n')
+                if profile == 'large-files':
+                    # detected by SizeInodeDecider only if the digest
+                    # file is updated
+                    fileutils.write_digest(
+                        path.join(self.tmpdir.name, 'in.txt'))
+                self.assertTrue(self.built(profile))
+
+    def test_unknown_profile(self):
+        self.assertRaises(ValueError, fast.fast, None, 'nonexistent')
+
+
+class TestSizeInodeDecider(BuildTest):
+
+    def built(self, *args):
+        return super().built('default', 'decider=size-inode', *args)
+
+    def copy(self):
+        """Replace in.txt with a copy (with a new inode)"""
+        fname = path.join(self.tmpdir.name, 'in.txt')
+        shutil.copy2(fname, fname + '.tmp')
+        os.replace(fname + '.tmp', fname)
+
+    def test_decider(self):
+        fname = path.join(self.tmpdir.name, 'in.txt')
+        self.assertTrue(self.built())
+        self.assertFalse(self.built())
+
+        # touched
+        self.write('input\n')
+        self.assertFalse(self.built())
+
+        # new inode with and without a digest file
+        self.copy()
+        self.assertFalse(self.built())
+        fileutils.write_digest(fname)
+        self.copy()
+        self.assertFalse(self.built())
+
+        # modified in place and the digest file updated
+        self.write('INPUT\n')
+        fileutils.write_digest(fname)
+        self.assertTrue(self.built())
+
+        # new size
+        self.write('new input\n')
+        self.assertTrue(self.built())
+
+    def test_trusted(self):
+        fname = path.join(self.tmpdir.name, 'in.txt')
+        cache = fileutils.DigestCache(path.join(self.tmpdir.name, 'db'))
+        decider = fast.SizeInodeDecider(cache)
+        digest = decider.digest(fname, os.stat(fname))
+        self.assertEqual(digest, fileutils.file_digest(fname))
+
+        # same size and inode: the file is not read
+        self.write('INPUT\n')
+        self.assertEqual(decider.digest(fname, os.stat(fname)), digest)
+
+        # unless the digest file disagrees
+        self.write('Input\n')
+        fileutils.write_digest(fname)
+        self.assertNotEqual(decider.digest(fname, os.stat(fname)), digest)
+        cache.close()
@@ -1,7 +1,23 @@
+import bz2
+import contextlib
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import shutil
+import tempfile
 import unittest
 import logging
+from os import path
+from unittest import mock
 
-from bioscons.fileutils import rename, split_path
+from bioscons.fileutils import (rename, split_path, file_digest,
+                                write_digest, check_digest, DigestCache,
+                                file_digests, write_digests, check_digests,
+                                Targets, TargetRegistry, copy_file,
+                                compression_format, strip_compression_suffix,
+                                decompress_file)
 
 log = logging
 
@@ -50,3 +66,358 @@ class TestSplitPath(unittest.TestCase):
         self.assertTrue(split_path(fname) == split_path([fname]))
         self.assertTrue(split_path(fname) == split_path((fname,)))
         self.assertTrue(split_path(fname) == split_path((fname, None)))
+
+
+class TestDigest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = path.join(self.tmpdir.name, 'test.txt')
+        self.data = b'ACGT' * 100000
+        with open(self.fname, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_file_digest(self):
+        self.assertEqual(file_digest(self.fname),
+                         hashlib.md5(self.data).hexdigest())
+        self.assertEqual(file_digest(self.fname, 'sha256', chunksize=1000),
+                         hashlib.sha256(self.data).hexdigest())
+
+    def test_bad_algorithm(self):
+        with self.assertRaises(ValueError):
+            file_digest(self.fname, 'nosuchhash')
+
+    def test_write_and_check(self):
+        digest = write_digest(self.fname)
+        with open(self.fname + '.md5') as f:
+            self.assertEqual(f.read(), digest)
+        self.assertTrue(check_digest(self.fname))
+
+        with open(self.fname, 'ab') as f:
+            f.write(b'N')
+        self.assertFalse(check_digest(self.fname))
+
+    def test_dirname_and_algorithm(self):
+        outdir = path.join(self.tmpdir.name, 'digests')
+        os.mkdir(outdir)
+        self.assertFalse(check_digest(self.fname, outdir, 'blake2b'))
+        write_digest(self.fname, outdir, 'blake2b')
+        self.assertTrue(path.exists(path.join(outdir, 'test.txt.blake2b')))
+        self.assertTrue(check_digest(self.fname, outdir, 'blake2b'))
+
+
+class TestDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = path.join(self.tmpdir.name, 'test.txt')
+        with open(self.fname, 'wb') as f:
+            f.write(b'ACGT' * 1000)
+        self.cache = DigestCache(path.join(self.tmpdir.name, 'digests.db'))
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmpdir.cleanup()
+
+    def test_cached(self):
+        self.assertIsNone(self.cache.get(self.fname))
+        digest = write_digest(self.fname, cache=self.cache)
+        self.assertEqual(self.cache.get(self.fname), digest)
+        self.assertTrue(check_digest(self.fname, cache=self.cache))
+
+    def test_modified(self):
+        self.cache.digest(self.fname)
+        with open(self.fname, 'ab') as f:
+            f.write(b'N')
+        self.assertIsNone(self.cache.get(self.fname))
+        self.assertEqual(self.cache.digest(self.fname),
+                         file_digest(self.fname))
+
+    def test_persistent(self):
+        digest = self.cache.digest(self.fname, 'sha256')
+        self.cache.close()
+        self.cache = DigestCache(self.cache.filename)
+        self.assertEqual(self.cache.get(self.fname, 'sha256'), digest)
+        self.assertIsNone(self.cache.get(self.fname, 'md5'))
+
+    def test_eviction(self):
+        self.cache.max_entries = 2
+        for i in range(4):
+            fname = path.join(self.tmpdir.name, '{}.txt'.format(i))
+            with open(fname, 'w') as f:
+                f.write(str(i))
+            self.cache.digest(fname)
+        self.cache.close()
+        self.cache = DigestCache(self.cache.filename)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNotNone(
+            self.cache.get(path.join(self.tmpdir.name, '3.txt')))
+
+
+class TestBatchDigests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fnames = []
+        for i in range(10):
+            fname = path.join(self.tmpdir.name, '{}.txt'.format(i))
+            with open(fname, 'w') as f:
+                f.write(str(i) * 1000)
+            self.fnames.append(fname)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_file_digests(self):
+        calls = []
+        results = file_digests(self.fnames, jobs=4,
+                               progress=lambda *args: calls.append(args))
+        self.assertEqual(results, {f: file_digest(f) for f in self.fnames})
+        self.assertEqual(len(calls), len(self.fnames))
+        self.assertEqual(calls[-1][:2], (10, 10))
+
+    def test_processes(self):
+        results = file_digests(self.fnames, 'sha256', jobs=2, processes=True)
+        self.assertEqual(
+            results, {f: file_digest(f, 'sha256') for f in self.fnames})
+
+    def test_write_and_check(self):
+        self.assertFalse(any(check_digests(self.fnames).values()))
+        with DigestCache(path.join(self.tmpdir.name, 'digests.db')) as cache:
+            write_digests(self.fnames[:5], jobs=2, cache=cache)
+            self.assertEqual(len(cache), 5)
+            results = check_digests(self.fnames, jobs=2, cache=cache)
+        self.assertEqual(results, {f: i < 5 for i, f in enumerate(self.fnames)})
+
+
+class TestTargetRegistry(unittest.TestCase):
+
+    def test_registry(self):
+        paths = ['out/a.txt', './out/b.txt', 'out/s1/a.txt', 'top.txt']
+        registry = TargetRegistry(paths)
+        registry.add('out/a.txt')
+        self.assertEqual(len(registry), 4)
+        self.assertEqual(
+            sorted(registry), ['out/a.txt', 'out/b.txt', 'out/s1/a.txt',
+                               'top.txt'])
+        self.assertIn('out/b.txt', registry)
+        self.assertIn('out//s1/a.txt', registry)
+        self.assertNotIn('out/s1/b.txt', registry)
+        self.assertEqual(registry.basenames('out'), {'a.txt', 'b.txt'})
+        self.assertEqual(registry.basenames(''), {'top.txt'})
+        self.assertTrue(registry.has_descendants('out'))
+        self.assertFalse(registry.has_descendants('out/s2'))
+
+    def test_curdir(self):
+        registry = TargetRegistry(['./b.txt', 'a.txt'])
+        self.assertIn('b.txt', registry)
+        self.assertIn('./a.txt', registry)
+        self.assertEqual(sorted(registry), ['a.txt', 'b.txt'])
+        self.assertEqual(registry.basenames(''), {'a.txt', 'b.txt'})
+
+    def test_compact(self):
+        registry = TargetRegistry(['s1/a.txt', 's2/a.txt', './s1/b.txt'])
+        registry.compact()
+        self.assertIn('s1/b.txt', registry)
+        registry.update(['s1/c.txt', './s1/d.txt', 's2/a.txt'])
+        self.assertEqual(len(registry), 5)
+        self.assertEqual(registry.basenames('s1'),
+                         {'a.txt', 'b.txt', 'c.txt', 'd.txt'})
+        self.assertEqual(registry.basenames('s2'), {'a.txt'})
+
+    def test_interned(self):
+        registry = TargetRegistry(
+            ['s1/' + ''.join(['aln', '.bam']), 's2/aln.bam'])
+        (a,), (b,) = registry.basenames('s1'), registry.basenames('s2')
+        self.assertIs(a, b)
+
+
+class TestTargets(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        for fname in ['out/a.txt', 'out/b.txt', 'out/sub/c.txt',
+                      'out/junk/d.txt', 'out/junk/e.txt']:
+            os.makedirs(path.dirname(fname), exist_ok=True)
+            with open(fname, 'w') as f:
+                f.write(fname)
+
+        self.targets = Targets()
+        self.targets.targets.update(['out/a.txt', 'out/sub/c.txt'])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_iter_extras(self):
+        self.assertEqual(
+            sorted(self.targets.iter_extras('out')),
+            ['out/b.txt', 'out/junk/d.txt', 'out/junk/e.txt'])
+        self.assertEqual(sorted(self.targets.iter_extras('./out/')),
+                         sorted(self.targets.iter_extras('out')))
+
+    def test_prune(self):
+        self.assertEqual(
+            sorted(self.targets.iter_extras('out', prune=True)),
+            ['out/b.txt', 'out/junk/'])
+
+    def test_curdir(self):
+        self.targets.targets.add('out/b.txt')
+        self.assertEqual(sorted(self.targets.iter_extras('.', prune=True)),
+                         ['out/junk/'])
+
+    def test_snapshot(self):
+        snapshot = path.join(self.tmpdir.name, 'snapshot')
+        self.assertEqual(
+            len(list(self.targets.iter_extras('out', snapshot=snapshot))), 3)
+        self.assertTrue(path.exists(snapshot))
+
+        # out/junk appears unmodified, so its saved listing is used
+        st = os.stat('out/junk')
+        with open('out/junk/f.txt', 'w'):
+            pass
+        os.utime('out/junk', ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.remove('out/b.txt')
+        self.assertEqual(
+            sorted(self.targets.iter_extras('out', snapshot=snapshot)),
+            ['out/junk/d.txt', 'out/junk/e.txt'])
+
+    def test_missing_directory(self):
+        self.assertEqual(list(self.targets.iter_extras('does-not-exist')), [])
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            self.targets.show_extras('does-not-exist')
+        self.assertEqual(out.getvalue(), '')
+
+    def test_removed_subdirectory(self):
+        listdir = self.targets._listdir
+
+        # out/junk is removed after out is listed
+        def remove_junk(dirname, previous, current):
+            listing = listdir(dirname, previous, current)
+            if dirname == 'out':
+                shutil.rmtree('out/junk')
+            return listing
+
+        with mock.patch.object(self.targets, '_listdir', remove_junk):
+            self.assertEqual(sorted(self.targets.iter_extras('out')),
+                             ['out/b.txt'])
+
+    def test_update(self):
+        from SCons.Environment import Environment
+        env = Environment(tools=[])
+        nodes = env.Command('out/b.txt', None, 'touch $TARGET')
+        targets = Targets([nodes, 'out/junk/d.txt', 1])
+        targets.update(env.File(f) for f in ['out/junk/d.txt'])
+        self.assertEqual(sorted(targets.targets),
+                         ['out/b.txt', 'out/junk/d.txt'])
+
+
+class TestCopyFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.src = path.join(self.tmpdir.name, 'src.txt')
+        self.dst = path.join(self.tmpdir.name, 'dst.txt')
+        with open(self.src, 'wb') as f:
+            f.write(os.urandom(100000))
+        os.chmod(self.src, 0o750)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def assertCopied(self):
+        self.assertEqual(file_digest(self.src), file_digest(self.dst))
+        self.assertEqual(os.stat(self.src).st_mode, os.stat(self.dst).st_mode)
+
+    def test_copy(self):
+        copy_file(self.src, self.dst)
+        self.assertCopied()
+        self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+
+    def test_no_bytes_copied(self):
+        # eg, copy_file_range on some FUSE filesystems
+        def copy_nothing(*args):
+            return 0
+
+        def copy_some(infd, outfd, count):
+            return os.write(outfd, os.read(infd, 10))
+
+        for copy_range, sendfile in [(copy_nothing, copy_nothing),
+                                     (copy_some, copy_nothing)]:
+            with mock.patch('bioscons.fileutils._reflink',
+                            side_effect=OSError), \
+                    mock.patch('os.copy_file_range', copy_range,
+                               create=True), \
+                    mock.patch('os.sendfile', sendfile, create=True):
+                copy_file(self.src, self.dst)
+            self.assertCopied()
+
+    def test_replace_hardlink(self):
+        # an existing link to src is replaced rather than overwritten
+        copy_file(self.src, self.dst, mode='hardlink')
+        self.assertEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+        copy_file(self.src, self.dst)
+        self.assertCopied()
+        self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dst).st_ino)
+
+    def test_bad_mode(self):
+        with self.assertRaises(ValueError):
+            copy_file(self.src, self.dst, mode='symlink')
+
+
+class TestDecompress(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = b'ACGT' * 100000
+        self.fnames = {}
+        for fmt, module in [('gz', gzip), ('bz2', bz2), ('xz', lzma)]:
+            fname = path.join(self.tmpdir.name, 'seqs.fasta.' + fmt)
+            with module.open(fname, 'wb') as f:
+                f.write(self.data)
+            self.fnames[fmt] = fname
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_compression_format(self):
+        for fmt, fname in self.fnames.items():
+            self.assertEqual(compression_format(fname), fmt)
+        self.assertIsNone(compression_format(__file__))
+
+    def test_strip_compression_suffix(self):
+        self.assertEqual(strip_compression_suffix('a.fa.gz'), 'a.fa')
+        self.assertEqual(strip_compression_suffix('a.fa.zstd'), 'a.fa')
+        self.assertEqual(strip_compression_suffix('a.fa.bgz'), 'a.fa')
+        self.assertEqual(strip_compression_suffix('a.fa'), 'a.fa')
+
+    def test_decompress_file(self):
+        dst = path.join(self.tmpdir.name, 'seqs.fasta')
+        for fname in self.fnames.values():
+            for use_tools in (True, False):
+                decompress_file(fname, dst, threads=2, use_tools=use_tools)
+                with open(dst, 'rb') as f:
+                    self.assertEqual(f.read(), self.data)
+
+    def test_emitter(self):
+        from SCons.Environment import Environment
+        from bioscons.fileutils import decompress
+        env = Environment(tools=[], BUILDERS={'Decompress': decompress})
+        for source, target in [('a.fq.gz', 'a.fq'),
+                               ('b.fq.bgz', 'b.fq'),
+                               ('c.fq.zstd', 'c.fq'),
+                               ('d.fq.gzip', 'd.fq')]:
+            node, = env.Decompress(path.join(self.tmpdir.name, source))
+            self.assertEqual(str(node), path.join(self.tmpdir.name, target))
+        node, = env.Decompress(path.join(self.tmpdir.name, 'out.fq'),
+                               path.join(self.tmpdir.name, 'in.fq.gz'))
+        self.assertEqual(path.basename(str(node)), 'out.fq')
+
+    def test_not_compressed(self):
+        with self.assertRaises(ValueError):
+            decompress_file(__file__, path.join(self.tmpdir.name, 'x'))
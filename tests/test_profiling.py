@@ -0,0 +1,107 @@
+import bz2
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from os import path
+
+from bioscons import profiling
+
+SCONSTRUCT = """
+import os
+from bioscons import profiling
+from bioscons.fileutils import bunzip2, copyfile
+from bioscons.slurm import SlurmEnvironment
+
+profiling.enable(trace='trace.json', summary='summary.txt')
+
+env = SlurmEnvironment(ENV=os.environ, use_cluster=False)
+env.Append(BUILDERS={'copyfile': copyfile, 'bunzip2': bunzip2})
+env.copyfile('copy.txt', 'in.txt')
+env.bunzip2('data.txt.bz2')
+env.Command('count.txt', 'copy.txt', 'wc -c $SOURCE > $TARGET')
+SConscript('sub/SConscript', exports='env')
+"""
+
+SUB_SCONSCRIPT = """
+Import('env')
+env.Command('upper.txt', '#in.txt', 'tr a-z A-Z < $SOURCE > $TARGET')
+"""
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        dirname = self.tmpdir.name
+        with open(path.join(dirname, 'SConstruct'), 'w') as f:
+            f.write(SCONSTRUCT)
+        os.mkdir(path.join(dirname, 'sub'))
+        with open(path.join(dirname, 'sub', 'SConscript'), 'w') as f:
+            f.write(SUB_SCONSCRIPT)
+        with open(path.join(dirname, 'in.txt'), 'w') as f:
+            f.write('input\n')
+        with bz2.open(path.join(dirname, 'data.txt.bz2'), 'wt') as f:
+            f.write('data\n')
+
+        subprocess.run([sys.executable, '-m', 'SCons', '-Q'],
+                       cwd=dirname, check=True, stdout=subprocess.PIPE)
+        with open(path.join(dirname, 'trace.json')) as f:
+            self.trace = json.load(f)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def events(self, category):
+        return [e for e in self.trace['traceEvents']
+                if e.get('cat') == category]
+
+    def test_trace(self):
+        phases = [e['name'] for e in self.events('phase')]
+        self.assertEqual(phases, ['read SConscript files', 'build targets'])
+        self.assertIn(path.join('sub', 'SConscript'),
+                      [e['name'] for e in self.events('read')])
+
+        builders = {e['name']: e['args']['builder']
+                    for e in self.events('execute')}
+        self.assertEqual(builders, {
+            'copy.txt': 'copyfile',
+            'data.txt': 'bunzip2',
+            'count.txt': 'local',
+            path.join('sub', 'upper.txt'): 'local',
+        })
+        for e in self.events('execute'):
+            self.assertEqual(e['ph'], 'X')
+            self.assertGreaterEqual(e['dur'], 0)
+
+        totals = self.trace['otherData']['totals']
+        self.assertEqual(totals['execute'][0], 4)
+        self.assertGreater(totals['signature'][0], 0)
+
+    def test_summary(self):
+        out = io.StringIO()
+        profiling.summary(self.trace, out)
+        text = out.getvalue()
+        for name in ['build targets', 'execute', 'copyfile', 'bunzip2',
+                     'slowest targets']:
+            self.assertIn(name, text)
+
+        with open(path.join(self.tmpdir.name, 'summary.txt')) as f:
+            self.assertEqual(f.read(), text)
+
+    def test_builder_name(self):
+        import SCons.Environment
+        from bioscons.fileutils import copyfile
+
+        env = SCons.Environment.Environment(tools=[])
+        env.Append(BUILDERS={'Copy': copyfile})
+        node, = env.Copy(path.join(self.tmpdir.name, 'x'),
+                         path.join(self.tmpdir.name, 'in.txt'))
+        self.assertEqual(profiling.builder_name(node.get_executor()),
+                         'copyfile')
+        node, = env.Command(path.join(self.tmpdir.name, 'y'), None,
+                            'sort -o $TARGET')
+        self.assertEqual(profiling.builder_name(node.get_executor()), 'sort')
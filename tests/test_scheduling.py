@@ -0,0 +1,141 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from os import path
+
+from bioscons import scheduling, slurm
+
+FAKE_SRUN = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+for last; do :; done
+exec sh -c "$last"
+"""
+
+# a -> b -> c (long chain) and d, e, f (short, independent)
+DEPS = {'a': [], 'b': ['a'], 'c': ['b'], 'd': [], 'e': [], 'f': []}
+RUNTIMES = {'a': 2, 'b': 2, 'c': 2, 'd': 3, 'e': 3, 'f': 3}
+
+
+class TestScheduling(unittest.TestCase):
+
+    def test_topological_order(self):
+        order = scheduling.topological_order(DEPS)
+        self.assertLess(order.index('a'), order.index('b'))
+        self.assertLess(order.index('b'), order.index('c'))
+        with self.assertRaises(ValueError):
+            scheduling.topological_order({'a': ['b'], 'b': ['a']})
+
+    def test_longest_paths(self):
+        paths = scheduling.longest_paths(DEPS, RUNTIMES)
+        self.assertEqual(paths, {'a': 6, 'b': 4, 'c': 2,
+                                 'd': 3, 'e': 3, 'f': 3})
+        self.assertEqual(scheduling.longest_paths(DEPS, {}, default=1)['a'], 3)
+
+    def test_simulate(self):
+        fifo = scheduling.simulate(
+            {'d': [], 'e': [], 'f': [], 'a': [], 'b': ['a'], 'c': ['b']},
+            RUNTIMES, slots=2)
+        self.assertEqual(scheduling.makespan(fifo), 9)
+        prioritized = scheduling.simulate(
+            DEPS, RUNTIMES, slots=2,
+            priority=scheduling.longest_paths(DEPS, RUNTIMES))
+        self.assertEqual(prioritized['a'], (0, 2))
+        self.assertEqual(scheduling.makespan(prioritized), 8)
+
+
+class TestCriticalPath(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        with open(path.join(self.tmpdir.name, 'srun'), 'w') as f:
+            f.write(FAKE_SRUN)
+        os.chmod(path.join(self.tmpdir.name, 'srun'), 0o755)
+        self.telemetry = path.join(self.tmpdir.name, 'telemetry.jsonl')
+        with open(self.telemetry, 'w') as f:
+            for name, wall in [('a', 100), ('b', 100), ('c', 10)]:
+                f.write(json.dumps({'target': [self.target(name)],
+                                    'wall': wall, 'state': 'COMPLETED'}))
+                f.write('\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def target(self, name):
+        return path.join(self.tmpdir.name, 'critical-{}.txt'.format(name))
+
+    def test_environment(self):
+        env = slurm.SlurmEnvironment(
+            ENV={'PATH': self.tmpdir.name + os.pathsep + os.environ['PATH']},
+            critical_path=self.telemetry)
+        a = env.Command(self.target('a'), None, 'echo a > $TARGET')
+        # b depends on a through an intermediate file not built by srun
+        tmp = env.Install(path.join(self.tmpdir.name, 'tmp'), a)
+        b = env.Command(self.target('b'), tmp, 'cat $SOURCE > $TARGET')
+        c = env.Command(self.target('c'), None, 'echo c > $TARGET')
+
+        cp = env.critical_path
+        self.assertEqual(cp.dependencies()[self.target('b')],
+                         {self.target('a')})
+        self.assertEqual(cp.priority(a[0]), 200)
+        self.assertEqual((cp.nice(a[0]), cp.nice(b[0]), cp.nice(c[0])),
+                         (0, 500, 950))
+
+        action, = c[0].get_executor().get_action_list()
+        self.assertEqual(action.execute(c, [], env), 0)
+        with open(path.join(self.tmpdir.name, 'calls')) as f:
+            self.assertTrue(f.read().startswith('--nice=950 -J echo'))
+        with open(self.target('c')) as f:
+            self.assertEqual(f.read(), 'c\n')
+
+    def test_peak_concurrency(self):
+        schedule = {'a': (0, 2), 'b': (2, 4), 'c': (1, 3), 'd': (0, 0)}
+        self.assertEqual(scheduling.peak_concurrency(schedule), 2)
+        self.assertEqual(scheduling.peak_concurrency(
+            schedule, {'a': 4, 'b': 1, 'c': 2}), 6)
+
+
+class TestEstimate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.telemetry = path.join(self.tmpdir.name, 'telemetry.jsonl')
+        with open(self.telemetry, 'w') as f:
+            f.write(json.dumps({'target': [self.target('a')], 'wall': 3600,
+                                'state': 'COMPLETED'}) + '\n')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def target(self, name):
+        return path.join(self.tmpdir.name, 'estimate-{}.txt'.format(name))
+
+    def test_estimate(self):
+        env = slurm.SlurmEnvironment(ENV={'PATH': os.environ['PATH']})
+        a = env.SRun(self.target('a'), None, 'true', ncores=4)
+        env.SRun(self.target('b'), a, 'true', ncores=2, timelimit='30')
+        env.SRun([self.target('c'), self.target('c2')], None, 'true',
+                 timelimit='1:00:00')
+        env.Clone().Command(self.target('d'), None, 'true')
+
+        out = io.StringIO()
+        result = env.Estimate(jobs=2, telemetry=self.telemetry, out=out)
+        self.assertEqual(result['runtime_sources'],
+                         {'history': 1, 'timelimit': 2, 'default': 1})
+        self.assertEqual(result['targets'], 4)
+        # a: 4 core-hours, b: 1, c: 1, d: 1 (the median of known runtimes)
+        self.assertEqual(result['core_hours'], 7)
+        self.assertEqual(result['critical_path'], 5400)
+        self.assertEqual(result['makespan'], 7200)
+        self.assertEqual(result['peak_jobs'], 2)
+        self.assertIn('core-hours: 7.0', out.getvalue())
+
+    def test_unlimited(self):
+        env = slurm.SlurmEnvironment(ENV={'PATH': os.environ['PATH']})
+        env.SetTimeLimit('UNLIMITED')
+        env.SRun(self.target('a'), None, 'true')
+        env.SRun(self.target('b'), None, 'true')
+        result = env.Estimate(telemetry=self.telemetry, out=io.StringIO())
+        self.assertEqual(result['runtime_sources'],
+                         {'history': 1, 'default': 1})
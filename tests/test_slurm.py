@@ -1,5 +1,17 @@
+import json
+import os
+import re
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
 import unittest
 import logging
+from os import path
 
 from bioscons import slurm
 
@@ -14,6 +26,14 @@ class TestSlurmFunctions(unittest.TestCase):
         if srun:
             self.assertTrue(srun.endswith('srun'))
 
+    def test_parse_mem(self):
+        for mem, mb in [(None, None), (100, 100), ('100', 100),
+                        ('2G', 2048), ('1.5g', 1536), ('1T', 1024 ** 2),
+                        ('2048K', 2)]:
+            self.assertEqual(slurm._parse_mem(mem), mb)
+        with self.assertRaises(ValueError):
+            slurm._parse_mem('lots')
+
     def test_quote(self):
         strings = [
             ('', "''"),
@@ -22,3 +42,710 @@ class TestSlurmFunctions(unittest.TestCase):
 
         for unquoted, quoted in strings:
             self.assertEqual(slurm._quote(unquoted), quoted)
+
+
+def wait_until(predicate, timeout=10):
+    """Poll ``predicate`` until it returns true, failing after
+    ``timeout`` seconds.
+
+    """
+
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting')
+        time.sleep(0.01)
+
+
+def wait_for_file(fname, timeout=20):
+    """Return a shell command waiting up to ``timeout`` seconds for
+    ``fname`` to exist.
+
+    """
+
+    return 'for i in {}; do [ -f {} ] && break; sleep 0.1; done'.format(
+        ' '.join(str(i) for i in range(timeout * 10)), fname)
+
+
+FAKE_SBATCH = """#!{python}
+# run each task of the array locally
+import os, subprocess, sys
+args = dict(a.split('=', 1) for a in sys.argv[1:-1] if '=' in a)
+first, last = map(int, args['--array'].split('-'))
+for i in range(first, last + 1):
+    with open(args['--output'].replace('%a', str(i)), 'w') as log:
+        subprocess.call(['/bin/sh', sys.argv[-1]], stdout=log, stderr=log,
+                        env=dict(os.environ, SLURM_ARRAY_TASK_ID=str(i)))
+with open(os.path.join(os.path.dirname(sys.argv[0]), 'calls'), 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+"""
+
+
+class TestBatchLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sbatch = path.join(self.tmpdir.name, 'sbatch')
+        with open(self.sbatch, 'w') as f:
+            f.write(FAKE_SBATCH.format(python=sys.executable))
+        os.chmod(self.sbatch, stat.S_IRWXU)
+        self.env = slurm.SlurmEnvironment(
+            ENV={'PATH': self.tmpdir.name + os.pathsep + os.environ['PATH']},
+            batch_size=3, batch_wait=0.5)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_actions(self):
+        action, = self.env.Command('a.txt', None, 'true')[0].get_executor(
+        ).get_action_list()
+        self.assertIs(action.launcher, self.env.launcher)
+        action, = self.env.Local('b.txt', None, 'true')[0].get_executor(
+        ).get_action_list()
+        self.assertIsNone(action.launcher)
+
+    def test_batches(self):
+        launcher = slurm._BatchLauncher(
+            3, 0.5, path.join(self.tmpdir.name, 'work'))
+        env = self.env.Clone()
+        env.SetPartition('campus')
+        other = self.env.Clone()
+        other['ENV']['BIOSCONS_TOOL'] = 'other'
+        statuses = {}
+
+        def run(i, e, check=''):
+            job = slurm._SlurmJob(
+                slurm._SlurmAction(check + 'exit {}'.format(i), 'sh',
+                                   'srun', ''),
+                [], [], e)
+            statuses[i] = launcher.run(job)
+
+        threads = [threading.Thread(target=run, args=(i, self.env))
+                   for i in range(4)]
+        threads.append(threading.Thread(target=run, args=(4, env)))
+        # a different execution environment is a separate batch
+        threads.append(threading.Thread(target=run, args=(
+            5, other, '[ "$$BIOSCONS_TOOL" = other ] || exit 9; ')))
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(statuses, {i: i for i in range(6)})
+        with open(path.join(self.tmpdir.name, 'calls')) as f:
+            calls = f.read().splitlines()
+        # one full batch of 3, and three partial batches
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(
+            sorted(c.split('--array=')[1].split()[0] for c in calls),
+            ['0-0', '0-0', '0-0', '0-2'])
+        self.assertEqual(len([c for c in calls if 'campus' in c]), 1)
+
+    def test_release(self):
+        # each job is released when its own task finishes
+        launcher = slurm._BatchLauncher(
+            2, 0.5, path.join(self.tmpdir.name, 'work'), poll_interval=0.05)
+        flag = path.join(self.tmpdir.name, 'flag')
+        statuses = {}
+
+        def run(i, cmd):
+            job = slurm._SlurmJob(
+                slurm._SlurmAction(cmd, 'sh', 'srun', ''), [], [], self.env)
+            statuses[i] = launcher.run(job)
+
+        first = threading.Thread(target=run, args=(0, 'echo first'))
+        first.start()
+        # the first job is task 0
+        wait_until(lambda: launcher.pending)
+        second = threading.Thread(
+            target=run, args=(1, wait_for_file(flag) + '; exit 3'))
+        second.start()
+        first.join(5)
+        self.assertFalse(first.is_alive())
+        self.assertEqual(statuses, {0: 0})
+        self.assertTrue(second.is_alive())
+
+        open(flag, 'w').close()
+        second.join(15)
+        self.assertEqual(statuses, {0: 0, 1: 3})
+
+
+FAKE_SALLOC = """#!/bin/sh
+echo "salloc: Granted job allocation 42" >&2
+"""
+
+FAKE_SRUN = """#!/bin/sh
+echo "srun $@ [$SLURM_PARTITION]" >> "$(dirname $0)/calls"
+for arg; do cmd="$arg"; done
+exec sh -c "$cmd"
+"""
+
+
+class TestAllocationLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for name, script in [('salloc', FAKE_SALLOC), ('srun', FAKE_SRUN)]:
+            fname = path.join(self.tmpdir.name, name)
+            with open(fname, 'w') as f:
+                f.write(script)
+            os.chmod(fname, stat.S_IRWXU)
+        self.env = slurm.SlurmEnvironment(
+            ENV={'PATH': self.tmpdir.name + os.pathsep + os.environ['PATH']},
+            allocation_size=4, allocation_args='--time=60')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_exclusive(self):
+        with self.assertRaises(ValueError):
+            slurm.SlurmEnvironment(batch_size=10, allocation_size=4)
+
+    def test_steps(self):
+        launcher = self.env.launcher
+        launcher.release = lambda ENV: None
+        self.env.SetPartition('campus')
+        for i in range(2):
+            job = slurm._SlurmJob(
+                slurm._SlurmAction('exit {}'.format(i), 'sh', 'srun', ''),
+                [], [], self.env)
+            self.assertEqual(launcher.run(job), i)
+
+        self.assertEqual(launcher.jobid, '42')
+        with open(path.join(self.tmpdir.name, 'calls')) as f:
+            calls = f.read().splitlines()
+        self.assertEqual(
+            calls[0], 'srun --jobid=42 --exact -n 1 -J exit sh -c exit 0 []')
+        self.assertEqual(len(calls), 2)
+
+
+class TestAsyncLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        fname = path.join(self.tmpdir.name, 'srun')
+        with open(fname, 'w') as f:
+            f.write(FAKE_SRUN)
+        os.chmod(fname, stat.S_IRWXU)
+        self.env = slurm.SlurmEnvironment(
+            ENV={'PATH': self.tmpdir.name + os.pathsep + os.environ['PATH']},
+            max_in_flight=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def calls(self):
+        try:
+            with open(path.join(self.tmpdir.name, 'calls')) as f:
+                return f.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def test_in_flight(self):
+        launcher = self.env.launcher
+        flag = path.join(self.tmpdir.name, 'flag')
+        statuses = {}
+
+        def run(i):
+            job = slurm._SlurmJob(
+                slurm._SlurmAction('true', 'sh', 'srun', ''),
+                [], [], self.env)
+            job.command = wait_for_file(flag) + '; exit {}'.format(i)
+            statuses[i] = launcher.run(job)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        # two srun processes are started and two jobs wait
+        wait_until(lambda: len(launcher.waiting) == 2)
+        wait_until(lambda: len(self.calls()) == 2)
+        self.assertEqual(launcher.running, 2)
+
+        open(flag, 'w').close()
+        for t in threads:
+            t.join()
+        self.assertEqual(statuses, {i: i for i in range(4)})
+        self.assertEqual(len(self.calls()), 4)
+
+    def test_priority(self):
+        launcher = slurm._AsyncLauncher(1)
+        flag = path.join(self.tmpdir.name, 'flag')
+
+        def run(priority, command):
+            job = slurm._SlurmJob(
+                slurm._SlurmAction('true', 'sh', 'srun', ''),
+                [], [], self.env)
+            job.priority = priority
+            job.command = command
+            launcher.run(job)
+
+        # jobs queue behind the first until the flag is created
+        threads = [threading.Thread(target=run, args=(0, wait_for_file(flag)))]
+        threads[0].start()
+        wait_until(lambda: launcher.running == 1)
+        for i, priority in enumerate([1, 2, 5, 3]):
+            threads.append(threading.Thread(
+                target=run, args=(priority, 'true {}'.format(priority))))
+            threads[-1].start()
+            wait_until(lambda: len(launcher.waiting) == i + 1)
+
+        open(flag, 'w').close()
+        for t in threads:
+            t.join()
+        started = [int(re.search(r'true (\d+)', c).group(1))
+                   for c in self.calls()[1:]]
+        self.assertEqual(started, [5, 3, 2, 1])
+
+
+class TestLocalScheduler(unittest.TestCase):
+
+    class Job(object):
+        def __init__(self, ncores, mem, running, release, priority=0,
+                     started=None):
+            self.ncores, self.mem, self.running = ncores, mem, running
+            self.release = release
+            self.priority = priority
+            self.started = [] if started is None else started
+
+        def spawn(self):
+            # jobs run until the event ``release`` is set
+            self.started.append(self.priority)
+            self.running.append(self)
+            self.peak = len(self.running)
+            self.release.wait(10)
+            self.running.remove(self)
+            return 0
+
+    def settled(self, scheduler, running, njobs):
+        # every job is either running or waiting for resources; jobs
+        # are added to scheduler.waiting and tested in a single hold
+        # of the lock
+        with scheduler.condition:
+            return len(running) + len(scheduler.waiting) == njobs
+
+    def run_jobs(self, scheduler, requests):
+        running, release = [], threading.Event()
+        jobs = [self.Job(ncores, mem, running, release)
+                for ncores, mem in requests]
+        threads = [threading.Thread(target=scheduler.run, args=(job,))
+                   for job in jobs]
+        for t in threads:
+            t.start()
+        wait_until(lambda: self.settled(scheduler, running, len(jobs)))
+        release.set()
+        for t in threads:
+            t.join()
+        return max(job.peak for job in jobs)
+
+    def test_cores(self):
+        scheduler = slurm._LocalScheduler(ncores=4, mem=1000)
+        self.assertEqual(self.run_jobs(scheduler, [(2, None)] * 4), 2)
+        self.assertEqual(self.run_jobs(scheduler, [(1, None)] * 4), 4)
+        # requests larger than the total run alone
+        self.assertEqual(self.run_jobs(scheduler, [(8, None)] * 2), 1)
+        self.assertEqual(scheduler.free_cores, 4)
+
+    def test_priority(self):
+        scheduler = slurm._LocalScheduler(ncores=1)
+        running, started, release = [], [], threading.Event()
+        threads = []
+        for i, priority in enumerate([0, 1, 5, 3]):
+            job = self.Job(1, None, running, release, priority, started)
+            threads.append(threading.Thread(target=scheduler.run, args=(job,)))
+            threads[-1].start()
+            wait_until(lambda: self.settled(scheduler, running, i + 1))
+        release.set()
+        for t in threads:
+            t.join()
+        # jobs waiting for the first are started by priority
+        self.assertEqual(started, [0, 5, 3, 1])
+
+    def test_mem(self):
+        scheduler = slurm._LocalScheduler(ncores=4, mem='1G')
+        self.assertEqual(self.run_jobs(scheduler, [(1, 512)] * 4), 2)
+        self.assertEqual(scheduler.free_mem, 1024)
+
+    def test_environment(self):
+        env = slurm.SlurmEnvironment(use_cluster=False, local_scheduler=True,
+                                     local_cores=8)
+        action, = env.SRun('a.txt', None, 'true', ncores=4, mem='1G')[
+            0].get_executor().get_action_list()
+        self.assertIs(action.launcher, env.local_scheduler)
+        self.assertEqual((action.ncores, action.mem), (4, '1G'))
+        action, = env.Local('b.txt', None, 'true', ncores=2)[
+            0].get_executor().get_action_list()
+        self.assertIs(action.launcher, env.local_scheduler)
+
+
+class TestResources(unittest.TestCase):
+
+    def setUp(self):
+        self.env = slurm.SlurmEnvironment(ENV={'PATH': os.environ['PATH']})
+
+    def action(self, nodes):
+        action, = nodes[0].get_executor().get_action_list()
+        return action
+
+    def test_resource_args(self):
+        self.assertEqual(
+            slurm._resource_args({'ncores': 4, 'mem': '4G', 'exclusive': True,
+                                  'constraint': 'gpu&fast', 'qos': None}),
+            "--cpus-per-task=4 --mem=4G --exclusive --constraint='gpu&fast'")
+        self.assertEqual(
+            slurm._resource_args({'ncores': 4, 'timelimit': '1:00:00',
+                                  'slurm_queue': 'short'}, 'salloc'),
+            '--ntasks=4 --time=1:00:00 --partition=short')
+        self.assertEqual(
+            slurm._resource_args({'ncores': 1, 'slurm_queue': 'short'},
+                                 exclude=['slurm_queue']), '')
+
+    def test_srun(self):
+        action = self.action(self.env.SRun(
+            'resources-a.txt', None, 'true', mem_per_cpu='2G', ncores=2, qos='long',
+            slurm_args='--hint=nomultithread'))
+        self.assertEqual(action.slurm_args, '--hint=nomultithread')
+        self.assertEqual((action.ncores, action.mem), (2, 4096))
+        self.assertIn('srun --cpus-per-task=2 --mem-per-cpu=2G --qos=long '
+                      '--hint=nomultithread', str(action))
+
+    def test_presig_memo(self):
+        nodes = self.env.SRun('resources-f.txt', 'resources-g.txt',
+                              'cat $SOURCE > $TARGET', ncores=2)
+        action = self.action(nodes)
+        calls = []
+        subst = self.env.subst_target_source
+        self.env.subst_target_source = lambda *args: (
+            calls.append(args) or subst(*args))
+        sources = nodes[0].sources
+        presig = action.get_presig(nodes, sources, self.env)
+        self.assertEqual(presig, 'cat resources-g.txt > resources-f.txt')
+        self.assertEqual(action.get_presig(list(nodes), sources, self.env),
+                         presig)
+        self.assertEqual(len(calls), 1)
+        # a different target
+        other = self.env.File('resources-h.txt')
+        self.assertEqual(action.get_presig([other], sources, self.env),
+                         'cat resources-g.txt > resources-h.txt')
+        self.assertEqual(len(calls), 2)
+        # a different environment
+        env = self.env.Clone()
+        env['ncores'] = 4
+        self.assertEqual(action.get_presig([other], sources, env),
+                         'cat resources-g.txt > resources-h.txt')
+        self.assertIs(action._presig_memo[1], env)
+
+    def test_srun_no_clone(self):
+        env = slurm.SlurmEnvironment(ENV=os.environ)
+        action = self.action(env.SRun(
+            'resources-e.txt', None, 'true', ncores=4, timelimit='10',
+            slurm_queue='short'))
+        self.assertIn('srun --cpus-per-task=4 --time=10 --partition=short',
+                      str(action))
+        # resources are provided as options rather than by modifying
+        # the (shared) execution environment
+        self.assertIs(env['ENV'], os.environ)
+        self.assertNotIn('SLURM_CPUS_PER_TASK', os.environ)
+
+    def test_profiles(self):
+        self.env.AddProfile('big', ncores=8, mem='64G', nodes=1)
+        action = self.action(self.env.SRun(
+            'resources-a.txt', None, 'true', profile='big', mem='32G'))
+        self.assertEqual(action.slurm_args, '')
+        self.assertEqual((action.ncores, action.mem), (8, '32G'))
+        self.assertIn('srun --cpus-per-task=8 --mem=32G --nodes=1',
+                      str(action))
+
+        action = self.action(self.env.SAlloc(
+            'resources-b.txt', None, 'mpirun true', profile='big', exclusive=True))
+        self.assertIn('salloc --ntasks=8 --mem=64G --nodes=1 --exclusive',
+                      str(action))
+
+        with self.assertRaises(ValueError):
+            self.env.SRun('resources-c.txt', None, 'true', profile='huge')
+        with self.assertRaises(TypeError):
+            self.env.AddProfile('bad', gpus=1)
+        with self.assertRaises(TypeError):
+            self.env.SAlloc('resources-d.txt', None, 'true')
+
+
+class TestWhereIsCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.bindir = path.join(self.tmpdir.name, 'bin')
+        os.mkdir(self.bindir)
+        slurm.clear_whereis_cache()
+
+    def tearDown(self):
+        slurm.clear_whereis_cache()
+        self.tmpdir.cleanup()
+
+    def add_program(self, name):
+        fname = path.join(self.bindir, name)
+        with open(fname, 'w') as f:
+            f.write('#!/bin/sh\n')
+        os.chmod(fname, 0o755)
+        return fname
+
+    def test_cache(self):
+        fname = self.add_program('whereis-prog')
+        env = slurm.SlurmEnvironment(ENV={'PATH': self.bindir})
+        calls = []
+        whereis = env.WhereIs
+        env.WhereIs = lambda *args: calls.append(args) or whereis(*args)
+
+        t1 = env.SRun('whereis-a.txt', None, 'whereis-prog > $TARGET')
+        t2 = env.SRun('whereis-b.txt', None, '${SOURCE and ""}whereis-prog')
+        self.assertEqual(len(calls), 1)
+        dep1, = t1[0].depends
+        dep2, = t2[0].depends
+        self.assertIs(dep1, dep2)
+        self.assertEqual(dep1.abspath, fname)
+
+        # not found, and keyed on PATH
+        env.SRun('whereis-c.txt', None, 'whereis-other')
+        self.assertEqual(len(calls), 2)
+        env['ENV']['PATH'] = os.pathsep.join([self.bindir, '/bin'])
+        env.SRun('whereis-d.txt', None, 'whereis-prog')
+        self.assertEqual(len(calls), 3)
+
+        # newly installed programs are found after invalidation
+        env['ENV']['PATH'] = self.bindir
+        self.add_program('whereis-other')
+        t5 = env.SRun('whereis-e.txt', None, 'whereis-other')
+        self.assertEqual(t5[0].depends, [])
+        slurm.clear_whereis_cache()
+        t6 = env.SRun('whereis-f.txt', None, 'whereis-other')
+        self.assertEqual(len(t6[0].depends), 1)
+
+
+# fails as if out of memory unless at least 4096M is requested, or
+# out of time unless at least 120 minutes are requested
+FAKE_SRUN_LIMITS = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+case "$*" in
+    *--mem=4096M*oom*|*--time=120*timeout*) ;;
+    *oom*)
+        echo "slurmstepd: error: Detected 1 oom-kill event(s) in StepId=1.0" >&2
+        exit 137;;
+    *timeout*)
+        echo "srun: error: *** STEP 1.0 CANCELLED DUE TO TIME LIMIT ***" >&2
+        exit 140;;
+esac
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        fname = path.join(self.tmpdir.name, 'srun')
+        with open(fname, 'w') as f:
+            f.write(FAKE_SRUN_LIMITS)
+        os.chmod(fname, stat.S_IRWXU)
+        self.log = path.join(self.tmpdir.name, 'retries.jsonl')
+        self.env = self.environment()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def environment(self):
+        return slurm.SlurmEnvironment(
+            ENV={'PATH': self.tmpdir.name + os.pathsep + os.environ['PATH']},
+            retry=slurm.RetryPolicy(log=self.log))
+
+    def build(self, nodes, env=None):
+        action, = nodes[0].get_executor().get_action_list()
+        return action.execute(nodes, [], env or self.env)
+
+    def calls(self):
+        with open(path.join(self.tmpdir.name, 'calls')) as f:
+            return [line.split(' -J ')[0] for line in f]
+
+    def test_parse_time(self):
+        for timelimit, minutes in [(90, 90), ('90:30', 91), ('1:30:00', 90),
+                                   ('2-12', 3600), ('1-0:30', 1470),
+                                   ('1-00:00:01', 1441),
+                                   ('UNLIMITED', None), ('infinite', None)]:
+            self.assertEqual(slurm._parse_time(timelimit), minutes)
+
+    def test_unlimited(self):
+        self.env.SetTimeLimit('UNLIMITED')
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-inf.txt'),
+                              None, 'echo timeout', retry=2)
+        self.assertEqual(self.build(nodes), 0)
+        self.assertEqual(self.calls()[-1], '--time=120')
+
+    def test_oom(self):
+        target = path.join(self.tmpdir.name, 'retry-oom.txt')
+        nodes = self.env.SRun(target, None, 'echo oom > $TARGET', mem='1G')
+        self.assertEqual(self.build(nodes), 0)
+        self.assertEqual(self.calls(), ['--mem=1G', '--mem=2048M',
+                                        '--mem=4096M'])
+        with open(target) as f:
+            self.assertEqual(f.read(), 'oom\n')
+        with open(self.log) as f:
+            attempts = [json.loads(line) for line in f]
+        self.assertEqual([(a['attempt'], a['reason']) for a in attempts],
+                         [(1, 'OUT_OF_MEMORY'), (2, 'OUT_OF_MEMORY'),
+                          (3, None)])
+
+        # the next build starts with the learned resources
+        env = self.environment()
+        nodes = env.SRun(target, None, 'echo oom > $TARGET', mem='1G')
+        self.assertEqual(self.build(nodes, env), 0)
+        self.assertEqual(self.calls()[-1], '--mem=4096M')
+
+        # unless more memory is requested
+        env = self.environment()
+        ncalls = len(self.calls())
+        nodes = env.SRun(target, None, 'echo oom > $TARGET', mem='64G')
+        self.build(nodes, env)
+        self.assertEqual(self.calls()[ncalls], '--mem=64G')
+
+    def test_environment_limits(self):
+        # escalated from the limits in the execution environment
+        self.env.SetTimeLimit('1-00:00:00')
+        self.env['ENV']['SLURM_MEM_PER_NODE'] = '3G'
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-env.txt'),
+                              None, 'echo timeout', retry=2)
+        self.assertEqual(self.build(nodes).status, 140)
+        self.assertEqual(self.calls()[-1], '--time=2880')
+
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-env.txt'),
+                              None, 'echo oom', retry=2)
+        self.assertEqual(self.build(nodes).status, 137)
+        self.assertEqual(self.calls()[-1], '--mem=6144M')
+
+    def test_timeout(self):
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-time.txt'),
+                              None, 'echo timeout', timelimit=30, retry=2)
+        status = self.build(nodes)
+        self.assertEqual(status.status, 140)
+        self.assertEqual(self.calls(), ['--time=30', '--time=60'])
+
+    def test_accounting_limits(self):
+        fname = path.join(self.tmpdir.name, 'sacct')
+        with open(fname, 'w') as f:
+            f.write('#!/bin/sh\ncase "$*" in\n'
+                    '    *ReqMem*) echo 8000Mn;;\n'
+                    '    *Timelimit*) echo 02:00:00;;\n'
+                    'esac\n')
+        os.chmod(fname, stat.S_IRWXU)
+        job = types.SimpleNamespace(
+            slurm_cmd='srun', slurm_job_id='5', ENV=self.env['ENV'])
+        retry = slurm.RetryPolicy()
+        self.assertEqual(retry.escalate({}, 'OUT_OF_MEMORY', job),
+                         {'mem': '16000M'})
+        self.assertEqual(retry.escalate({}, 'TIMEOUT', job),
+                         {'timelimit': '240'})
+        self.assertEqual(retry.limit(job, {}, 'mem_per_cpu', True), None)
+
+    def test_other_failure(self):
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-fail.txt'),
+                              None, 'exit 3')
+        self.assertEqual(self.build(nodes).status, 3)
+        self.assertEqual(len(self.calls()), 1)
+
+        # messages from the command itself are ignored
+        nodes = self.env.SRun(
+            path.join(self.tmpdir.name, 'retry-message.txt'), None,
+            'echo "java.lang.OutOfMemoryError: out of memory" >&2; '
+            'echo "error: TIMEOUT DUE TO TIME LIMIT" >&2; exit 3')
+        self.assertEqual(self.build(nodes).status, 3)
+        self.assertEqual(len(self.calls()), 2)
+
+        nodes = self.env.SRun(path.join(self.tmpdir.name, 'retry-none.txt'),
+                              None, 'echo oom', retry=False)
+        action, = nodes[0].get_executor().get_action_list()
+        self.assertIsNone(action.retry)
+
+
+FAKESLURM = path.join(path.dirname(path.abspath(__file__)), 'fakeslurm')
+
+SCONSTRUCT = """
+import os
+from bioscons.slurm import SlurmEnvironment
+
+env = SlurmEnvironment(ENV=os.environ, {options})
+first = env.Command('a.txt', None, 'echo a > $TARGET')
+for name in 'bcd':
+    env.SRun(name + '.txt', first, 'cat $SOURCE > $TARGET; echo ' + name +
+             ' >> $TARGET', ncores=2{srun_options})
+env.Command('e.txt', ['b.txt', 'c.txt', 'd.txt'], 'cat $SOURCES > $TARGET')
+"""
+
+
+class TestFakeSlurm(unittest.TestCase):
+    """Builds using the stand-in slurm commands in tests/fakeslurm"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = dict(
+            os.environ,
+            PATH=FAKESLURM + os.pathsep + os.environ['PATH'],
+            FAKESLURM_STATE=path.join(self.tmpdir.name, 'state'),
+            FAKESLURM_PYTHON=sys.executable,
+            FAKESLURM_CPUS='4')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scons(self, dirname, *args):
+        return subprocess.run(
+            [sys.executable, '-m', 'SCons', '-Q', '-j', '4'] + list(args),
+            cwd=dirname, env=self.env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def sacct(self):
+        out = subprocess.check_output(
+            ['sacct', '-n', '-P', '-o', 'JobName,State'], env=self.env,
+            universal_newlines=True)
+        return [line.split('|') for line in out.splitlines()]
+
+    def build(self, options='', srun_options=''):
+        dirname = path.join(self.tmpdir.name, 'build')
+        os.mkdir(dirname)
+        with open(path.join(dirname, 'SConstruct'), 'w') as f:
+            f.write(SCONSTRUCT.format(options=options,
+                                      srun_options=srun_options))
+        proc = self.scons(dirname)
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        with open(path.join(dirname, 'e.txt')) as f:
+            self.assertEqual(f.read().split(), 'a b a c a d'.split())
+        return proc
+
+    def test_srun(self):
+        self.build()
+        self.assertEqual(len(self.sacct()), 5)
+
+    def test_batch(self):
+        self.build('batch_size=3, batch_wait=0.5')
+        names = [name for name, state in self.sacct()]
+        self.assertIn('bioscons-batch', names)
+
+    def test_allocation(self):
+        self.build('allocation_size=4')
+        names = [name for name, state in self.sacct()]
+        self.assertIn('bioscons-allocation', names)
+
+    def test_max_in_flight(self):
+        self.build('max_in_flight=2')
+
+    def test_retry(self):
+        self.env['FAKESLURM_JOB_MEM'] = '3000'
+        self.build('retry=True', srun_options=", mem='2G'")
+        states = sorted(state for name, state in self.sacct())
+        self.assertEqual(states.count('OUT_OF_MEMORY'), 3)
+        self.assertEqual(states.count('COMPLETED'), 5)
+
+    def test_example(self):
+        # a copy of tests/slurm to keep .sconsign out of the source tree
+        dirname = path.join(self.tmpdir.name, 'slurm')
+        shutil.copytree(path.join(path.dirname(FAKESLURM), 'slurm'), dirname)
+        out = path.join(self.tmpdir.name, 'out')
+        proc = self.scons(dirname, 'out=' + out, out)
+        self.assertEqual(proc.returncode, 0, proc.stdout)
+        self.assertEqual(len(os.listdir(out)), 5)
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from os import path
+
+from bioscons import slurm, telemetry
+
+FAKE_SRUN = """#!/bin/sh
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = path.join(self.tmpdir.name, 'telemetry.jsonl')
+        self.workdir = path.join(self.tmpdir.name, 'work')
+        srun = path.join(self.tmpdir.name, 'srun')
+        with open(srun, 'w') as f:
+            f.write(FAKE_SRUN)
+        os.chmod(srun, 0o755)
+        self.PATH = os.pathsep.join([self.tmpdir.name, os.environ['PATH']])
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def build(self, builder, name, action, **kw):
+        env = builder.__self__
+        target = path.join(self.tmpdir.name, name)
+        nodes = builder(target, None, action, **kw)
+        act, = nodes[0].get_executor().get_action_list()
+        self.assertIs(act.telemetry, env.telemetry)
+        return act.execute(nodes, [], env), target
+
+    def records(self):
+        with open(self.filename) as f:
+            return [json.loads(line) for line in f]
+
+    def test_run_command(self):
+        statfile = path.join(self.tmpdir.name, 'stats.json')
+        status = telemetry.run_command(['sh', '-c', 'exit 3'], statfile)
+        self.assertEqual(status, 3)
+        with open(statfile) as f:
+            stats = json.load(f)
+        self.assertEqual((stats['status'], stats['state']), (3, 'FAILED'))
+        self.assertGreaterEqual(stats['wall'], 0)
+
+    def test_environment(self):
+        env = slurm.SlurmEnvironment(
+            ENV={'PATH': self.PATH}, telemetry=telemetry.Telemetry(
+                self.filename, workdir=self.workdir, python=sys.executable))
+
+        status, target = self.build(
+            env.SRun, 'telemetry-a.txt', 'x=hello; echo "$$x" > $TARGET',
+            ncores=2)
+        self.assertEqual(status, 0)
+        with open(target) as f:
+            self.assertEqual(f.read().strip(), 'hello')
+
+        status, target = self.build(
+            env.Command, 'telemetry-b.txt', 'exit 2', use_cluster=False)
+        self.assertEqual(status.status, 2)
+
+        rec_a, rec_b = self.records()
+        self.assertEqual(rec_a['target'], [path.join(
+            self.tmpdir.name, 'telemetry-a.txt')])
+        self.assertEqual((rec_a['state'], rec_a['ncores']), ('COMPLETED', 2))
+        for key in ['queue_wait', 'wall', 'cpu', 'maxrss']:
+            self.assertGreaterEqual(rec_a[key], 0)
+        self.assertEqual((rec_b['state'], rec_b['status']), ('FAILED', 2))
+        self.assertEqual(os.listdir(self.workdir), [])
+
+    def test_filename(self):
+        env = slurm.SlurmEnvironment(telemetry=self.filename)
+        self.assertEqual(env.telemetry.filename, self.filename)
+        self.assertEqual(env.telemetry.workdir, '.bioscons')
+        self.assertIsNone(slurm.SlurmEnvironment(telemetry=True)
+                          .telemetry.filename)
+
+    def test_report(self):
+        records = {}
+        for i, (wall, cpu, ncores) in enumerate(
+                [(10, 38, 4), (100, 100, 8), (5, 5, 1), (0.1, 0, 1)]):
+            records[str(i)] = {
+                'target': [str(i)], 'wall': wall, 'cpu': cpu,
+                'ncores': ncores, 'queue_wait': 1, 'maxrss': 10,
+                'state': 'COMPLETED'}
+        out = io.StringIO()
+        telemetry.report(records, n=2, out=out)
+        slowest, efficiency = out.getvalue().split('\n\n')
+        self.assertEqual([line.split()[-1] for line in
+                          slowest.splitlines()[2:]], ['1', '0'])
+        self.assertEqual([line.split()[-2:] for line in
+                          efficiency.splitlines()[2:]],
+                         [['1', '[1]'], ['0', '[4]']])
@@ -0,0 +1,88 @@
+import io
+import logging
+import unittest
+
+from bioscons import utils
+
+
+@utils.verbose
+def add(x, y=1):
+    return x + y
+
+
+@utils.verbose(sample=0.5)
+def double(x):
+    return 2 * x
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.n = 0
+
+    @utils.verbose
+    def increment(self, by=1):
+        self.n += by
+        return self.n
+
+
+class TestVerbose(unittest.TestCase):
+
+    def setUp(self):
+        for f in [add, double, Counter.increment]:
+            f.trace.calls, f.trace.seconds = 0, 0.0
+
+    def tearDown(self):
+        utils.disable_tracing()
+
+    def test_disabled(self):
+        self.assertEqual(add(1, y=2), 3)
+        self.assertEqual(add.trace.calls, 0)
+        self.assertEqual(add.__name__, 'add')
+
+    def test_buffer(self):
+        utils.enable_tracing(buffer_size=5, logger=None)
+        for i in range(10):
+            self.assertEqual(add(i), i + 1)
+        self.assertEqual(add.trace.calls, 10)
+        self.assertGreater(add.trace.seconds, 0)
+
+        records = utils.trace_records()
+        self.assertEqual(len(records), 5)
+        self.assertEqual([r.args for r in records],
+                         [(i,) for i in range(5, 10)])
+        self.assertEqual(records[0].name, 'add')
+
+    def test_sample(self):
+        utils.enable_tracing(sample=0.25, buffer_size=100, logger=None)
+        for i in range(8):
+            add(i)
+            double(i)
+        records = utils.trace_records()
+        self.assertEqual([r.args for r in records if r.name == 'add'],
+                         [(0,), (4,)])
+        self.assertEqual(len([r for r in records if r.name == 'double']), 4)
+        self.assertRaises(ValueError, utils.enable_tracing, 0)
+
+    def test_logger(self):
+        logger = logging.getLogger('bioscons.test_utils')
+        with self.assertLogs(logger, logging.DEBUG) as logs:
+            utils.enable_tracing(logger=logger)
+            add(1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('add', logs.output[0])
+
+    def test_method(self):
+        utils.enable_tracing(buffer_size=10, logger=None)
+        counter = Counter()
+        self.assertEqual(counter.increment(by=2), 2)
+        self.assertEqual(Counter.increment.trace.calls, 1)
+        rec, = utils.trace_records()
+        self.assertEqual(rec.kwargs, {'by': 2})
+
+    def test_summary(self):
+        utils.enable_tracing(logger=None)
+        add(1)
+        out = io.StringIO()
+        utils.trace_summary(out)
+        self.assertIn('add', out.getvalue())